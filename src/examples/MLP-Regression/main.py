@@ -1,4 +1,5 @@
 import copy
+import os
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -17,7 +18,10 @@ import prov4ml.prov4ml as prov4ml
 https://machinelearningmastery.com/building-a-regression-model-in-pytorch/
 """
 mlflow.set_experiment("MLP-Regression")
-with prov4ml.start_run(prov_user_namespace="www.example.org",run_name="run"):
+#the best epoch of MSE_eval is tracked while training, and linked to its checkpoint and to the registered model
+#the outputs of each run, its document and its checkpoints, are written to its own directory
+with prov4ml.start_run(prov_user_namespace="www.example.org",run_name="run",objectives={"MSE_eval":"min"},output_dir="runs/{run_id}") as run:
+    output_dir = os.path.join("runs", run.info.run_id)
     # Read data
     data = fetch_california_housing()
     X, y = data.data, data.target
@@ -103,9 +107,14 @@ with prov4ml.start_run(prov_user_namespace="www.example.org",run_name="run"):
         if mse < best_mse:
             best_mse = mse
             best_weights = copy.deepcopy(model.state_dict())
+            checkpoint = os.path.join(output_dir, f"checkpoint_{epoch}.pt")
+            torch.save(best_weights, checkpoint)
+            prov4ml.log_checkpoint(checkpoint, step=epoch)
 
     # restore model and return best accuracy
     model.load_state_dict(best_weights)
+    best_mse, best_epoch = prov4ml.best_metrics()["MSE_eval"]
+    print("Best epoch: %d" % best_epoch)
     print("MSE: %.2f" % best_mse)
     print("RMSE: %.2f" % np.sqrt(best_mse))
 
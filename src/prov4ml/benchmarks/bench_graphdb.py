@@ -0,0 +1,62 @@
+"""Exporting the document of a long run to graph database import files, compared with loading it with prov.model.
+
+The document is written once, then each kind of reader runs in its own process, so that their peak memory is
+measured separately: prov, ProvDocument.deserialize, and prov4ml.graphdb.export_graph to each of its formats.
+
+Run from src/prov4ml: python -m benchmarks.bench_graphdb [--steps N]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import metric_document
+
+KINDS = ('prov', 'csv', 'jsonl')
+
+def read(kind:str, path:str) -> str:
+    """
+    Loads the document with prov.model, or exports it with export_graph to a directory next to it.
+
+    Returns:
+        str: The time taken, the growth of the peak memory of the process and what was read.
+    """
+    import prov.model as prov
+    from prov4ml.graphdb import export_graph
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if kind == 'prov':
+        with open(path) as document:
+            result = f'{len(prov.ProvDocument.deserialize(document).records)} records'
+    else:
+        nodes, relationships = export_graph([path], os.path.join(os.path.dirname(path), kind), kind)
+        result = f'{nodes} nodes, {relationships} relationships'
+    elapsed = time.perf_counter() - start
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024
+    return f'{elapsed:.1f} s, peak RSS +{peak:.0f} MB, {result}'
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--steps', type=int, default=100000)
+    parser.add_argument('--kind', choices=KINDS, help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.kind is not None:
+        print(read(args.kind, args.path))
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'prov_graph.json')
+        with open(path, 'w') as document:
+            metric_document(args.steps).serialize(document)
+        print(f'document: {args.steps} steps, {os.path.getsize(path) / 2 ** 20:.0f} MB')
+        for kind in KINDS:
+            result = subprocess.run([sys.executable, '-m', 'benchmarks.bench_graphdb', '--kind', kind, '--path', path],
+                                    capture_output=True, text=True, check=True).stdout.strip()
+            print(f'{kind}: {result}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""Import time of prov4ml.prov4ml, against that of the dependencies it imports lazily.
+
+Each import is timed in a fresh interpreter with python -X importtime, best of --repeat runs.
+
+Run from src/prov4ml: python -m benchmarks.bench_import [--repeat N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ('prov4ml.prov4ml', 'mlflow', 'prov.model', 'prov.dot')
+
+def import_time(module:str) -> float:
+    """
+    Returns the cumulative import time of a module in seconds, as reported by python -X importtime.
+    """
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=PACKAGE_DIR, capture_output=True, text=True, check=True).stderr
+    #lines are "import time: {self} | {cumulative} | {indented name}", the module itself is the last one at depth 0
+    for line in reversed(stderr.splitlines()):
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module and not fields[2][1:].startswith(' ' * 2):
+            return int(fields[1]) / 1e6
+    raise RuntimeError(f'No import time reported for {module}')
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for module in MODULES:
+        print(f'{module}: {min(import_time(module) for _ in range(args.repeat)) * 1000:.1f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""Index build and lookup times of prov4ml.query.ProvIndex on a synthetic document.
+
+Run from src/prov4ml: python -m benchmarks.bench_query [--steps N]
+"""
+import argparse
+import json
+import time
+
+from prov4ml.query import ProvIndex
+
+from benchmarks.synthetic import metric_document
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--steps', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    document = json.loads(metric_document(args.steps).serialize())
+
+    start = time.perf_counter()
+    index = ProvIndex(document)
+    built = time.perf_counter()
+    index.find(attributes={'mlflow:step': 0})
+    first_find = time.perf_counter()
+    for step in range(args.lookups):
+        index.find(attributes={'mlflow:step': step})
+    finds = time.perf_counter()
+    for step in range(args.lookups):
+        index.upstream(f'loss_{step}')
+    traversals = time.perf_counter()
+
+    print(f'{len(index)} records and relations')
+    print(f'build {built - start:.3f} s')
+    print(f'first find (builds the attribute index) {first_find - built:.3f} s')
+    print(f'find {(finds - first_find) / args.lookups * 1e6:.1f} us per lookup')
+    print(f'upstream {(traversals - finds) / args.lookups * 1e6:.1f} us per traversal')
+
+if __name__ == '__main__':
+    main()
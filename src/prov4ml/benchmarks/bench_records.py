@@ -0,0 +1,69 @@
+"""Building and serializing the document of a long run with prov.model and with prov4ml.records.RecordStore.
+
+Each kind of document is built in its own process, so that their peak memory is measured separately.
+
+Run from src/prov4ml: python -m benchmarks.bench_records [--steps N]
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+from benchmarks.synthetic import fake_run, metric_history
+
+KINDS = ('prov', 'records')
+
+def build(kind:str, steps:int) -> str:
+    """
+    Builds the first two levels of the document of a run logging two metrics at every step, and serializes it.
+
+    Returns:
+        str: The build time, the serialization time and the growth of the peak memory of the process.
+    """
+    import prov4ml.prov4ml as prov4ml
+    from prov4ml.contexts import ContextIndex
+    from prov4ml.records import RecordStore
+    from prov4ml.snapshot import RunSnapshot
+
+    contexts = {'loss': 'TRAINING', 'acc': 'EVALUATION'}
+    run = fake_run(contexts)
+    snapshot = RunSnapshot(run, SimpleNamespace(name='experiment'), [], {}, metric_history(list(contexts), steps), [])
+    index = ContextIndex()
+    for key, history in snapshot.metric_histories.items():
+        index.add_points(history, [contexts[key]] * len(history))
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if kind == 'prov':
+        import prov.model as prov
+        document = prov.ProvDocument()
+    else:
+        document = RecordStore()
+    document.set_default_namespace('www.example.org')
+    document.add_namespace('mlflow', 'mlflow')
+    document.add_namespace('prov-ml', 'prov-ml')
+    prov4ml.first_level_prov(run, document, None, snapshot, contexts=index)
+    prov4ml.second_level_prov(run, document, None, None, 1, snapshot, index)
+    built = time.perf_counter()
+    serialized = document.serialize()
+    done = time.perf_counter()
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024
+    return f'build {built - start:.1f} s, serialize {done - built:.1f} s, peak RSS +{peak:.0f} MB, {len(serialized)} characters'
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--steps', type=int, default=50000)
+    parser.add_argument('--kind', choices=KINDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.kind is not None:
+        print(build(args.kind, args.steps))
+        return
+    for kind in KINDS:
+        result = subprocess.run([sys.executable, '-m', 'benchmarks.bench_records', '--steps', str(args.steps), '--kind', kind],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        print(f'{kind}: {result}')
+
+if __name__ == '__main__':
+    main()
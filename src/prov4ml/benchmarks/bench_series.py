@@ -0,0 +1,38 @@
+"""Logging a metric series with log_metric_series against a loop of log_metric calls, on a local file store.
+
+Run from src/prov4ml: python -m benchmarks.bench_series [--points N] [--loop-points N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--points', type=int, default=2500)
+    parser.add_argument('--loop-points', type=int, default=300)
+    args = parser.parse_args()
+
+    os.environ.setdefault('MLFLOW_ALLOW_FILE_STORE', 'true')
+    import mlflow
+    import numpy as np
+    import prov4ml.prov4ml as prov4ml
+
+    with tempfile.TemporaryDirectory() as directory:
+        mlflow.set_tracking_uri(f'file://{directory}/mlruns')
+        values = np.random.rand(max(args.points, args.loop_points)).astype(np.float32)
+        with mlflow.start_run():
+            start = time.perf_counter()
+            prov4ml.log_metric_series('series', values[:args.points], context=prov4ml.Context.TRAINING)
+            series = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for step in range(args.loop_points):
+                prov4ml.log_metric('loop', float(values[step]), prov4ml.Context.TRAINING, step=step)
+            loop = time.perf_counter() - start
+
+    print(f'log_metric_series: {args.points} points in {series:.2f} s ({series / args.points * 1e6:.0f} us per point)')
+    print(f'log_metric loop: {args.loop_points} points in {loop:.2f} s ({loop / args.loop_points * 1e6:.0f} us per point)')
+
+if __name__ == '__main__':
+    main()
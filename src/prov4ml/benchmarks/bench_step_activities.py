@@ -0,0 +1,59 @@
+"""Document size and finalization time of a long run for several step activity hierarchies, on a local file store.
+
+A run logs one training and one evaluation metric per step. It is finalized with one activity per step,
+with epochs split into step buckets, and with epochs only.
+
+Run from src/prov4ml: python -m benchmarks.bench_step_activities [--steps N] [--steps-per-epoch N] [--bucket-size N]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+def finalize(steps:int, steps_per_epoch, step_bucket_size) -> tuple:
+    """
+    Logs a run of the given number of steps and returns the number of records of its document and the time
+    start_run took to write it after the body of the run.
+    """
+    import numpy as np
+    import prov4ml.prov4ml as prov4ml
+
+    with prov4ml.start_run(prov_user_namespace='www.example.org', run_name='run', steps_per_epoch=steps_per_epoch,
+                           step_bucket_size=step_bucket_size, output_dir='.'):
+        prov4ml.log_metric_series('loss', np.random.rand(steps), context=prov4ml.Context.TRAINING)
+        prov4ml.log_metric_series('acc', np.random.rand(steps), context=prov4ml.Context.EVALUATION)
+        start = time.perf_counter()
+    elapsed = time.perf_counter() - start
+    with open('prov_graph.json') as document:
+        records = sum(len(section) for kind, section in json.load(document).items() if kind != 'prefix')
+    return records, elapsed
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--steps-per-epoch', type=int, default=100)
+    parser.add_argument('--bucket-size', type=int, default=25)
+    args = parser.parse_args()
+
+    os.environ.setdefault('MLFLOW_ALLOW_FILE_STORE', 'true')
+    import mlflow
+
+    configurations = {
+        'one activity per step': (None, 1),
+        f'epochs of {args.steps_per_epoch}, buckets of {args.bucket_size}': (args.steps_per_epoch, args.bucket_size),
+        f'epochs of {args.steps_per_epoch} only': (args.steps_per_epoch, None),
+    }
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            mlflow.set_tracking_uri(f'file://{directory}/mlruns')
+            for name, (steps_per_epoch, step_bucket_size) in configurations.items():
+                records, elapsed = finalize(args.steps, steps_per_epoch, step_bucket_size)
+                print(f'{name}: {records} records, finalization {elapsed:.2f} s')
+        finally:
+            os.chdir(cwd)
+
+if __name__ == '__main__':
+    main()
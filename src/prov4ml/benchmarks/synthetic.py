@@ -0,0 +1,63 @@
+"""Synthetic inputs shared by the benchmarks: MLflow-like runs and the PROV-JSON documents prov4ml writes for them."""
+from types import SimpleNamespace
+from typing import Dict, List
+
+from prov4ml.records import RecordStore
+
+def metric_history(keys:List[str], steps:int) -> Dict[str, list]:
+    """
+    Returns the metric histories of a run that logged every key once per step.
+
+    Args:
+        keys (List[str]): The metric keys.
+        steps (int): The number of steps.
+
+    Returns:
+        Dict[str, list]: The mlflow.entities.Metric history of each key, in log order.
+    """
+    from mlflow.entities import Metric
+    return {key: [Metric(key, 0.5 + step * 1e-6, 1700000000000 + step, step) for step in range(steps)] for key in keys}
+
+def fake_run(contexts:Dict[str, str]):
+    """
+    Returns an object with the attributes of an mlflow.entities.Run that the document builders read.
+
+    Args:
+        contexts (Dict[str, str]): The context name of each metric key, e.g. {'loss': 'TRAINING'}.
+    """
+    info = SimpleNamespace(run_name='run', run_id='r0', artifact_uri='artifacts', user_id='user', experiment_id='1',
+                           status='FINISHED', lifecycle_stage='active')
+    tags = {f'metric.context.{key}': context for key, context in contexts.items()}
+    tags.update({'mlflow.source.name': 'benchmark', 'mlflow.source.type': 'LOCAL'})
+    data = SimpleNamespace(params={'lr': '0.1'}, tags=tags, metrics={})
+    return SimpleNamespace(info=info, data=data, inputs=SimpleNamespace(dataset_inputs=[]))
+
+def metric_document(steps:int, run_id:str='r0') -> RecordStore:
+    """
+    Returns a document with the shape of a long run: a LearningStage entity and, for every step,
+    a loss entity generated by the run and by its step activity.
+
+    Args:
+        steps (int): The number of steps.
+        run_id (str): The run ID of the LearningStage entity. Defaults to 'r0'.
+
+    Returns:
+        RecordStore: The document, with about 3 records per step.
+    """
+    document = RecordStore()
+    document.set_default_namespace('www.example.org')
+    document.add_namespace('mlflow', 'mlflow')
+    document.add_namespace('prov-ml', 'prov-ml')
+    document.entity('run', {'mlflow:run_id': f"lv_attr(level='1', value='{run_id}')",
+                            'prov-ml:type': "lv_attr(level='1', value='LearningStage')", 'prov:level': '1'})
+    document.activity('run_execution', {'prov:level': '1'})
+    for step in range(steps):
+        entity = document.entity(f'loss_{step}', {
+            'prov-ml:type': 'ModelEvaluation',
+            'mlflow:value': f"lv_attr(level='1', value={step / 3})",
+            'mlflow:step': f"lv_attr(level='1', value={step})",
+            'prov:level': '1',
+        })
+        document.wasGeneratedBy(entity, 'run_execution', identifier=f'loss_{step}_gen', other_attributes={'prov:level': '1'})
+        document.wasGeneratedBy(entity, f'train_step_{step}', other_attributes={'prov:level': '2'})
+    return document
@@ -0,0 +1,205 @@
+"""asyncio API of prov4ml, for training code driven by an event loop.
+
+The MLflow client is blocking, so every call to the tracking server runs in a worker thread through
+asyncio.to_thread, and the lookups issued when the run ends are overlapped with asyncio.gather, at most
+max_concurrency at a time. The fluent MLflow run is bound to the thread that started it, so the run is
+started and ended in the thread of the event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple, Union, TYPE_CHECKING
+
+from .prov4ml import Context, _abort_run, _begin_run, _context_tags, _end_run, _journal, _load_prov_state, _metric_batch, _run_states, _write_provenance
+from .sampling import MetricPolicy
+from .snapshot import RunSnapshot, get_experiment, get_registered_model, stale_metric_keys
+
+if TYPE_CHECKING:
+    import mlflow
+    from mlflow import ActiveRun
+    from mlflow.entities.file_info import FileInfo
+
+
+class _Limiter:
+    #runs blocking calls in worker threads, at most max_concurrency at a time
+    def __init__(self, max_concurrency:int):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def __call__(self, function:Callable, *args) -> Any:
+        async with self._semaphore:
+            return await asyncio.to_thread(function, *args)
+
+
+async def _traverse_artifact_tree(call:_Limiter, client:mlflow.MlflowClient, run_id:str, path:Optional[str]=None) -> List[FileInfo]:
+    #same order as snapshot.traverse_artifact_tree, with the directories of each level listed concurrently
+    artifact_list = await call(client.list_artifacts, run_id, path)
+    subtrees = iter(await asyncio.gather(*(_traverse_artifact_tree(call, client, run_id, artifact.path)
+                                           for artifact in artifact_list if artifact.is_dir)))
+    artifact_paths = []
+    for artifact in artifact_list:
+        if artifact.is_dir:
+            artifact_paths.extend(next(subtrees))
+        else:
+            artifact_paths.append(artifact)
+    return artifact_paths
+
+async def agather_snapshot(client:mlflow.MlflowClient, run_id:str, experiment_id:Optional[str]=None,
+                           metric_counts:Optional[Dict[str,int]]=None, logged_keys:Optional[Iterable[str]]=None,
+                           max_concurrency:int=8) -> RunSnapshot:
+    """
+    Awaitable counterpart of RunSnapshot.gather.
+
+    Args:
+        client (mlflow.MlflowClient): The MLflow client object.
+        run_id (str): The ID of the run.
+        experiment_id (Optional[str]): The ID of the experiment of the run, if known. Defaults to None.
+        metric_counts (Optional[Dict[str, int]]): The number of points of each metric already in the document.
+            Defaults to None, no document.
+        logged_keys (Optional[Iterable[str]]): The keys logged since the document was generated. Defaults to None,
+            every key is fetched.
+        max_concurrency (int): The maximum number of concurrent requests. Defaults to 8.
+
+    Returns:
+        RunSnapshot: The snapshot.
+    """
+    call = _Limiter(max_concurrency)
+
+    async def run_and_experiment() -> Tuple[Any, Any]:
+        if experiment_id is None:
+            run = await call(client.get_run, run_id)
+            return run, await call(get_experiment, client, run.info.experiment_id)
+        run, experiment = await asyncio.gather(call(client.get_run, run_id), call(get_experiment, client, experiment_id))
+        if run.info.experiment_id != experiment_id:
+            experiment = await call(get_experiment, client, run.info.experiment_id)
+        return run, experiment
+
+    async def metric_histories(run) -> Dict[str, List[Any]]:
+        keys = stale_metric_keys(run, metric_counts, logged_keys)
+        histories = await asyncio.gather(*(call(client.get_metric_history, run_id, key) for key in keys))
+        return dict(zip(keys, histories))
+
+    async def model_versions() -> Tuple[List[Any], Dict[str, Any]]:
+        versions = list(await call(client.search_model_versions, f'run_id="{run_id}"'))
+        names = sorted({version.name for version in versions})
+        models = await asyncio.gather(*(call(get_registered_model, client, name) for name in names))
+        return versions, dict(zip(names, models))
+
+    async def run_data() -> Tuple[Any, Any, Dict[str, List[Any]]]:
+        run, experiment = await run_and_experiment()
+        return run, experiment, await metric_histories(run)
+
+    (run, experiment, histories), (versions, models), artifacts = await asyncio.gather(
+        run_data(), model_versions(), _traverse_artifact_tree(call, client, run_id))
+    return RunSnapshot(run, experiment, versions, models, histories, artifacts, metric_counts)
+
+@asynccontextmanager
+async def astart_run(
+    prov_user_namespace: str,
+    run_id: Optional[str] = None,
+    experiment_id: Optional[str] = None,
+    run_name: Optional[str] = None,
+    nested: bool = False,
+    tags: Optional[Dict[str, Any]] = None,
+    description: Optional[str] = None,
+    log_system_metrics: Optional[bool] = None,
+    prov_store: Optional[str] = None,
+    steps_per_epoch: Optional[int] = None,
+    step_bucket_size: Optional[int] = 1,
+    journal: bool = False,
+    metric_policies: Optional[Dict[str, MetricPolicy]] = None,
+    objectives: Optional[Dict[str, str]] = None,
+    validation: Optional[str] = 'lenient',
+    export_formats: Tuple[str, ...] = ('dot',),
+    output_dir: str = '.',
+    upload_artifacts: bool = False,
+    batch_metrics: bool = False,
+    checksums: Union[bool, str] = False,
+    events: Optional[Union[str, Callable[[List[Dict[str, Any]]], None]]] = None,
+    max_concurrency: int = 8,
+) -> AsyncIterator[ActiveRun]:
+    """
+    Async counterpart of start_run, used with ``async with``.
+
+    When the block exits, the pending metrics are written, the MLflow lookups needed by the provenance document are
+    issued concurrently and the document is built and written in a worker thread, without blocking the event loop.
+
+    Args:
+        prov_user_namespace (str): The user namespace for provenance tracking.
+        run_id, experiment_id, run_name, nested, tags, description, log_system_metrics: As in start_run.
+        prov_store, steps_per_epoch, step_bucket_size, journal, metric_policies, objectives, validation,
+            export_formats, output_dir, upload_artifacts, batch_metrics, checksums, events: As in start_run.
+        max_concurrency (int): The maximum number of concurrent requests to the tracking server when the run ends. Defaults to 8.
+
+    Returns:
+        ActiveRun: The active run object.
+    """
+    import mlflow
+
+    active_run = _begin_run(prov_user_namespace,run_id,experiment_id,run_name,nested,tags,description,log_system_metrics,
+                            prov_store=prov_store,steps_per_epoch=steps_per_epoch,step_bucket_size=step_bucket_size,
+                            journal=journal,metric_policies=metric_policies,objectives=objectives,validation=validation,export_formats=export_formats,
+                            output_dir=output_dir,upload_artifacts=upload_artifacts,batch_metrics=batch_metrics,checksums=checksums,events=events)
+    try:
+        yield active_run
+    except BaseException:
+        _abort_run(active_run)    #in this thread, where the run is active
+        raise
+
+    run_state = _run_states[active_run.info.run_id]
+    try:
+        await asyncio.to_thread(run_state.close)
+    except BaseException:
+        _abort_run(active_run)
+        raise
+    del _run_states[active_run.info.run_id]
+    _end_run()
+
+    prov_state = _load_prov_state(run_state)
+    snapshot = await agather_snapshot(mlflow.MlflowClient(),run_state.run_id,experiment_id=active_run.info.experiment_id,
+                                      metric_counts=prov_state.metric_counts if prov_state is not None else None,
+                                      logged_keys=run_state.contexts.keys,
+                                      max_concurrency=max_concurrency)
+    await asyncio.to_thread(_write_provenance,run_state,snapshot,prov_state)
+
+async def _write_batch(batch:Optional[Tuple[str,List[Any],List[str]]]) -> None:
+    import mlflow
+    from .batching import iter_batches
+
+    if batch is None:
+        return
+    run_id,metrics_arr,context_arr = batch
+    client = mlflow.MlflowClient()
+    start = 0
+    for batch_metrics,_ in iter_batches(metrics_arr):
+        batch_contexts = context_arr[start:start+len(batch_metrics)]
+        tags = await asyncio.to_thread(_context_tags,client,run_id,batch_metrics,batch_contexts)
+        await asyncio.to_thread(client.log_batch,run_id,metrics=batch_metrics,tags=tags)
+        _journal(run_id,batch_metrics,batch_contexts)
+        start += len(batch_metrics)
+
+async def alog_metrics(metrics:Dict[str,Tuple[float,Context]], step:Optional[int]=None) -> None:
+    """
+    Awaitable counterpart of log_metrics. Tensor values are buffered as in log_metrics.
+
+    Args:
+        metrics (Dict[str, Tuple[float, Context]]): The metrics to log, with their contexts.
+        step (Optional[int]): The step of the metrics. Defaults to None.
+    """
+    batch = _metric_batch(metrics,step)    #resolves the active run in the thread of the event loop
+    await _write_batch(batch)
+
+async def alog_metric(key:str, value:float, context:Context, step:Optional[int]=None, timestamp:Optional[int]=None) -> None:
+    """
+    Awaitable counterpart of log_metric. The metric is written in a single request, with the context index of the
+    run when it wasn't started with start_run.
+
+    Args:
+        key (str): The key of the metric.
+        value (float): The value of the metric, or a single-element tensor.
+        context (Context): The context of the metric.
+        step (Optional[int]): The step of the metric. Defaults to None.
+        timestamp (Optional[int]): The timestamp of the metric, in milliseconds. Defaults to None, the current time.
+    """
+    batch = _metric_batch({key:(value,context)},step,timestamp)
+    await _write_batch(batch)
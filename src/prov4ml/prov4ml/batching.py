@@ -0,0 +1,29 @@
+"""Splitting of metric and tag writes into log_batch requests within the MLflow limits."""
+from typing import Iterator, List, Sequence, Tuple, TypeVar
+
+#MLflow rejects log_batch requests with more than 1000 metrics, 100 tags or 1000 entities overall
+MAX_METRICS_PER_BATCH = 1000
+MAX_TAGS_PER_BATCH = 100
+MAX_ENTITIES_PER_BATCH = 1000
+
+M = TypeVar('M')
+T = TypeVar('T')
+
+def iter_batches(metrics:Sequence[M], tags:Sequence[T]=()) -> Iterator[Tuple[List[M], List[T]]]:
+    """
+    Splits metrics and tags into the fewest log_batch payloads MLflow accepts, tags first.
+
+    Args:
+        metrics (Sequence[M]): The metrics to log.
+        tags (Sequence[T]): The tags to log. Defaults to ().
+
+    Yields:
+        Tuple[List[M], List[T]]: The metrics and tags of each payload.
+    """
+    m, t = 0, 0
+    while m < len(metrics) or t < len(tags):
+        batch_tags = list(tags[t:t + MAX_TAGS_PER_BATCH])
+        batch_metrics = list(metrics[m:m + min(MAX_METRICS_PER_BATCH, MAX_ENTITIES_PER_BATCH - len(batch_tags))])
+        t += len(batch_tags)
+        m += len(batch_metrics)
+        yield batch_metrics, batch_tags
@@ -0,0 +1,83 @@
+"""Streaming tracking of the best point of the metrics with an objective.
+
+The objectives are given per metric key (or fnmatch pattern) to start_run, as 'min' or 'max'. Every point written
+to MLflow is compared with the best one of its key as it is written, in constant time and memory, so the best step
+of a metric is known when the run ends without reading its history back from the tracking server. It is recorded
+as the ``metric.best.{key}`` tag of the run and as a BestEvaluation entity of its document.
+"""
+import json
+import math
+import threading
+from fnmatch import fnmatchcase
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+OBJECTIVES = ('min', 'max')
+
+#the best point of a key: value, step, timestamp
+BestPoint = Tuple[float, int, int]
+
+class BestTracker:
+    """Running best point of each metric key with an objective.
+
+    Args:
+        objectives (Dict[str, str]): The objective, min or max, of each key, or of the keys matching an fnmatch
+            pattern. Exact keys take precedence over patterns; keys matching no entry aren't tracked.
+
+    Attributes:
+        best (Dict[str, Tuple[float, int, int]]): The value, step and timestamp of the best point of each key.
+            Ties keep the earliest point.
+    """
+    def __init__(self, objectives:Dict[str, str]):
+        unknown = {key: objective for key, objective in objectives.items() if objective not in OBJECTIVES}
+        if unknown:
+            raise ValueError(f'Unknown objectives {unknown}, the objectives are {OBJECTIVES}')
+        self.objectives = objectives
+        self.best: Dict[str, BestPoint] = {}
+        self._objectives: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()    #points are written by the run and by the thread draining its channel
+
+    def objective(self, key:str) -> Optional[str]:
+        """
+        Returns the objective of a key, None if it isn't tracked.
+        """
+        if key not in self._objectives:
+            objective = self.objectives.get(key)
+            if objective is None:
+                objective = next((objective for pattern, objective in self.objectives.items() if fnmatchcase(key, pattern)), None)
+            self._objectives[key] = objective
+        return self._objectives[key]
+
+    def add(self, key:str, value:float, step:int, timestamp:int) -> None:
+        """
+        Compares a written point with the best point of its key.
+        """
+        objective = self.objective(key)
+        if objective is None or math.isnan(value):
+            return
+        best = self.best.get(key)
+        if best is None or (value < best[0] if objective == 'min' else value > best[0]):
+            self.best[key] = value, step, timestamp
+
+    def append_metrics(self, metrics:Iterable[Any]) -> None:
+        """
+        Compares a batch of metrics, as written to MLflow with log_batch, with the best points.
+        """
+        with self._lock:
+            for metric in metrics:
+                self.add(metric.key, metric.value, metric.step, metric.timestamp)
+
+    def restore(self, tags:Dict[str, str]) -> None:
+        """
+        Restores the best points recorded in the tags of a run, e.g. when it is resumed.
+        """
+        for tag, value in tags.items():
+            if tag.startswith('metric.best.'):
+                point = json.loads(value)
+                self.add(tag[len('metric.best.'):], point['value'], point['step'], point['timestamp'])
+
+    def tags(self) -> Dict[str, str]:
+        """
+        Returns the metric.best.{key} tags recording the best points.
+        """
+        return {f'metric.best.{key}': json.dumps({'objective': self.objective(key), 'value': value, 'step': step, 'timestamp': timestamp})
+                for key, (value, step, timestamp) in sorted(self.best.items())}
@@ -0,0 +1,122 @@
+"""Buffering of metric values that are still tensors on their device.
+
+Converting a tensor to a Python float (``.item()``, ``float()``) waits for the device to finish the computation,
+so doing it on every logged step stalls the training loop. The buffer keeps references to the logged tensors and
+materializes them together at flush time, with one stacked transfer per device.
+"""
+from functools import reduce
+from typing import Any, Dict, List, Optional, Tuple
+
+from .batching import MAX_METRICS_PER_BATCH, iter_batches
+
+def is_tensor(value:Any) -> bool:
+    """
+    Returns whether a value is a single-element tensor, without importing torch.
+    """
+    return hasattr(value, 'detach') and hasattr(value, 'numel') and value.numel() == 1
+
+def materialize(tensors:List[Any]) -> List[float]:
+    """
+    Converts single-element tensors to floats with one stacked device-to-host transfer per device.
+
+    Args:
+        tensors (List[Any]): The tensors.
+
+    Returns:
+        List[float]: Their values, in the same order.
+    """
+    import torch
+
+    by_device: Dict[Any, List[int]] = {}
+    for i, tensor in enumerate(tensors):
+        by_device.setdefault(tensor.device, []).append(i)
+    values: List[float] = [0.0] * len(tensors)
+    for positions in by_device.values():
+        dtype = reduce(torch.promote_types, (tensors[i].dtype for i in positions))
+        stacked = torch.stack([tensors[i].detach().reshape(()).to(dtype) for i in positions])
+        MetricBuffer.materializations += 1
+        for i, value in zip(positions, stacked.cpu().tolist()):
+            values[i] = float(value)
+    return values
+
+
+class MetricBuffer:
+    """Metric points of a run whose values are tensors, waiting to be materialized and written.
+
+    Attributes:
+        materializations (int): The number of device-to-host transfers done by all buffers, for inspection.
+        journal (Optional[Any]): The journal, or the state of the run, the written points are also appended to with
+            append_metrics, if any.
+
+    Args:
+        run_id (Optional[str]): The ID of the run the metrics are logged to. A buffer can be given to another run once
+            it is flushed, e.g. by the trials run one after another by a sweep worker.
+        capacity (int): The number of points after which the buffer is flushed by add. Defaults to 1000.
+    """
+    materializations = 0
+
+    def __init__(self, run_id:Optional[str], capacity:int=MAX_METRICS_PER_BATCH):
+        self.run_id = run_id
+        self.capacity = capacity
+        self._points: List[Tuple[str, Any, int, int, str]] = []
+        self._client = None    #created by the first flush and kept by the next ones
+        self.journal = None
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def add(self, key:str, value:Any, step:int, timestamp:int, context:str) -> None:
+        """
+        Adds a metric point, flushing the buffer if it is full.
+
+        A tensor value is stored as a detached copy, made on its device without synchronization: the caller may
+        update the tensor in place before the flush, and its autograd graph is not kept alive.
+
+        Args:
+            key (str): The key of the metric.
+            value (Any): The value, a tensor or a number.
+            step (int): The step of the metric.
+            timestamp (int): The timestamp of the metric, in milliseconds.
+            context (str): The name of the Context of the metric.
+        """
+        if is_tensor(value):
+            value = value.detach().clone()
+        self._points.append((key, value, step, timestamp, context))
+        if len(self._points) >= self.capacity:
+            self.flush()
+
+    def flush(self, synchronous:bool=True) -> Optional[Any]:
+        """
+        Materializes the buffered values and writes them to MLflow. Their contexts are passed to the journal.
+
+        Args:
+            synchronous (bool): Whether to write synchronously. Defaults to True.
+
+        Returns:
+            Optional[RunOperations]: The run operations object, None if there was nothing to write or it was written synchronously.
+        """
+        if not self._points:
+            return None
+        import mlflow
+        from mlflow.entities import Metric
+        from mlflow.utils.async_logging.run_operations import get_combined_run_operations
+
+        points, self._points = self._points, []
+        tensor_positions = [i for i, point in enumerate(points) if is_tensor(point[1])]
+        values = [point[1] for point in points]
+        for i, value in zip(tensor_positions, materialize([values[i] for i in tensor_positions])):
+            values[i] = value
+
+        metrics = [Metric(key, value, timestamp, step) for (key, _, step, timestamp, _), value in zip(points, values)]
+        contexts = [point[4] for point in points]
+        if self._client is None:
+            self._client = mlflow.MlflowClient()
+        client = self._client
+        operations = []
+        start = 0
+        for batch_metrics, _ in iter_batches(metrics):
+            operations.append(client.log_batch(self.run_id, metrics=batch_metrics, synchronous=synchronous))
+            if self.journal is not None:
+                self.journal.append_metrics(batch_metrics, contexts[start:start + len(batch_metrics)])
+            start += len(batch_metrics)
+        return get_combined_run_operations(operations)
@@ -0,0 +1,141 @@
+"""Metric logging from DataLoader workers and other subprocesses of a run.
+
+A MetricChannel wraps a multiprocessing queue. Worker processes put plain (key, value, step, timestamp) tuples on it,
+without importing mlflow, and a thread of the process that started the run drains it into batched MLflow writes.
+A write that fails is logged and retried at the next flush, with the metrics kept in the meantime; if the last
+attempt, when the channel is closed, fails too, close raises, so that the run doesn't end as if nothing was lost.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .batching import MAX_METRICS_PER_BATCH, iter_batches
+
+_CLOSE = None
+
+_logger = logging.getLogger(__name__)
+
+class MetricChannel:
+    """Multiprocessing-safe channel for logging metrics into the active run from other processes.
+
+    The channel is created by the process that started the run, through prov4ml.metric_channel(), and must reach
+    the workers as an argument of their creation (e.g. as an attribute of the Dataset of a DataLoader, or an argument
+    of multiprocessing.Process), as multiprocessing queues can't be sent through other queues or pipes.
+    Metrics logged through the channel are attached to the data_preparation activity of the provenance document.
+
+    Args:
+        run_id (str): The ID of the run the metrics are logged to.
+        context (str): The name of the Context the metrics are logged with.
+        flush_interval (float): The maximum time, in seconds, a metric waits before being written. Defaults to 1.0.
+        multiprocessing_context (Optional[str]): The start method of the worker processes (fork, spawn or forkserver),
+            which the queue must be created with. Defaults to None, the default start method.
+    """
+    def __init__(self, run_id:str, context:str, flush_interval:float=1.0, multiprocessing_context:Optional[str]=None):
+        self.run_id = run_id
+        self.context = context
+        self.flush_interval = flush_interval
+        self._queue = multiprocessing.get_context(multiprocessing_context).Queue()
+        self._owner = os.getpid()
+        self._drain_thread: Optional[threading.Thread] = None
+        self._error: Optional[Exception] = None    #the last failed write, if its metrics are still pending
+        self._unwritten = 0
+        self.journal = None    #set by the process that owns the run, to append the drained metrics to its journal and best points
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_drain_thread'] = None
+        state['_error'] = None
+        state['journal'] = None
+        return state
+
+    def log_metric(self, key:str, value:float, step:Optional[int]=None, timestamp:Optional[int]=None) -> None:
+        """
+        Logs a metric from any process. The call doesn't block on MLflow.
+
+        Args:
+            key (str): The key of the metric.
+            value (float): The value of the metric.
+            step (Optional[int]): The step of the metric. Defaults to None.
+            timestamp (Optional[int]): The timestamp of the metric, in milliseconds. Defaults to None, the current time.
+        """
+        self._queue.put((key, float(value), step or 0, timestamp or int(time.time() * 1000)))
+
+    def log_metrics(self, metrics:Dict[str, float], step:Optional[int]=None) -> None:
+        """
+        Logs several metrics with the same step and timestamp from any process.
+
+        Args:
+            metrics (Dict[str, float]): The values of the metrics.
+            step (Optional[int]): The step of the metrics. Defaults to None.
+        """
+        timestamp = int(time.time() * 1000)
+        for key, value in metrics.items():
+            self.log_metric(key, value, step, timestamp)
+
+    def start(self) -> None:
+        """
+        Starts draining the channel into MLflow. Called by the process that owns the run.
+        """
+        if self._drain_thread is None:
+            self._drain_thread = threading.Thread(target=self._drain, name='prov4ml-metric-channel', daemon=True)
+            self._drain_thread.start()
+
+    def close(self) -> None:
+        """
+        Writes the metrics still in the channel and stops draining it.
+
+        Raises:
+            RuntimeError: If some metrics could not be written to MLflow, from the last error of the writes.
+        """
+        if self._drain_thread is not None and os.getpid() == self._owner:
+            self._queue.put(_CLOSE)
+            self._drain_thread.join()
+            self._drain_thread = None
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise RuntimeError(f'{self._unwritten} metrics logged through the channel could not be written to run {self.run_id}') from error
+
+    def _drain(self) -> None:
+        import mlflow
+
+        client = mlflow.MlflowClient()
+        pending: List[Tuple[str, float, int, int]] = []
+        deadline = time.monotonic() + self.flush_interval
+        closing = False
+        while not closing:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                if item is _CLOSE:
+                    closing = True
+                else:
+                    pending.append(item)
+            except queue.Empty:
+                pass
+            if closing or len(pending) >= MAX_METRICS_PER_BATCH or time.monotonic() >= deadline:
+                while pending:
+                    try:
+                        self._write(client, pending[:MAX_METRICS_PER_BATCH])
+                    except Exception as error:
+                        #kept for the next flush; the drain thread must survive, or the workers' metrics would pile up in the queue
+                        _logger.warning('Writing %d metrics of the channel of run %s failed, retrying at the next flush',
+                                        len(pending), self.run_id, exc_info=True)
+                        self._error = error
+                        break
+                    del pending[:MAX_METRICS_PER_BATCH]
+                else:
+                    self._error = None
+                self._unwritten = len(pending)
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, client, batch:List[Tuple[str, float, int, int]]) -> None:
+        from mlflow.entities import Metric
+
+        metrics = [Metric(key, value, timestamp, step) for key, value, step, timestamp in batch]
+        for batch_metrics, _ in iter_batches(metrics):
+            client.log_batch(self.run_id, metrics=batch_metrics)
+            if self.journal is not None:
+                self.journal.append_metrics(batch_metrics, [self.context] * len(batch_metrics))
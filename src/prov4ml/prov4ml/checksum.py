@@ -0,0 +1,136 @@
+"""Content checksums of the artifacts of a run, for the attributes of their entities.
+
+MLflow's FileInfo only has the path and size of an artifact. When the artifacts are on the local file system (a
+file: artifact store, or a local copy of a remote one), prov4ml hashes them itself:
+
+* each file is memory-mapped and hashed in chunks, so that large checkpoints are neither read into memory at once nor
+  copied through Python buffers;
+* the files are hashed by a pool of worker threads: hashlib releases the GIL while it hashes a chunk, so the files
+  are hashed in parallel without the cost of starting processes;
+* the checksums are cached in a JSON file by path, size and modification time, so that the document of a resumed or
+  recovered run doesn't hash its artifacts again, only the new or modified ones.
+"""
+import hashlib
+import json
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+CHECKSUM_ALGORITHM = 'sha256'
+
+#the size and checksum of an artifact, the checksum as {algorithm}:{hex digest}
+ArtifactChecksum = Tuple[int, str]
+
+def local_artifact_root(artifact_uri:str) -> Optional[str]:
+    """
+    Returns the local directory of an artifact URI, None if the artifacts aren't on the local file system.
+    """
+    parsed = urlparse(artifact_uri)
+    if parsed.scheme == 'file':
+        return unquote(parsed.path)
+    if parsed.scheme == '' or len(parsed.scheme) == 1:    #a plain path, or one starting with a Windows drive
+        return artifact_uri
+    return None
+
+def file_checksum(path:str, algorithm:str=CHECKSUM_ALGORITHM, chunk_size:int=1 << 22) -> str:
+    """
+    Hashes a file in chunks of a memory map of it.
+
+    Args:
+        path (str): The path of the file.
+        algorithm (str): The hashlib algorithm. Defaults to sha256.
+        chunk_size (int): The number of bytes hashed at a time. Defaults to 4 MiB.
+
+    Returns:
+        str: The checksum, as {algorithm}:{hex digest}.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size:    #empty files can't be mapped
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for start in range(0, len(view), chunk_size):
+                    digest.update(view[start:start + chunk_size])
+    return f'{algorithm}:{digest.hexdigest()}'
+
+
+class ChecksumCache:
+    """Checksums of files, valid as long as their size and modification time don't change.
+
+    Args:
+        path (str): The path of the JSON file of the cache, read if it exists.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self._entries: Dict[str, list] = {}
+        if os.path.exists(path):
+            with open(path) as cache_file:
+                self._entries = json.load(cache_file)
+        self._changed = False
+
+    def get(self, path:str, stat:os.stat_result, algorithm:str) -> Optional[str]:
+        """
+        Returns the cached checksum of a file, None if it isn't cached or the file changed since.
+        """
+        entry = self._entries.get(os.path.abspath(path))
+        if entry is not None and entry[:3] == [stat.st_size, stat.st_mtime_ns, algorithm]:
+            return entry[3]
+        return None
+
+    def put(self, path:str, stat:os.stat_result, algorithm:str, checksum:str) -> None:
+        self._entries[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns, algorithm, checksum]
+        self._changed = True
+
+    def save(self) -> None:
+        """
+        Writes the cache atomically, if anything was added.
+        """
+        if self._changed:
+            temporary = f'{self.path}.tmp'
+            with open(temporary, 'w') as cache_file:
+                json.dump(self._entries, cache_file)
+            os.replace(temporary, self.path)
+            self._changed = False
+
+def artifact_checksums(root:str, paths:Iterable[str], cache:Optional[ChecksumCache]=None, algorithm:str=CHECKSUM_ALGORITHM,
+                       max_workers:Optional[int]=None) -> Dict[str, ArtifactChecksum]:
+    """
+    Computes the size and checksum of the artifacts of a run, hashing the ones not in the cache in parallel.
+
+    Args:
+        root (str): The local directory of the artifacts of the run.
+        paths (Iterable[str]): The artifact paths, relative to root, e.g. the paths of traverse_artifact_tree.
+        cache (Optional[ChecksumCache]): The cache of the checksums, updated and saved. Defaults to None.
+        algorithm (str): The hashlib algorithm. Defaults to sha256.
+        max_workers (Optional[int]): The maximum number of files hashed at the same time. Defaults to None, the
+            number of CPUs.
+
+    Returns:
+        Dict[str, Tuple[int, str]]: The size and checksum of each artifact path; the artifacts that aren't found
+            locally are left out.
+    """
+    checksums: Dict[str, ArtifactChecksum] = {}
+    missing = []
+    for path in paths:
+        local_path = os.path.join(root, path)
+        try:
+            stat = os.stat(local_path)
+        except OSError:
+            continue
+        checksum = cache.get(local_path, stat, algorithm) if cache is not None else None
+        if checksum is not None:
+            checksums[path] = stat.st_size, checksum
+        else:
+            missing.append((path, local_path, stat))
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(len(missing), max_workers or os.cpu_count() or 1)) as pool:
+            hashed = pool.map(partial(file_checksum, algorithm=algorithm), [local_path for _, local_path, _ in missing])
+            for (path, local_path, stat), checksum in zip(missing, hashed):
+                checksums[path] = stat.st_size, checksum
+                if cache is not None:
+                    cache.put(local_path, stat, algorithm, checksum)
+    if cache is not None:
+        cache.save()
+    return checksums
@@ -0,0 +1,43 @@
+"""Command line interface: ``prov4ml <command>``, or ``python -m prov4ml.cli <command>``.
+
+Commands:
+
+* diff: the structural diff of the documents of two runs, see prov4ml.diff.
+"""
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+from .diff import diff_files, diff_to_json, format_diff
+
+def _document_path(path:str) -> str:
+    #a run's output directory stands for its document
+    return os.path.join(path, 'prov_graph.json') if os.path.isdir(path) else path
+
+def _diff(args:argparse.Namespace) -> int:
+    diff = diff_files(_document_path(args.first), _document_path(args.second), tolerance=args.tolerance)
+    print(diff_to_json(diff) if args.json else format_diff(diff, limit=args.limit))
+    return 1 if args.exit_code and (diff.added or diff.removed or diff.changed or diff.relations_added
+                                    or diff.relations_removed or any(metric.first_divergent_step is not None
+                                                                     or metric.points[0] != metric.points[1]
+                                                                     for metric in diff.metrics.values())) else 0
+
+def main(argv:Optional[List[str]]=None) -> int:
+    parser = argparse.ArgumentParser(prog='prov4ml')
+    commands = parser.add_subparsers(dest='command', required=True)
+    diff = commands.add_parser('diff', help='structural diff of the provenance documents of two runs')
+    diff.add_argument('first', help='a PROV-JSON document, or the directory of its prov_graph.json')
+    diff.add_argument('second', help='a PROV-JSON document, or the directory of its prov_graph.json')
+    diff.add_argument('--tolerance', type=float, default=0.0,
+                      help='the largest difference between metric values at the same step that is not a divergence')
+    diff.add_argument('--limit', type=int, default=10,
+                      help='the number of added or removed records of a type listed before they are only counted')
+    diff.add_argument('--json', action='store_true', help='print the diff as JSON')
+    diff.add_argument('--exit-code', action='store_true', help='exit with 1 if the documents differ')
+    diff.set_defaults(handler=_diff)
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
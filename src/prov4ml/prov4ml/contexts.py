@@ -0,0 +1,420 @@
+"""Registry of the contexts metrics are logged in, and index of the contexts of the metric keys of a run.
+
+A context names the phase of the run a metric belongs to and the step activities that generate its points in the
+document (see prov4ml.step_activity_levels): e.g. the points of TRAINING are generated by train_step_{step}
+activities of type TrainingExecution. Besides the members of prov4ml.Context, contexts can be registered, e.g. one
+per DataLoader or for a custom phase:
+
+    ood = prov4ml.register_context('VALIDATION_OOD', prefix='val_ood', prov_type='ValidationExecution')
+    prov4ml.log_metric('loss', loss, ood, step=step)
+
+A run doesn't record the contexts as one tag per metric key: it keeps a ContextIndex, which records the contexts
+each key is logged in and the steps of each, as ranges with a stride, so that a regular loop takes constant space.
+The index is written as the prov4ml.contexts tag of the run, or as the prov/contexts.json artifact when it doesn't
+fit in a tag, by an IndexWriter: within SAVE_INTERVAL seconds of the first point of a key or of a context of a key,
+so that a run killed before it ends still has it, when the metrics are flushed and when the run ends. For a run not
+started with prov4ml.start_run, e.g. with mlflow.start_run, whose end prov4ml doesn't see, the index is also written
+with the batch of metrics that logs a new key or context, if it fits in a tag, and within SAVE_INTERVAL seconds of
+every batch. Logging a metric never writes an artifact. The document looks the contexts up in the index, once per key.
+
+A key can be logged in several contexts, e.g. loss in TRAINING and VALIDATION. Each point is attributed to the only
+context that logged its step; for the steps logged in several, the index records the order of the contexts of their
+points, e.g. TRAINING then VALIDATION, in ranges with a stride too, so that a loop evaluating at every step, or every
+few steps, still takes constant space. The n-th point of such a step, {key}_{step}_{n} in the document, is attributed
+to the n-th context of its order.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+MetricContext = namedtuple('MetricContext', ['name', 'prefix', 'prov_type'])
+MetricContext.__doc__ = """A context metrics are logged in.
+
+Attributes:
+    name (str): The name of the context, recorded for each metric key.
+    prefix (Optional[str]): The prefix of the identifiers of its step activities, e.g. train for train_step_{step};
+        None for the contexts without step activities.
+    prov_type (Optional[str]): The prov-ml:type of its step activities.
+"""
+
+CONTEXTS_TAG = 'prov4ml.contexts'
+#in the artifact directory of the outputs, which the document doesn't describe
+CONTEXTS_ARTIFACT_PATH = 'prov/contexts.json'
+MAX_TAG_LENGTH = 8000
+#the number of seconds the index of a run waits to be written after it changes, while the run runs
+SAVE_INTERVAL = 30.0
+
+_logger = logging.getLogger(__name__)
+
+_registry: Dict[str, MetricContext] = {}
+_registry_lock = threading.Lock()
+
+def register_context(name:str, prefix:Optional[str]=None, prov_type:Optional[str]=None) -> MetricContext:
+    """
+    Registers a context, which can then be given to log_metric and log_metrics like a member of Context.
+
+    Args:
+        name (str): The name of the context.
+        prefix (Optional[str]): The prefix of its step activities. Defaults to None, no step activities.
+        prov_type (Optional[str]): The prov-ml:type of its step activities. Defaults to {name}Execution.
+
+    Returns:
+        MetricContext: The context.
+
+    Raises:
+        ValueError: If the name or the prefix is already registered with another definition.
+    """
+    context = MetricContext(name, prefix, prov_type or (f'{name.title().replace("_", "")}Execution' if prefix is not None else None))
+    with _registry_lock:
+        registered = _registry.get(name)
+        if registered is not None and registered != context:
+            raise ValueError(f'Context {name} is already registered as {registered}')
+        clash = next((other for other in _registry.values() if prefix is not None and other.prefix == prefix and other.name != name), None)
+        if clash is not None:
+            raise ValueError(f'The prefix {prefix} of context {name} is already the one of context {clash.name}')
+        _registry[name] = context
+    return context
+
+def get_context(name:str) -> Optional[MetricContext]:
+    """
+    Returns the registered context with the given name, None if there is none.
+    """
+    return _registry.get(name)
+
+
+def _covers(span:List[Any], step:int) -> bool:
+    first, last, stride = span[0], span[1], span[2]
+    return first <= step <= last and (step == first or (stride > 0 and (step - first) % stride == 0))
+
+def _extend(spans:List[List[Any]], step:int, *rest:Any) -> None:
+    #adds a step to the last range if it continues it with the same stride and rest, e.g. the same order of contexts
+    last = spans[-1] if spans else None
+    if last is not None and list(rest) == last[3:] and step > last[1] and (last[2] == 0 or step == last[1] + last[2]):
+        last[1:3] = step, step - last[0] if last[2] == 0 else last[2]
+    else:
+        spans.append([step, step, 0, *rest])
+
+def _without(span:List[Any], step:int) -> List[List[Any]]:
+    #the parts of a range left when one of its steps is taken out of it
+    first, last, stride = span[0], span[1], span[2]
+    parts = []
+    if step > first:
+        parts.append([first, step - stride, stride if step - stride > first else 0, *span[3:]])
+    if step < last:
+        parts.append([step + stride, last, stride if last > step + stride else 0, *span[3:]])
+    return parts
+
+def _add_run(runs:List[List[Any]], context:str) -> None:
+    #the order of the contexts of the points of a step, as [context, number of consecutive points] runs
+    if runs and runs[-1][0] == context:
+        runs[-1][1] += 1
+    else:
+        runs.append([context, 1])
+
+def _nth(runs:List[List[Any]], n:int) -> str:
+    for context, count in runs:
+        if n < count:
+            return context
+        n -= count
+    return runs[-1][0]
+
+
+class ContextIndex:
+    """The contexts each metric key of a run is logged in, with the steps of each.
+
+    Args:
+        keys (Optional[Dict[str, Dict[str, List[List[int]]]]]): The steps of each context of each key, as lists of
+            [first, last, stride] ranges. Defaults to None, an empty index.
+        shared (Optional[Dict[str, List[List[Any]]]]): For the steps of a key logged in several contexts, the order of
+            the contexts of their points, as [first, last, stride, runs] ranges of the steps with the same order; the
+            runs are [context, number of consecutive points] pairs. Defaults to None.
+    """
+    def __init__(self, keys:Optional[Dict[str, Dict[str, List[List[int]]]]]=None, shared:Optional[Dict[str, List[List[Any]]]]=None):
+        self.keys: Dict[str, Dict[str, List[List[int]]]] = keys or {}
+        self.shared: Dict[str, List[List[Any]]] = shared or {}
+        self._current: Dict[str, List[Any]] = {}    #the last step of each key and the order of its contexts so far
+        self._lock = threading.Lock()    #points are added by the run and by the thread draining its channel
+
+    def add(self, key:str, context:str, step:int) -> bool:
+        """
+        Records a point of a key logged in a context.
+
+        Args:
+            key (str): The key of the metric.
+            context (str): The name of the context.
+            step (int): The step of the point.
+
+        Returns:
+            bool: Whether the key, or the context for the key, is new.
+        """
+        with self._lock:
+            contexts = self.keys.get(key)
+            if contexts is None:
+                self.keys[key] = {context: [[step, step, 0]]}
+                self._current[key] = [step, [[context, 1]]]
+                return True
+            current = self._current.get(key)
+            if current is not None and current[0] == step:
+                _add_run(current[1], context)
+            else:
+                if current is not None:
+                    self._record_order(key, *current)
+                runs = self._earlier_order(key, contexts, step) if len(contexts) > 1 or context not in contexts else []
+                _add_run(runs, context)
+                self._current[key] = [step, runs]
+            if context not in contexts:
+                contexts[context] = [[step, step, 0]]
+                return True
+            ranges = contexts[context]
+            if not _covers(ranges[-1], step):
+                _extend(ranges, step)
+            return False
+
+    def _earlier_order(self, key:str, contexts:Dict[str, List[List[int]]], step:int) -> List[List[Any]]:
+        #the order of the contexts of a step logged before, taken out of the index until the step is left again; for a
+        #step whose order wasn't recorded, one point per context that logged it
+        spans = self.shared.get(key, [])
+        for i, span in enumerate(spans):
+            if _covers(span, step):
+                spans[i:i + 1] = _without(span, step)
+                return [list(run) for run in span[3]]
+        return [[other, 1] for other, ranges in contexts.items() if any(_covers(span, step) for span in ranges)]
+
+    def _record_order(self, key:str, step:int, runs:List[List[Any]]) -> None:
+        #a step whose points are all in the same context needs no order
+        if len(runs) > 1:
+            _extend(self.shared.setdefault(key, []), step, runs)
+
+    def _orders(self, key:str) -> List[List[Any]]:
+        #the recorded orders of a key and the one of its current step, copied
+        spans = [[first, last, stride, [list(run) for run in runs]] for first, last, stride, runs in self.shared.get(key, ())]
+        current = self._current.get(key)
+        if current is not None and len(current[1]) > 1:
+            _extend(spans, current[0], [list(run) for run in current[1]])
+        return spans
+
+    def add_points(self, metrics:Iterable[Any], contexts:Iterable[str]) -> bool:
+        """
+        Records a batch of metric points and the name of the context of each.
+
+        Returns:
+            bool: Whether a key, or a context for a key, is new.
+        """
+        new = False
+        for metric, context in zip(metrics, contexts):
+            new = self.add(metric.key, context, metric.step) or new
+        return new
+
+    def update(self, other:'ContextIndex') -> None:
+        """
+        Adds the contexts and steps of another index, e.g. the one of the session before a resume.
+
+        The steps logged in different contexts by the two indexes aren't known as shared: their points are attributed
+        to the contexts in the order they were first used for the key.
+        """
+        with other._lock:
+            keys = {key: {context: [list(span) for span in ranges] for context, ranges in contexts.items()} for key, contexts in other.keys.items()}
+            shared = {key: other._orders(key) for key in other.keys}
+        with self._lock:
+            for key, contexts in keys.items():
+                for context, ranges in contexts.items():
+                    self.keys.setdefault(key, {}).setdefault(context, []).extend(ranges)
+            for key, spans in shared.items():
+                if spans:
+                    self.shared.setdefault(key, []).extend(spans)
+
+    def contexts(self, key:str) -> List[str]:
+        """
+        Returns the contexts a key is logged in, in the order they were first used for it.
+        """
+        return list(self.keys.get(key, ()))
+
+    def resolver(self, key:str) -> Callable[[int, int], Optional[str]]:
+        """
+        Returns a function giving the context of each point of a key.
+
+        Args:
+            key (str): The key of the metric.
+
+        Returns:
+            Callable[[int, int], Optional[str]]: A function of the step of a point and of the number of points of the
+                metric before it at the same step, as numbered by prov4ml.query.MetricNumbering, returning the name
+                of its context, None if the key isn't in the index.
+        """
+        contexts = self.keys.get(key)
+        if not contexts:
+            return lambda step, n: None
+        if len(contexts) == 1:
+            context = next(iter(contexts))
+            return lambda step, n: context
+        with self._lock:
+            spans = self._orders(key)
+        steps = {span[0]: span[3] for span in spans if span[0] == span[1]}
+        spans = [span for span in spans if span[0] != span[1]]
+
+        def resolve(step:int, n:int) -> Optional[str]:
+            runs = steps.get(step)
+            if runs is None:
+                runs = next((span[3] for span in spans if _covers(span, step)), None)
+            if runs is not None:
+                return _nth(runs, n)
+            candidates = [context for context, ranges in contexts.items() if any(_covers(span, step) for span in ranges)]
+            if not candidates:
+                return next(iter(contexts))
+            return candidates[min(n, len(candidates) - 1)]
+        return resolve
+
+    def to_json(self) -> Dict[str, Any]:
+        """
+        Returns the index as a JSON object, with the definitions of the contexts it uses.
+        """
+        with self._lock:
+            keys = {key: {context: [list(span) for span in ranges] for context, ranges in contexts.items()}
+                    for key, contexts in self.keys.items()}
+            shared = {key: spans for key, spans in ((key, self._orders(key)) for key in self.keys) if spans}
+        names = {context for contexts in keys.values() for context in contexts}
+        definitions = {name: [_registry[name].prefix, _registry[name].prov_type] for name in sorted(names) if name in _registry}
+        return {'contexts': definitions, 'keys': keys, 'shared': shared}
+
+    @classmethod
+    def from_json(cls, content:Dict[str, Any]) -> 'ContextIndex':
+        """
+        Loads an index written by to_json, registering the contexts it defines that aren't registered yet.
+        """
+        for name, (prefix, prov_type) in content.get('contexts', {}).items():
+            if name not in _registry:
+                register_context(name, prefix, prov_type)
+        #ranges without a stride cover every step between their ends
+        keys = {key: {context: [span if len(span) == 3 else [span[0], span[1], 1] for span in ranges] for context, ranges in contexts.items()}
+                for key, contexts in content.get('keys', {}).items()}
+        return cls(keys, {key: [list(span) for span in spans] for key, spans in content.get('shared', {}).items()})
+
+    def tag_content(self) -> Optional[str]:
+        """
+        Returns the index as the value of the prov4ml.contexts tag, None if it doesn't fit in a tag.
+        """
+        content = json.dumps(self.to_json(), separators=(',', ':'))
+        return content if len(content) <= MAX_TAG_LENGTH else None
+
+    def tag_value(self, client:Any, run_id:str) -> str:
+        """
+        Returns the value of the prov4ml.contexts tag of the index: the index, or the path of the artifact it is
+        written to first if it doesn't fit in a tag.
+        """
+        content = json.dumps(self.to_json(), separators=(',', ':'))
+        if len(content) > MAX_TAG_LENGTH:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, os.path.basename(CONTEXTS_ARTIFACT_PATH))
+                with open(path, 'w') as index_file:
+                    index_file.write(content)
+                client.log_artifact(run_id, path, os.path.dirname(CONTEXTS_ARTIFACT_PATH))
+            content = json.dumps({'artifact': CONTEXTS_ARTIFACT_PATH})
+        return content
+
+    def save(self, client:Any, run_id:str) -> None:
+        """
+        Writes the index as the prov4ml.contexts tag of a run, or as an artifact if it doesn't fit in a tag.
+        """
+        if self.keys:
+            client.set_tag(run_id, CONTEXTS_TAG, self.tag_value(client, run_id))
+
+    @classmethod
+    def load(cls, client:Any, run:Any) -> 'ContextIndex':
+        """
+        Reads the index of a run, from its prov4ml.contexts tag, or from the metric.context.{key} tags written by
+        the previous versions, one context per key.
+        """
+        tag = run.data.tags.get(CONTEXTS_TAG)
+        if tag is None:
+            return cls({key[len('metric.context.'):]: {context: [[0, 0, 0]]} for key, context in run.data.tags.items()
+                        if key.startswith('metric.context.')})
+        content = json.loads(tag)
+        if 'artifact' in content:
+            with tempfile.TemporaryDirectory() as directory:
+                with open(client.download_artifacts(run.info.run_id, content['artifact'], directory)) as index_file:
+                    content = json.load(index_file)
+        return cls.from_json(content)
+
+
+class IndexWriter:
+    """Writes the index of a run while it runs, from a thread of its own, so that logging never waits for it.
+
+    A change marks the index dirty, and it is written at most interval seconds later, or when the writer is flushed;
+    closing the writer writes it in any case, with the steps logged since. Every write uses the same tracking client.
+
+    Args:
+        run_id (str): The ID of the run.
+        index (Callable[[], ContextIndex]): Returns the index to write, e.g. the one of all the sessions of the run.
+        interval (float): The number of seconds a change waits before it is written. Defaults to SAVE_INTERVAL.
+        client (Optional[Any]): The tracking client. Defaults to None, an MlflowClient created for the first write.
+    """
+    def __init__(self, run_id:str, index:Callable[[], ContextIndex], interval:float=SAVE_INTERVAL, client:Optional[Any]=None):
+        self.run_id = run_id
+        self.interval = interval
+        self._index = index
+        self._client = client
+        self._dirty = False
+        self._closed = False
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()    #one write at a time, so that an older index doesn't replace a newer one
+
+    def mark(self) -> None:
+        """
+        Marks the index as changed, to be written within interval seconds.
+        """
+        with self._lock:
+            self._dirty = True
+            if self._timer is None and not self._closed:
+                self._timer = threading.Timer(self.interval, self._write_marked)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _write_marked(self) -> None:
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            #the thread of a timer has no caller to raise to; the index stays dirty, for the next write
+            _logger.warning('Writing the context index of run %s failed, retrying after the next change', self.run_id, exc_info=True)
+
+    def flush(self) -> None:
+        """
+        Writes the index now if it changed since it was last written.
+        """
+        with self._write_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, False
+            if dirty:
+                self._write()
+
+    def _write(self) -> None:
+        if self._client is None:
+            import mlflow
+
+            self._client = mlflow.MlflowClient()
+        try:
+            self._index().save(self._client, self.run_id)
+        except BaseException:
+            with self._lock:
+                self._dirty = True
+            raise
+
+    def close(self) -> None:
+        """
+        Cancels the pending write and writes the index now.
+        """
+        with self._lock:
+            self._closed = True
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        with self._write_lock:
+            with self._lock:
+                self._dirty = False
+            self._write()
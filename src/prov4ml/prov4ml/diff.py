@@ -0,0 +1,205 @@
+"""Structural diff between the provenance documents of two runs.
+
+Records are matched by a key derived from their identifier, through hash maps, so the diff is O(R) in the size of
+the documents. The parts of identifiers that always differ between runs are normalized away:
+
+* the run name, e.g. ``{run_name}_execution`` is matched as ``<run>_execution``;
+* the digest of datasets, ``{name}-{digest}``, which is reported as a changed mlflow:digest instead;
+* the version of model versions, ``{name}_{version}``, matched as ``{name}_<version>``.
+
+Matched records are compared attribute by attribute, ignoring the attributes that identify the run rather than
+describe it (IGNORED_ATTRIBUTES). Relations are compared as multisets of (kind, subject, object, attributes)
+signatures. Metric entities are not compared one by one: they are grouped by their key (see prov4ml.query.metric_key)
+and the points of each metric are compared as a series, step by step, and summarized numerically.
+"""
+import json
+from collections import Counter, namedtuple
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from .query import attribute_value, iter_records, iter_relations, load_document, metric_key
+
+#attributes that differ between any two runs
+IGNORED_ATTRIBUTES = frozenset({
+    'mlflow:run_id',
+    'mlflow:artifact_uri',
+    'mlflow:creation_timestamp',
+    'mlflow:last_updated_timestamp',
+})
+
+RUN_PLACEHOLDER = '<run>'
+
+RecordChange = namedtuple('RecordChange', ['kind', 'key', 'attributes'])
+RelationSignature = namedtuple('RelationSignature', ['kind', 'subject', 'object', 'attributes'])
+MetricDiff = namedtuple('MetricDiff', ['key', 'points', 'common_steps', 'max_abs_difference', 'mean_abs_difference',
+                                       'first_divergent_step', 'final_values'])
+DocumentDiff = namedtuple('DocumentDiff', ['runs', 'added', 'removed', 'changed', 'relations_added', 'relations_removed', 'metrics'])
+DocumentDiff.__doc__ = """The differences between two documents, from the first to the second.
+
+Attributes:
+    runs (Tuple[str, str]): The names of the two runs.
+    added (List[Tuple[str, str, Any]]): The kind, key and prov-ml:type of the records only in the second document.
+    removed (List[Tuple[str, str, Any]]): The same for the records only in the first document.
+    changed (List[RecordChange]): The records in both, with the (first, second) values of each differing attribute.
+    relations_added (List[RelationSignature]): The relations only in the second document, as often as they are added.
+    relations_removed (List[RelationSignature]): The relations only in the first document.
+    metrics (Dict[str, MetricDiff]): The comparison of each metric series, by key.
+"""
+
+_Index = namedtuple('_Index', ['run', 'records', 'types', 'relations', 'metrics'])
+
+def _index(document:Dict[str, Any], ignore:FrozenSet[str]) -> _Index:
+    run = next((identifier for kind, identifier, attributes in iter_records(document)
+                if kind == 'entity' and attribute_value(attributes.get('prov-ml:type')) == 'LearningStage'), None)
+
+    def normalize(identifier:str) -> str:
+        if run is not None and (identifier == run or identifier.startswith((f'{run}_', f'{run}/'))):
+            return RUN_PLACEHOLDER + identifier[len(run):]
+        return identifier
+
+    keys: Dict[str, str] = {}
+    records: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    types: Dict[Tuple[str, str], Any] = {}
+    points: Dict[str, Tuple[str, Any, Any]] = {}
+    for kind, identifier, attributes in iter_records(document):
+        values = {attribute: attribute_value(value) for attribute, value in attributes.items()}
+        prov_type = values.get('prov-ml:type')
+        if prov_type == 'ModelEvaluation':
+            points[identifier] = metric_key(identifier, values) or identifier, values.get('mlflow:step'), values.get('mlflow:value')
+            continue
+        if 'mlflow:digest' in values and identifier.endswith(f"-{values['mlflow:digest']}"):
+            key = identifier[:-len(str(values['mlflow:digest']))-1]
+        elif 'mlflow:version' in values and identifier.endswith(f"_{values['mlflow:version']}"):
+            key = identifier[:-len(str(values['mlflow:version']))] + '<version>'
+        else:
+            key = normalize(identifier)
+        keys[identifier] = key
+        records.setdefault((kind, key), {}).update((attribute, value) for attribute, value in values.items() if attribute not in ignore)
+        types[(kind, key)] = prov_type
+
+    metrics: Dict[str, Dict[Any, Any]] = {}
+    for key, step, value in points.values():
+        metrics.setdefault(key, {}).setdefault(step, value)    #the first point of a step logged more than once
+
+    relations = Counter()
+    for relation in iter_relations(document):
+        if relation.subject in points or relation.object in points:
+            continue    #compared with the metric series
+        attributes = tuple(sorted((attribute, repr(attribute_value(value))) for attribute, value in relation.attributes.items()
+                                  if attribute not in ignore))
+        relations[RelationSignature(relation.kind, keys.get(relation.subject, normalize(relation.subject)),
+                                    keys.get(relation.object, normalize(relation.object)), attributes)] += 1
+    return _Index(run, records, types, relations, metrics)
+
+def _number(value:Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _diff_metric(key:str, first:Dict[Any, Any], second:Dict[Any, Any], tolerance:float) -> MetricDiff:
+    differences = []
+    first_divergent_step = None
+    for step in sorted(step for step in first if step in second):
+        a, b = _number(first[step]), _number(second[step])
+        difference = abs(b - a) if a is not None and b is not None else (0.0 if first[step] == second[step] else float('inf'))
+        differences.append(difference)
+        if first_divergent_step is None and difference > tolerance:
+            first_divergent_step = step
+    final_values = (first[max(first)] if first else None, second[max(second)] if second else None)
+    return MetricDiff(key, (len(first), len(second)), len(differences), max(differences) if differences else None,
+                      sum(differences)/len(differences) if differences else None, first_divergent_step, final_values)
+
+def diff_documents(first:Dict[str, Any], second:Dict[str, Any], tolerance:float=0.0,
+                   ignore:FrozenSet[str]=IGNORED_ATTRIBUTES) -> DocumentDiff:
+    """
+    Computes the structural diff between two PROV-JSON documents, in O(R).
+
+    Args:
+        first (Dict[str, Any]): The first document, e.g. loaded with prov4ml.query.load_document.
+        second (Dict[str, Any]): The second document.
+        tolerance (float): The largest difference between the values of a metric at the same step that isn't a
+            divergence. Defaults to 0.0.
+        ignore (FrozenSet[str]): The attributes not compared. Defaults to IGNORED_ATTRIBUTES.
+
+    Returns:
+        DocumentDiff: The differences from the first document to the second.
+    """
+    a, b = _index(first, ignore), _index(second, ignore)
+    added = [(kind, key, b.types[(kind, key)]) for kind, key in b.records if (kind, key) not in a.records]
+    removed = [(kind, key, a.types[(kind, key)]) for kind, key in a.records if (kind, key) not in b.records]
+    changed = []
+    for record, attributes in a.records.items():
+        other = b.records.get(record)
+        if other is None:
+            continue
+        differences = {attribute: (attributes.get(attribute), other.get(attribute))
+                       for attribute in dict.fromkeys([*attributes, *other]) if attributes.get(attribute) != other.get(attribute)}
+        if differences:
+            changed.append(RecordChange(*record, differences))
+    metrics = {key: _diff_metric(key, a.metrics.get(key, {}), b.metrics.get(key, {}), tolerance)
+               for key in dict.fromkeys([*a.metrics, *b.metrics])}
+    return DocumentDiff((a.run, b.run), added, removed, changed, list((b.relations - a.relations).elements()),
+                        list((a.relations - b.relations).elements()), metrics)
+
+def diff_files(first_path:str, second_path:str, **kwargs) -> DocumentDiff:
+    """
+    Computes the structural diff between two PROV-JSON files, see diff_documents.
+    """
+    return diff_documents(load_document(first_path), load_document(second_path), **kwargs)
+
+def _grouped(records:List[Tuple[str, str, Any]], sign:str, limit:int) -> List[str]:
+    #records of the same kind and type are listed up to limit, then counted, e.g. the step activities
+    groups: Dict[Tuple[str, Any], List[str]] = {}
+    for kind, key, prov_type in records:
+        groups.setdefault((kind, prov_type), []).append(key)
+    lines = []
+    for (kind, prov_type), keys in groups.items():
+        label = f'{kind} {prov_type}' if prov_type is not None else kind
+        if len(keys) > limit:
+            lines.append(f'  {sign} {len(keys)} {label} records, e.g. {keys[0]}')
+        else:
+            lines.extend(f'  {sign} {label} {key}' for key in keys)
+    return lines
+
+def format_diff(diff:DocumentDiff, limit:int=10) -> str:
+    """
+    Formats a diff as text.
+
+    Args:
+        diff (DocumentDiff): The diff.
+        limit (int): The number of added or removed records of the same kind and type listed before they are only
+            counted. Defaults to 10.
+
+    Returns:
+        str: The diff, one difference per line.
+    """
+    lines = [f'runs: {diff.runs[0]} -> {diff.runs[1]}',
+             f'records: +{len(diff.added)} -{len(diff.removed)} ~{len(diff.changed)}']
+    lines += _grouped(diff.added, '+', limit) + _grouped(diff.removed, '-', limit)
+    for change in diff.changed:
+        for attribute, (a, b) in change.attributes.items():
+            lines.append(f'  ~ {change.kind} {change.key} {attribute}: {a!r} -> {b!r}')
+    lines.append(f'relations: +{len(diff.relations_added)} -{len(diff.relations_removed)}')
+    for sign, relations in (('+', diff.relations_added), ('-', diff.relations_removed)):
+        for (kind, subject, object), count in Counter((relation.kind, relation.subject, relation.object) for relation in relations).items():
+            lines.append(f'  {sign} {kind}({subject}, {object})' + (f' x{count}' if count > 1 else ''))
+    lines.append(f'metrics: {len(diff.metrics)}')
+    for metric in diff.metrics.values():
+        if metric.points[0] == metric.points[1] == metric.common_steps and metric.first_divergent_step is None:
+            lines.append(f'  = {metric.key}: {metric.common_steps} points, identical')
+            continue
+        lines.append(f'  ~ {metric.key}: {metric.points[0]} -> {metric.points[1]} points, {metric.common_steps} common steps, '
+                     f'max |diff| {metric.max_abs_difference}, mean |diff| {metric.mean_abs_difference}, '
+                     f'first divergence at step {metric.first_divergent_step}, final {metric.final_values[0]!r} -> {metric.final_values[1]!r}')
+    return '\n'.join(lines)
+
+def diff_to_json(diff:DocumentDiff) -> str:
+    """
+    Serializes a diff to JSON.
+    """
+    content = diff._asdict()
+    content['changed'] = [change._asdict() for change in diff.changed]
+    content['relations_added'] = [relation._asdict() for relation in diff.relations_added]
+    content['relations_removed'] = [relation._asdict() for relation in diff.relations_removed]
+    content['metrics'] = {key: metric._asdict() for key, metric in diff.metrics.items()}
+    return json.dumps(content, default=str)
@@ -0,0 +1,227 @@
+"""Live stream of the provenance of a run, for dashboards that follow it while it runs.
+
+The document of a run is written when it ends; with the events option of start_run, its records are also published
+as they appear, as events, each a record of the document as a JSON object:
+
+    {"run_id": "...", "time": 1700000000000, "kind": "entity", "id": "loss_3", "attributes": {"mlflow:value": 0.25, ...}}
+
+kind is entity, activity or a relation type; the attributes are plain JSON values, the endpoints of relations are
+their PROV-JSON attributes (e.g. prov:entity and prov:activity for wasGeneratedBy). The events cover the run entity
+and its execution activity, whose mlflow:status is updated when the run ends, the metric entities, the step
+activities they are generated by, and the artifacts: the checkpoints logged with log_checkpoint as they are logged,
+all of them when the run ends. Events are upserts: a record can be published more than once, e.g. the execution
+activity, and its latest attributes are the current ones.
+
+Publishing doesn't block the training loop: the run only appends what it logged to a queue, and a thread of the
+process renders the events and delivers them in batches, every flush_interval seconds, to the sink:
+
+* a path: the events are appended to the file, one per line, e.g. for ``tail -f``. Each batch is a single write, so
+  several runs, e.g. the trials of a sweep, can share the file;
+* ``unix:{path}``: the events are sent, one per line, to the Unix stream socket a dashboard listens on. While it
+  can't be reached, the events are dropped, and the connection is retried at the next batch;
+* a callable: it is called by the thread with the list of events of each batch.
+"""
+import json
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .query import RELATION_ENDPOINTS, MetricNumbering
+
+EVENT_SOCKET_PREFIX = 'unix:'
+
+#the activities a metric of a context and step is generated by, from the outermost, with their attributes
+StepActivities = Callable[[str, int], List[Tuple[str, Dict[str, Any]]]]
+
+Sink = Union[str, Callable[[List[Dict[str, Any]]], None]]
+
+_ENCODER = json.JSONEncoder(check_circular=False, default=str)    #json.dumps with arguments builds an encoder per call
+_DATA_PREPARATION = ('DATA_PREPARATION', 'data_preparation')
+
+class _FileSink:
+    def __init__(self, path:str):
+        self._file = open(path, 'ab', buffering=0)    #unbuffered append: a batch is one write, not interleaved with other writers
+
+    def __call__(self, data:bytes) -> None:
+        self._file.write(data)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _SocketSink:
+    def __init__(self, path:str):
+        self._path = path
+        self._socket: Optional[socket.socket] = None
+
+    def __call__(self, data:bytes) -> None:
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.connect(self._path)
+            self._socket.sendall(data)
+        except OSError:
+            self.close()    #the batch is dropped, the connection retried with the next one
+
+    def close(self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class ProvEventStream:
+    """Batched, non-blocking publication of the provenance events of a run.
+
+    The methods called by the run (run_started, metrics, artifact, run_ended) only append to a queue; the events are
+    rendered and delivered by a thread started with the stream.
+
+    Args:
+        sink (Union[str, Callable[[List[Dict[str, Any]]], None]]): A file path, unix:{path} or a callable, see the module.
+        run_id (str): The ID of the run.
+        run_name (str): The name of the run, which names its entity and its execution activity.
+        step_activities (Callable[[str, int], List[Tuple[str, Dict[str, Any]]]]): The step activities of the metrics
+            of a context and step, as in the document (see prov4ml.step_activity_levels).
+        flush_interval (float): The maximum time, in seconds, an event waits before being delivered. Defaults to 0.5.
+        max_pending (int): The maximum number of logging calls waiting to be published; beyond it, when the sink
+            can't keep up, the oldest are dropped. Defaults to 10000.
+    """
+    def __init__(self, sink:Sink, run_id:str, run_name:str, step_activities:StepActivities,
+                 flush_interval:float=0.5, max_pending:int=10000):
+        self.run_id = run_id
+        self.flush_interval = flush_interval
+        self._run_name = run_name
+        self._execution = f'{run_name}_execution'
+        self._step_activities = step_activities
+        self._pending: deque = deque(maxlen=max_pending)    #appends and pops are atomic, no lock on the logging path
+        self._callback = None
+        self._writer = None
+        if callable(sink):
+            self._callback = sink
+        elif sink.startswith(EVENT_SOCKET_PREFIX):
+            self._writer = _SocketSink(sink[len(EVENT_SOCKET_PREFIX):])
+        else:
+            self._writer = _FileSink(sink)
+        #rendering state: the points logged at each step of each key, the current activity of each context and level
+        self._numbering = MetricNumbering()
+        self._last_activities: Dict[Tuple[str, int], str] = {}
+        self._data_preparation = False
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._deliver, name='prov4ml-events', daemon=True)
+        self._thread.start()
+
+    def _emit(self, item:Tuple[Any, ...]) -> None:
+        self._pending.append((int(time.time() * 1000), item))
+
+    def run_started(self, run:Any) -> None:
+        """
+        Publishes the run entity and its execution activity, RUNNING.
+        """
+        self._emit(('run', run.info.experiment_id, run.info.user_id))
+
+    def metrics(self, metrics:List[Any], contexts:List[str]) -> None:
+        """
+        Publishes a batch of metrics written to MLflow, with the name of the context of each.
+        """
+        self._emit(('metrics', metrics, contexts))
+
+    def artifact(self, path:str, step:Optional[int]=None) -> None:
+        """
+        Publishes an artifact of the run, e.g. a checkpoint and the step it was saved at.
+        """
+        self._emit(('artifact', path, step))
+
+    def run_ended(self, status:str) -> None:
+        """
+        Publishes the status the run ended with.
+        """
+        self._emit(('status', status))
+
+    def close(self) -> None:
+        """
+        Delivers the pending events and stops the thread.
+        """
+        if self._thread is not None:
+            self._closing.set()
+            self._thread.join()
+            self._thread = None
+            if self._writer is not None:
+                self._writer.close()
+
+    def _deliver(self) -> None:
+        while True:
+            closing = self._closing.wait(self.flush_interval)
+            events = []
+            while self._pending:
+                timestamp, item = self._pending.popleft()
+                events.extend(self._render(timestamp, item))
+            if events:
+                self._write(events)
+            if closing:
+                return
+
+    def _write(self, events:List[Dict[str, Any]]) -> None:
+        if self._callback is not None:
+            try:
+                self._callback(events)
+            except Exception:
+                pass    #a failing dashboard must not stop the publication, nor the run
+        else:
+            encode = _ENCODER.encode
+            self._writer(''.join([encode(event) + '\n' for event in events]).encode())
+
+    def _event(self, timestamp:int, kind:str, identifier:Optional[str], attributes:Dict[str, Any]) -> Dict[str, Any]:
+        return {'run_id': self.run_id, 'time': timestamp, 'kind': kind, 'id': identifier, 'attributes': attributes}
+
+    def _relation(self, timestamp:int, kind:str, subject:str, object:str, identifier:Optional[str]=None, level:str='1') -> Dict[str, Any]:
+        subject_key, object_key = RELATION_ENDPOINTS[kind]
+        return self._event(timestamp, kind, identifier, {subject_key: subject, object_key: object, 'prov:level': level})
+
+    def _render(self, timestamp:int, item:Tuple[Any, ...]) -> Iterator[Dict[str, Any]]:
+        kind = item[0]
+        if kind == 'run':
+            _, experiment_id, user_id = item
+            yield self._event(timestamp, 'entity', self._run_name, {
+                'mlflow:run_id': self.run_id, 'mlflow:experiment_id': experiment_id, 'mlflow:user_id': user_id,
+                'prov-ml:type': 'LearningStage', 'prov:level': '1'})
+            yield self._event(timestamp, 'activity', self._execution, {
+                'prov-ml:type': 'LearningStageExecution', 'mlflow:status': 'RUNNING', 'prov:level': '1'})
+            yield self._relation(timestamp, 'wasGeneratedBy', self._run_name, self._execution)
+        elif kind == 'metrics':
+            yield from self._render_metrics(timestamp, item[1], item[2])
+        elif kind == 'artifact':
+            _, path, step = item
+            attributes = {'mlflow:artifact_path': path, 'prov:level': '1'}
+            if step is not None:
+                attributes['mlflow:step'] = step
+            yield self._event(timestamp, 'entity', path, attributes)
+            yield self._relation(timestamp, 'wasGeneratedBy', path, self._execution, f'{path}_gen')
+        elif kind == 'status':
+            yield self._event(timestamp, 'activity', self._execution, {
+                'prov-ml:type': 'LearningStageExecution', 'mlflow:status': item[1], 'prov:level': '1'})
+
+    def _render_metrics(self, timestamp:int, metrics:Iterable[Any], contexts:Iterable[str]) -> Iterator[Dict[str, Any]]:
+        for metric, context in zip(metrics, contexts):
+            identifier = self._numbering.identifier(metric.key, metric.step)    #numbered as in the document
+            yield self._event(timestamp, 'entity', identifier, {
+                'prov-ml:type': 'ModelEvaluation', 'mlflow:key': metric.key, 'mlflow:value': metric.value, 'mlflow:step': metric.step,
+                'mlflow:timestamp': metric.timestamp, 'mlflow:context': context, 'prov:level': '1'})
+            yield self._relation(timestamp, 'wasGeneratedBy', identifier, self._execution, f'{identifier}_gen')
+            if context == _DATA_PREPARATION[0]:
+                if not self._data_preparation:
+                    self._data_preparation = True
+                    yield self._event(timestamp, 'activity', _DATA_PREPARATION[1], {
+                        'prov-ml:type': 'FeatureExtractionExecution', 'prov:level': '2'})
+                yield self._relation(timestamp, 'wasGeneratedBy', identifier, _DATA_PREPARATION[1], level='2')
+                continue
+            parent = self._execution
+            #an activity is published when its metrics start, i.e. once per activity when steps increase
+            for level, (activity, attributes) in enumerate(self._step_activities(context, metric.step)):
+                if self._last_activities.get((context, level)) != activity:
+                    self._last_activities[(context, level)] = activity
+                    yield self._event(timestamp, 'activity', activity, {**attributes, 'prov:level': '2'})
+                    yield self._relation(timestamp, 'wasStartedBy', activity, parent, level='2')
+                parent = activity
+            if parent != self._execution:
+                yield self._relation(timestamp, 'wasGeneratedBy', identifier, parent, level='2')
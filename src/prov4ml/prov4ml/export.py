@@ -0,0 +1,117 @@
+"""Concurrent export of a provenance document to formats other than PROV-JSON.
+
+The PROV-JSON file written at the end of a run is the intermediate form shared by every export. A single format,
+such as the default DOT export, is rendered by a thread of the process, which builds the ``prov.model.ProvDocument``
+from the file while the run's process updates the store and the state: starting worker processes would cost more
+than the rendering. Several formats are rendered by the worker processes of a pool, each reading the file and
+building its own document, so the document is neither pickled nor sent to the workers and the formats are produced
+at the same time. The thread and the pool are created on first use and reused by the next runs of the process.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Sequence, Tuple
+
+#file extension of each supported format; xml needs lxml, rdf needs rdflib and the images need graphviz
+EXPORT_FORMATS = {
+    'dot': '.dot',
+    'provn': '.provn',
+    'xml': '.xml',
+    'rdf': '.trig',
+    'svg': '.svg',
+    'png': '.png',
+    'pdf': '.pdf',
+}
+
+_lock = threading.Lock()
+_renderer: Optional[ThreadPoolExecutor] = None
+#the pools of the process, by start method and number of workers
+_pools: Dict[Tuple[Optional[str], int], ProcessPoolExecutor] = {}
+
+def _executor(formats:int, max_workers:Optional[int], multiprocessing_context:Optional[str]):
+    global _renderer
+    with _lock:
+        if formats == 1:
+            if _renderer is None:
+                _renderer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prov4ml-export')
+            return _renderer
+        key = (multiprocessing_context, min(formats, max_workers or os.cpu_count() or 1))
+        if key not in _pools:
+            _pools[key] = ProcessPoolExecutor(max_workers=key[1], mp_context=multiprocessing.get_context(multiprocessing_context))
+        return _pools[key]
+
+def export_path(json_path:str, format:str) -> str:
+    """
+    Returns the path a format is exported to, next to the PROV-JSON file, e.g. prov_graph.dot for prov_graph.json.
+    """
+    return os.path.splitext(json_path)[0] + EXPORT_FORMATS[format]
+
+def render(json_path:str, format:str, path:str) -> str:
+    """
+    Renders a PROV-JSON file to another format.
+
+    Args:
+        json_path (str): The path of the PROV-JSON file.
+        format (str): One of EXPORT_FORMATS.
+        path (str): The path of the output file.
+
+    Returns:
+        str: The path of the output file.
+    """
+    import prov.model as prov
+
+    with open(json_path) as prov_graph:
+        doc = prov.ProvDocument.deserialize(prov_graph)
+    if format in ('dot', 'svg', 'png', 'pdf'):
+        import prov.dot as dot
+
+        graph = dot.prov_to_dot(doc)
+        if format == 'dot':
+            with open(path, 'w') as output:
+                output.write(graph.to_string())
+        else:
+            graph.write(path, format=format)
+    elif format == 'provn':
+        with open(path, 'w') as output:
+            output.write(doc.get_provn())
+    elif format == 'rdf':
+        doc.serialize(path, format='rdf', rdf_format='trig')
+    else:
+        doc.serialize(path, format=format)
+    return path
+
+def submit_exports(json_path:str, formats:Sequence[str], max_workers:Optional[int]=None,
+                   multiprocessing_context:Optional[str]=None) -> Dict[str, Future]:
+    """
+    Starts rendering a PROV-JSON file to the given formats: a single one in a thread, several in a process pool,
+    one worker per format.
+
+    Args:
+        json_path (str): The path of the PROV-JSON file.
+        formats (Sequence[str]): The formats, from EXPORT_FORMATS.
+        max_workers (Optional[int]): The maximum number of worker processes. Defaults to None, the number of CPUs.
+        multiprocessing_context (Optional[str]): The start method of the workers. Defaults to None, the default start
+            method, which unlike spawn doesn't run the main module of the training script again.
+
+    Returns:
+        Dict[str, Future]: The future of each format, whose result is the path of its file.
+    """
+    unknown = [format for format in formats if format not in EXPORT_FORMATS]
+    if unknown:
+        raise ValueError(f'Unknown export formats {unknown}, the supported formats are {list(EXPORT_FORMATS)}')
+    formats = list(dict.fromkeys(formats))
+    if not formats:
+        return {}
+    executor = _executor(len(formats), max_workers, multiprocessing_context)
+    try:
+        return {format: executor.submit(render, json_path, format, export_path(json_path, format)) for format in formats}
+    except BrokenProcessPool:
+        #a worker died, e.g. killed by the OOM killer during an earlier export: the pool is replaced
+        with _lock:
+            for key, pool in list(_pools.items()):
+                if pool is executor:
+                    del _pools[key]
+        executor = _executor(len(formats), max_workers, multiprocessing_context)
+        return {format: executor.submit(render, json_path, format, export_path(json_path, format)) for format in formats}
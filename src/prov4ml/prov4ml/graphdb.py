@@ -0,0 +1,241 @@
+"""Bulk export of PROV-JSON documents to the import formats of graph databases.
+
+Records become nodes and relations become relationships, written straight from the PROV-JSON files without building
+``prov.model`` objects, nor even loading a whole document: each file is read in chunks and its records are decoded
+one at a time, so memory doesn't grow with the size or the number of the documents. Two formats are written, each as
+a nodes file and a relationships file in the output directory:
+
+* csv: the CSV files of ``neo4j-admin database import``, e.g.
+  ``neo4j-admin database import full --nodes=nodes.csv --relationships=relationships.csv``;
+* jsonl: JSON Lines in the layout of APOC's JSON export, one node or relationship per line, for apoc.import.json
+  or other loaders; the attributes are properties of their own.
+
+Node IDs are stable: ``{run_id}/{identifier}``, the scoping of prov4ml.query.ProvIndex, so that records with the same
+name in different runs stay distinct and exporting a document again gives the same IDs. Nodes are labelled with their
+kind (Entity, Activity, Agent) and their prov-ml:type; prov:level is kept as the level property, and the attributes,
+unwrapped with attribute_value, as the attributes property of the CSV files, a JSON object.
+"""
+import csv
+import json
+import os
+import re
+from typing import Any, Dict, IO, Iterable, Iterator, List, Tuple
+
+from .query import RELATION_ENDPOINTS, attribute_value
+
+GRAPH_FORMATS = ('csv', 'jsonl')
+
+_LABEL = re.compile(r'^\w+$')
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+class _JsonReader:
+    #incremental reader of the nested objects of a JSON document: only the current chunk and value are in memory
+    def __init__(self, stream:IO[str], chunk_size:int):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self._position = _WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._fill():
+                return ''
+
+    def _next(self, expected:str) -> str:
+        char = self.peek()
+        if char not in expected:
+            raise ValueError(f'Invalid PROV-JSON: expected one of {expected!r}, found {char!r}')
+        self._position += 1
+        return char
+
+    def value(self) -> Any:
+        #the values read are objects, lists and strings, which can't be mistaken for complete when cut by a chunk
+        self.peek()
+        while True:
+            try:
+                value, self._position = self._decoder.raw_decode(self._buffer, self._position)
+                return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+    def keys(self) -> Iterator[str]:
+        #iterates over the keys of an object, the caller reading the value of each key before the next one
+        self._next('{')
+        if self.peek() == '}':
+            self._position += 1
+            return
+        while True:
+            key = self.value()
+            self._next(':')
+            yield key
+            if self._next(',}') == '}':
+                return
+
+def iter_document(stream:IO[str], chunk_size:int=1 << 16) -> Iterator[Tuple[str, str, Any]]:
+    """
+    Iterates over the records of a PROV-JSON document, reading it in chunks.
+
+    Args:
+        stream (IO[str]): The document, as a text stream.
+        chunk_size (int): The number of characters read at a time. Defaults to 65536.
+
+    Yields:
+        Tuple[str, str, Any]: The kind, identifier and value of each record: its attributes, or a list of them for
+            a record declared more than once. The prefix section and bundles are skipped.
+    """
+    reader = _JsonReader(stream, chunk_size)
+    for kind in reader.keys():
+        if kind in ('prefix', 'bundle'):
+            reader.value()
+            continue
+        for identifier in reader.keys():
+            yield kind, identifier, reader.value()
+
+def _properties(attributes:Dict[str, Any]) -> Dict[str, Any]:
+    return {key: [attribute_value(item) for item in value] if isinstance(value, list) else attribute_value(value)
+            for key, value in attributes.items()}
+
+def _level(properties:Dict[str, Any]) -> Any:
+    level = properties.get('prov:level')
+    try:
+        return int(level)
+    except (TypeError, ValueError):
+        return None
+
+def _is_flat(value:Any) -> bool:
+    return isinstance(value, list) and all(isinstance(item, (str, int, float, bool)) for item in value)
+
+def _is_run(kind:str, value:Any) -> bool:
+    #the LearningStage entity gives the run ID of the document
+    return kind == 'entity' and isinstance(value, dict) and attribute_value(value.get('prov-ml:type')) == 'LearningStage'
+
+
+class _CsvWriter:
+    #neo4j-admin import files: property columns are typed in the header, labels are separated by semicolons
+    def __init__(self, directory:str):
+        self._files = [open(os.path.join(directory, name), 'w', newline='') for name in ('nodes.csv', 'relationships.csv')]
+        self._nodes, self._relationships = (csv.writer(file) for file in self._files)
+        self._nodes.writerow(['id:ID', ':LABEL', 'run_id', 'level:int', 'attributes'])
+        self._relationships.writerow([':START_ID', ':END_ID', ':TYPE', 'id', 'run_id', 'level:int', 'attributes'])
+
+    def node(self, identifier:str, labels:List[str], run_id:str, properties:Dict[str, Any]) -> None:
+        self._nodes.writerow([identifier, ';'.join(labels), run_id, _level(properties), json.dumps(properties, default=str)])
+
+    def relationship(self, identifier:str, kind:str, start:str, end:str, run_id:str, properties:Dict[str, Any]) -> None:
+        self._relationships.writerow([start, end, kind, identifier, run_id, _level(properties), json.dumps(properties, default=str)])
+
+    def close(self) -> None:
+        for file in self._files:
+            file.close()
+
+
+class _JsonlWriter:
+    #the line layout of apoc.export.json
+    def __init__(self, directory:str):
+        self._nodes, self._relationships = (open(os.path.join(directory, name), 'w') for name in ('nodes.jsonl', 'relationships.jsonl'))
+
+    @staticmethod
+    def _properties(run_id:str, properties:Dict[str, Any]) -> Dict[str, Any]:
+        #graph properties can't be maps: the attributes are flattened, and the values that are still maps encoded
+        flat = {key: json.dumps(value, default=str) if isinstance(value, (dict, list)) and not _is_flat(value) else value
+                for key, value in properties.items()}
+        return {'run_id': run_id, 'level': _level(properties), **flat}
+
+    def node(self, identifier:str, labels:List[str], run_id:str, properties:Dict[str, Any]) -> None:
+        self._nodes.write(json.dumps({'type': 'node', 'id': identifier, 'labels': labels,
+                                      'properties': self._properties(run_id, properties)}, default=str) + '\n')
+
+    def relationship(self, identifier:str, kind:str, start:str, end:str, run_id:str, properties:Dict[str, Any]) -> None:
+        self._relationships.write(json.dumps({'type': 'relationship', 'id': identifier, 'label': kind, 'start': {'id': start},
+                                              'end': {'id': end}, 'properties': self._properties(run_id, properties)}, default=str) + '\n')
+
+    def close(self) -> None:
+        self._nodes.close()
+        self._relationships.close()
+
+
+def _write_record(writer:Any, kind:str, identifier:str, value:Any, run_id:str) -> Tuple[int, int]:
+    scoped = lambda name: f'{run_id}/{name}'
+    occurrences = value if isinstance(value, list) else [value]
+    if kind in RELATION_ENDPOINTS:
+        subject_key, object_key = RELATION_ENDPOINTS[kind]
+        relationships = 0
+        for attributes in occurrences:
+            attributes = dict(attributes)
+            start, end = attributes.pop(subject_key, None), attributes.pop(object_key, None)
+            if start is None or end is None:
+                continue    #a relation without an endpoint has nothing to connect
+            writer.relationship(scoped(identifier), kind, scoped(start), scoped(end), run_id, _properties(attributes))
+            relationships += 1
+        return 0, relationships
+    attributes = {}
+    for occurrence in occurrences:    #a record declared more than once is one node, with the attributes of all
+        attributes.update(occurrence)
+    properties = _properties(attributes)
+    labels = [kind.capitalize()]
+    prov_type = properties.get('prov-ml:type')
+    if isinstance(prov_type, str) and _LABEL.match(prov_type) and prov_type not in labels:
+        labels.append(prov_type)
+    writer.node(scoped(identifier), labels, run_id, properties)
+    return 1, 0
+
+def export_graph(paths:Iterable[str], directory:str, format:str='csv', chunk_size:int=1 << 16) -> Tuple[int, int]:
+    """
+    Exports PROV-JSON documents to the bulk import files of a graph database, in a single streaming pass.
+
+    Args:
+        paths (Iterable[str]): The paths of the documents, e.g. the prov_graph.json of several runs.
+        directory (str): The output directory, created if needed.
+        format (str): csv, for neo4j-admin import, or jsonl. Defaults to csv.
+        chunk_size (int): The number of characters read at a time from each document. Defaults to 65536.
+
+    Returns:
+        Tuple[int, int]: The number of nodes and of relationships written.
+    """
+    if format not in GRAPH_FORMATS:
+        raise ValueError(f'Unknown graph format {format!r}, the formats are {GRAPH_FORMATS}')
+    os.makedirs(directory, exist_ok=True)
+    writer = _CsvWriter(directory) if format == 'csv' else _JsonlWriter(directory)
+    counts = [0, 0]
+
+    def write(records:Iterable[Tuple[str, str, Any]], run_id:str) -> None:
+        for kind, identifier, value in records:
+            nodes, relationships = _write_record(writer, kind, identifier, value, run_id)
+            counts[0] += nodes
+            counts[1] += relationships
+
+    try:
+        for i, path in enumerate(paths):
+            with open(path) as document:
+                #records are held back until the run ID is known; the run entity is the first record prov4ml writes
+                run_id, pending = None, []
+                for record in iter_document(document, chunk_size):
+                    if run_id is not None:
+                        write((record,), run_id)
+                    elif _is_run(record[0], record[2]):
+                        run_id = str(attribute_value(record[2].get('mlflow:run_id')))
+                        write([record, *pending], run_id)
+                        pending = []
+                    else:
+                        pending.append(record)
+                write(pending, str(i))    #no run entity: the document is scoped by its position, as in ProvIndex
+    finally:
+        writer.close()
+    return counts[0], counts[1]
@@ -0,0 +1,251 @@
+"""Crash-safe local journal of the metrics logged during a run.
+
+The provenance document is built when the run ends, so a training process that is killed never writes it, and
+rebuilding it afterwards reads the whole metric history back from the tracking server. With a journal, every batch
+of metrics written to MLflow is also appended as one JSON line to ``{journal_dir}/{run_id}.jsonl``:
+
+* each line is flushed to the operating system when it is appended, so it survives the death of the process, and
+  fsynced at most every fsync_interval seconds, so that a machine failure loses at most that much;
+* every segment_size points the journal file is sealed: it is fsynced and renamed to ``{run_id}.{n}.jsonl``, and
+  the next lines go to a new file. Sealed segments are never rewritten, so an append costs the same at the start of
+  a run and after millions of points;
+* when a segment is sealed, a checkpoint of it is written to ``{run_id}.{n}.checkpoint.json``: the points of the
+  segment as one column per field and key, the contexts of all the keys so far, the number of points of each key and
+  the number of segments it covers. Only the points of the current segment are kept in memory to write it, and it
+  is serialized and written by a background thread, so sealing doesn't stall the logging call that triggers it.
+
+The header of the run, what recover_run needs besides the metrics, is written once to ``{run_id}.header.json``.
+prov4ml.recover_run then rebuilds the metric histories from the checkpoints, and replays only the segments sealed
+after the last checkpoint and the journal file.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .contexts import ContextIndex
+
+JOURNAL_DIR = 'prov_journal'
+_HEADER_SUFFIX = '.header.json'
+_CHECKPOINT_SUFFIX = '.checkpoint.json'
+
+def _paths(journal_dir:str, run_id:str) -> Tuple[str, str]:
+    return os.path.join(journal_dir, f'{run_id}.jsonl'), os.path.join(journal_dir, f'{run_id}{_HEADER_SUFFIX}')
+
+def _segment_paths(journal_dir:str, run_id:str) -> List[str]:
+    #the sealed segments of a run, in the order they were written
+    prefix = f'{run_id}.'
+    numbers = sorted(int(name[len(prefix):-len('.jsonl')]) for name in os.listdir(journal_dir)
+                     if name.startswith(prefix) and name.endswith('.jsonl') and name[len(prefix):-len('.jsonl')].isdigit())
+    return [os.path.join(journal_dir, f'{run_id}.{number}.jsonl') for number in numbers]
+
+def _checkpoint_path(journal_dir:str, run_id:str, segment:int) -> str:
+    return os.path.join(journal_dir, f'{run_id}.{segment}{_CHECKPOINT_SUFFIX}')
+
+def _write_atomically(path:str, content:Dict[str, Any]) -> None:
+    #write-and-rename, so that a crash leaves either no file or the whole file
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as temporary_file:
+        temporary_file.write(json.dumps(content))
+        temporary_file.flush()
+        os.fsync(temporary_file.fileno())
+    os.replace(temporary_path, path)
+
+def _write_checkpoint(path:str, content:Dict[str, Any], histories:Dict[str, Tuple[List[Any], ...]], chunk_size:int=4096) -> None:
+    #the json encoder holds the GIL for a whole call: the columns are encoded a chunk at a time, so that writing a
+    #checkpoint in the background doesn't stall the training thread for the whole segment
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as temporary_file:
+        temporary_file.write(json.dumps(content)[:-1] + ', "histories": {')
+        for i, (key, columns) in enumerate(histories.items()):
+            temporary_file.write(f'{", " if i else ""}{json.dumps(key)}: [')
+            for j, column in enumerate(columns):
+                temporary_file.write(', [' if j else '[')
+                temporary_file.write(', '.join(json.dumps(column[start:start + chunk_size])[1:-1]
+                                               for start in range(0, len(column), chunk_size)))
+                temporary_file.write(']')
+            temporary_file.write(']')
+        temporary_file.write('}}')
+        temporary_file.flush()
+        os.fsync(temporary_file.fileno())
+    os.replace(temporary_path, path)
+
+def pending_runs(journal_dir:str=JOURNAL_DIR) -> List[str]:
+    """
+    Returns the IDs of the runs with a journal, i.e. the runs that didn't end normally.
+
+    Args:
+        journal_dir (str): The directory of the journals. Defaults to prov_journal.
+
+    Returns:
+        List[str]: The run IDs.
+    """
+    if not os.path.isdir(journal_dir):
+        return []
+    return sorted(name[:-len(_HEADER_SUFFIX)] for name in os.listdir(journal_dir) if name.endswith(_HEADER_SUFFIX))
+
+
+class Journal:
+    """Append-only journal of the metrics of a run, in segments.
+
+    Args:
+        run_id (str): The ID of the run.
+        header (Dict[str, Any]): What is needed to build the document of the run besides MLflow, e.g. the namespace
+            and the options given to start_run. Must be JSON-serializable.
+        journal_dir (str): The directory of the journals. Defaults to prov_journal.
+        fsync_interval (float): The maximum time, in seconds, between an append and the fsync that persists it. Defaults to 1.0.
+        segment_size (int): The number of metric points after which the journal file is sealed as a segment. Defaults to 100000.
+    """
+    def __init__(self, run_id:str, header:Dict[str, Any], journal_dir:str=JOURNAL_DIR, fsync_interval:float=1.0, segment_size:int=100000):
+        self.run_id = run_id
+        self.header = header
+        self.fsync_interval = fsync_interval
+        self.segment_size = segment_size
+        self.journal_dir = journal_dir
+        self._journal_path, self._header_path = _paths(journal_dir, run_id)
+        self._lock = threading.Lock()
+        self._segments = 0
+        self._in_segment = 0
+        self._contexts = ContextIndex()    #of all the points, for the checkpoints
+        self._counts: Dict[str, int] = {}
+        self._columns: Dict[str, Tuple[List[float], List[int], List[int]]] = {}    #of the points of the current segment
+        #one thread, so that the checkpoints are written in order; a checkpoint that isn't written only means that
+        #its segment is replayed
+        self._checkpoints = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prov4ml-journal')
+
+        os.makedirs(journal_dir, exist_ok=True)
+        Journal.discard(run_id, journal_dir)    #the segments of a previous session were recovered or are obsolete
+        _write_atomically(self._header_path, {'run_id': run_id, 'header': header})    #no header, and no journal, or the whole header
+        self._file = open(self._journal_path, 'w')
+        self._last_fsync = time.monotonic()
+
+    def append_metrics(self, metrics:Iterable[Any], contexts:Iterable[str]) -> None:
+        """
+        Appends a batch of metrics, as written to MLflow with log_batch.
+
+        Args:
+            metrics (Iterable[Metric]): The metrics.
+            contexts (Iterable[str]): The name of the context of each metric.
+        """
+        points = [[metric.key, metric.value, metric.step, metric.timestamp, context] for metric, context in zip(metrics, contexts)]
+        if not points:
+            return
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(json.dumps({'metrics': points}) + '\n')
+            self._file.flush()
+            for key, value, step, timestamp, context in points:
+                self._contexts.add(key, context, step)
+                values, steps, timestamps = self._columns.setdefault(key, ([], [], []))
+                values.append(value)
+                steps.append(step)
+                timestamps.append(timestamp)
+            self._in_segment += len(points)
+            if self._in_segment >= self.segment_size:
+                self._seal()
+            elif time.monotonic() - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._last_fsync = time.monotonic()
+
+    def close(self) -> None:
+        """
+        Persists the appended metrics and closes the journal, once the pending checkpoints are written. The files
+        are kept until remove is called.
+        """
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+        self._checkpoints.shutdown(wait=True)
+
+    def remove(self) -> None:
+        """
+        Closes the journal and deletes its files, once the document of the run is written.
+        """
+        self.close()
+        Journal.discard(self.run_id, self.journal_dir)
+
+    def _seal(self) -> None:
+        #the fsync only persists what was appended since the last one; the rename is atomic, so a crash leaves the
+        #lines either in the journal file or in the segment
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._journal_path, os.path.join(self.journal_dir, f'{self.run_id}.{self._segments}.jsonl'))
+        #a crash before the checkpoint is written leaves the segment to be replayed
+        for key, (values, _, _) in self._columns.items():
+            self._counts[key] = self._counts.get(key, 0) + len(values)
+        self._checkpoints.submit(_write_checkpoint, _checkpoint_path(self.journal_dir, self.run_id, self._segments), {
+            'segments': self._segments + 1,
+            'contexts': self._contexts.to_json(),
+            'counts': dict(self._counts),
+        }, self._columns)
+        self._columns = {}
+        self._segments += 1
+        self._in_segment = 0
+        self._file = open(self._journal_path, 'w')
+        self._last_fsync = time.monotonic()
+
+    @staticmethod
+    def read(run_id:str, journal_dir:str=JOURNAL_DIR) -> Tuple[Dict[str, Any], ContextIndex, Dict[str, List[Tuple[float, int, int]]]]:
+        """
+        Reads the journal of a run: the points of its checkpoints, the contexts of the last one, then the segments
+        sealed after it and the journal file, in order.
+
+        A line cut short by the crash is ignored.
+
+        Args:
+            run_id (str): The ID of the run.
+            journal_dir (str): The directory of the journals. Defaults to prov_journal.
+
+        Returns:
+            Tuple: The header, the contexts of the metric keys and the (value, step, timestamp) points of each key.
+        """
+        journal_path, header_path = _paths(journal_dir, run_id)
+        with open(header_path) as header_file:
+            header = json.load(header_file)['header']
+        contexts = ContextIndex()
+        histories: Dict[str, List[Tuple[float, int, int]]] = {}
+        #the checkpoints of the first segments, up to the first one missing
+        checkpointed = 0
+        checkpoint = None
+        while os.path.exists(_checkpoint_path(journal_dir, run_id, checkpointed)):
+            with open(_checkpoint_path(journal_dir, run_id, checkpointed)) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            for key, (values, steps, timestamps) in checkpoint['histories'].items():
+                histories.setdefault(key, []).extend(zip(values, steps, timestamps))
+            checkpointed += 1
+        if checkpoint is not None and {key: len(points) for key, points in histories.items()} == checkpoint['counts']:
+            contexts = ContextIndex.from_json(checkpoint['contexts'])
+        else:
+            histories, checkpointed = {}, 0    #incomplete checkpoints, every segment is replayed
+        for path in _segment_paths(journal_dir, run_id)[checkpointed:] + [journal_path]:
+            if not os.path.exists(path):
+                continue    #the process died while sealing a segment, after the rename
+            with open(path) as journal_file:
+                for line in journal_file:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        break
+                    for key, value, step, timestamp, context in event['metrics']:
+                        contexts.add(key, context, step)
+                        histories.setdefault(key, []).append((value, step, timestamp))
+        return header, contexts, histories
+
+    @staticmethod
+    def discard(run_id:str, journal_dir:str=JOURNAL_DIR) -> None:
+        """
+        Deletes the journal files of a run.
+        """
+        if not os.path.isdir(journal_dir):
+            return
+        prefix = f'{run_id}.'
+        checkpoints = [os.path.join(journal_dir, name) for name in os.listdir(journal_dir)
+                       if name.startswith(prefix) and name.endswith((_CHECKPOINT_SUFFIX, f'{_CHECKPOINT_SUFFIX}.tmp'))]
+        for path in [*_paths(journal_dir, run_id), *_segment_paths(journal_dir, run_id), *checkpoints]:
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,75 +1,321 @@
+from __future__ import annotations
+
+from concurrent.futures import Future,ThreadPoolExecutor,as_completed
 from contextlib import contextmanager
-import mlflow
-from mlflow import ActiveRun
-from mlflow.entities import Metric,RunTag,Run
-from mlflow.entities.file_info import FileInfo
-from mlflow.utils.time import get_current_time_millis
-from mlflow.utils.async_logging.run_operations import RunOperations
-import prov.model as prov
-import prov.dot as dot
 
+import os
+import json
+import warnings
 from datetime import datetime
-from typing import Optional,Dict,Tuple,Any,List
+from typing import Optional,Dict,Tuple,Any,List,Callable,Union,TYPE_CHECKING
 from enum import Enum
 
 from collections import namedtuple
+from functools import partial
+from itertools import islice
+
+from .batching import iter_batches
+from .best import BestTracker
+from .buffer import MetricBuffer,is_tensor,materialize
+from .channel import MetricChannel
+from .checksum import ArtifactChecksum,ChecksumCache,artifact_checksums,local_artifact_root
+from .contexts import CONTEXTS_TAG,ContextIndex,IndexWriter,MetricContext,get_context,register_context
+from .events import ProvEventStream
+from .journal import JOURNAL_DIR,Journal,pending_runs
+from .export import submit_exports
+from .query import MetricNumbering,metric_identifier
+from .records import RecordStore
+from .sampling import EveryNth,MetricPolicy,MetricSampler,Throttle,Window
+from .snapshot import RunSnapshot,traverse_artifact_tree
+
+#mlflow, prov and pydot take seconds to import: they are imported by the functions that use them, so that processes
+#which only need Context or never log (e.g. DataLoader workers) don't pay for them
+if TYPE_CHECKING:
+    import mlflow
+    from mlflow import ActiveRun
+    from mlflow.entities import Metric,Run
+    from mlflow.entities.file_info import FileInfo
+    from mlflow.utils.async_logging.run_operations import RunOperations
+    import prov.model as prov
 
 lv_attr = namedtuple('lv_attr', ['level', 'value'])
 LVL_1 = "1"
 LVL_2 = "2"
 
+PROV_GRAPH_PATH = 'prov_graph.json'
+PROV_STATE_PATH = 'prov_state.json'
+PROV_CHECKSUMS_PATH = 'prov_checksums.json'
+#artifact directory of the uploaded outputs, which is not itself described by the document
+PROV_ARTIFACT_PATH = 'prov'
+
+#the asyncio API (prov4ml.aio) is imported on first use
+_LAZY_ATTRIBUTES = {
+    'astart_run': 'aio',
+    'alog_metric': 'aio',
+    'alog_metrics': 'aio',
+    'run_sweep': 'sweep',
+    'TrialResult': 'sweep',
+}
+
+def __getattr__(name:str) -> Any:
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+        return getattr(importlib.import_module(f'.{_LAZY_ATTRIBUTES[name]}',__package__),name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 class Context(Enum):
     """Enumeration class for defining the context of the metric when saved using log_metrics.
 
+    Other contexts, e.g. one per DataLoader, are registered with register_context (see prov4ml.contexts) and given
+    to log_metric and log_metrics like the members of this class.
+
     Attributes:
         TRAINING (str): The context for training metrics.
         EVALUATION (str): The context for evaluation metrics.
+        VALIDATION (str): The context for validation metrics, e.g. the ones used for early stopping.
+        TEST (str): The context for the metrics of the final test.
+        DATA_PREPARATION (str): The context for data loading and preprocessing metrics, e.g. the ones logged by DataLoader workers.
     """
     TRAINING = 'training'
     EVALUATION = 'evaluation'
+    VALIDATION = 'validation'
+    TEST = 'test'
+    DATA_PREPARATION = 'data_preparation'
+
+#prefix and prov-ml:type of the step activities of the built-in contexts; the metrics of DATA_PREPARATION are
+#generated by the data_preparation activity instead
+register_context(Context.TRAINING.name,'train','TrainingExecution')
+register_context(Context.EVALUATION.name,'test','EvaluationExecution')
+register_context(Context.VALIDATION.name,'val','ValidationExecution')
+register_context(Context.TEST.name,'final_test','TestExecution')
+register_context(Context.DATA_PREPARATION.name)
 
-def traverse_artifact_tree(client:mlflow.MlflowClient,run_id:str,path=None) -> List[FileInfo]:
+class ProvState:
+    """Compact summary of an already generated provenance document.
+
+    It is saved next to the document at the end of each run and used to extend the document
+    incrementally when the same run is resumed, instead of regenerating it from scratch.
+
+    Attributes:
+        run_id (str): The ID of the run the document belongs to.
+        metric_counts (Dict[str, int]): The number of recorded points of each metric.
     """
-    Recursively traverses the artifact tree of a given run in MLflow and returns a list of FileInfo objects.
+    def __init__(self, run_id:str, metric_counts:Optional[Dict[str,int]]=None):
+        self.run_id = run_id
+        self.metric_counts = metric_counts or {}
+
+    @classmethod
+    def load(cls, path:str, run_id:str) -> Optional['ProvState']:
+        """
+        Loads the state saved at the given path.
+
+        Args:
+            path (str): The path of the state file.
+            run_id (str): The ID of the run being resumed.
+
+        Returns:
+            Optional[ProvState]: The saved state, None if the file does not exist, belongs to another run or was saved
+                by a previous version, with the last step of each metric instead of the number of points.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path) as state_file:
+            saved = json.load(state_file)
+        if saved.get('run_id') != run_id or 'metric_counts' not in saved:
+            return None
+        return cls(run_id, saved['metric_counts'])
+
+    def save(self, path:str) -> None:
+        """
+        Saves the state to the given path.
+
+        Args:
+            path (str): The path of the state file.
+        """
+        with open(path, 'w') as state_file:
+            json.dump({'run_id': self.run_id, 'metric_counts': self.metric_counts}, state_file)
+
+class _RunState:
+    """In-process state of a run started with start_run, kept until its provenance is written.
 
-    Args:
-        client (mlflow.MlflowClient): The MLflow client object.
+    Attributes:
         run_id (str): The ID of the run.
-        path (str, optional): The path to start the traversal from. Defaults to None.
-
-    Returns:
-        List[FileInfo]: A list of FileInfo objects representing the artifacts in the tree.
-    """    
-    artifact_list=client.list_artifacts(run_id,path)
-    artifact_paths=[]
-    for artifact in artifact_list:
-        if artifact.is_dir:
-            artifact_paths.extend(traverse_artifact_tree(client,run_id,artifact.path))
+        prov_user_namespace (str): The default namespace of the document.
+        resumed (bool): Whether the run was resumed through its run_id.
+        buffer (MetricBuffer): The metric points whose values are tensors not materialized yet.
+        channel (Optional[MetricChannel]): The channel opened by metric_channel, if any.
+        journal (Optional[Journal]): The journal the written metrics are appended to, if enabled.
+        sampler (Optional[MetricSampler]): The sampling policies of the metrics, if any.
+        best (Optional[BestTracker]): The best point of the metrics with an objective, if any.
+        events (Optional[ProvEventStream]): The live stream of the provenance events of the run, if enabled.
+        contexts (ContextIndex): The contexts of the metric keys written by this session of the run, and their steps.
+        earlier_contexts (Optional[ContextIndex]): The contexts written by the sessions before a resume, if resumed.
+        contexts_writer (IndexWriter): Writes the contexts of all the sessions when a key or a context of a key is new.
+        options (Dict[str, Any]): The provenance options given to start_run, with output_dir resolved for the run.
+        builders (List[Callable[[RecordStore, Run], None]]): Functions adding records of their own to the document,
+            called after the first and second levels, e.g. the trials of a sweep in the document of its parent run.
+    """
+    def __init__(self, run_id:str, prov_user_namespace:str, resumed:bool, **options):
+        self.run_id = run_id
+        self.prov_user_namespace = prov_user_namespace
+        self.resumed = resumed
+        self.buffer = MetricBuffer(run_id)
+        self.channel: Optional[MetricChannel] = None
+        self.journal: Optional[Journal] = None
+        self.sampler: Optional[MetricSampler] = None
+        self.best = BestTracker(options['objectives']) if options.get('objectives') else None
+        self.events: Optional[ProvEventStream] = None
+        self.contexts = ContextIndex()
+        self.earlier_contexts: Optional[ContextIndex] = None
+        self.contexts_writer = IndexWriter(run_id,self.run_contexts)
+        self.options = options
+        self.builders: List[Callable[[RecordStore,Any],None]] = []
+
+    def path(self, name:str) -> str:
+        """
+        Returns the path of an output file of the run, in its output directory.
+        """
+        return os.path.join(self.options['output_dir'],name)
+
+    def run_contexts(self) -> ContextIndex:
+        """
+        Returns the contexts of the metric keys of all the sessions of the run.
+        """
+        if self.earlier_contexts is None:
+            return self.contexts
+        index = ContextIndex()
+        index.update(self.earlier_contexts)
+        index.update(self.contexts)
+        return index
+
+    def append_metrics(self, metrics:List[Any], contexts:List[str]) -> None:
+        """
+        Observes a batch of metrics written to MLflow, with the name of the context of each: indexes their contexts,
+        appends them to the journal, updates the best points and publishes them to the event stream.
+        """
+        if self.contexts.add_points(metrics,contexts):
+            #also written soon after a key or a context of a key is new, so that a run killed before it ends has them
+            self.contexts_writer.mark()
+        if self.journal is not None:
+            self.journal.append_metrics(metrics,contexts)
+        if self.best is not None:
+            self.best.append_metrics(metrics)
+        if self.events is not None:
+            self.events.metrics(metrics,contexts)
+
+    def summary_tags(self) -> List[Any]:
+        """
+        Returns the tags summarizing the metrics of the run, written when it ends.
+        """
+        from mlflow.entities import RunTag
+
+        tags = []
+        if self.sampler is not None:
+            #the raw and logged point counts of the sampled metrics, for auditing
+            tags += [RunTag(f'metric.{count}_count.{key}',str(value)) for key,counts in sorted(self.sampler.counts.items())
+                     for count,value in zip(('raw','logged'),counts)]
+        if self.best is not None:
+            tags += [RunTag(key,value) for key,value in self.best.tags().items()]
+        return tags
+
+    def close(self) -> None:
+        """
+        Writes everything still pending, before the run ends.
+
+        Raises:
+            RuntimeError: If the metrics of the channel could not all be written, once everything else is.
+        """
+        error = None
+        if self.channel is not None:
+            try:
+                self.channel.close()
+            except RuntimeError as channel_error:
+                error = channel_error
+        if self.sampler is not None:
+            for key,value,step,timestamp,context in self.sampler.flush():
+                self.buffer.add(key,value,step,timestamp,context)
+        self.buffer.flush()
+        import mlflow
+
+        client = mlflow.MlflowClient()
+        for _,batch_tags in iter_batches([],self.summary_tags()):
+            client.log_batch(self.run_id,tags=batch_tags)
+        self.contexts_writer.close()    #one tag for all the keys, instead of one per key
+        if error is not None:
+            raise error
+
+#state of the runs started with start_run that haven't ended yet, by run ID
+_run_states: Dict[str,_RunState] = {}
+
+def _active_run_state() -> Optional[_RunState]:
+    import mlflow
+
+    active_run = mlflow.active_run()
+    return _run_states.get(active_run.info.run_id) if active_run is not None else None
+
+def _metric_batch(metrics:Dict[str,Tuple[float,Context]],step:Optional[int]=None,timestamp:Optional[int]=None) -> Optional[Tuple[str,List[Any],List[str]]]:
+    #buffers the tensor values, or all of them with batch_metrics, and returns the run ID, metrics and context names
+    #to log now, None if there is nothing to log now
+    import mlflow
+    from mlflow.entities import Metric
+    from mlflow.utils.time import get_current_time_millis
+
+    timestamp=timestamp or get_current_time_millis()
+    state=_active_run_state()
+    if state is not None and state.sampler is not None:
+        sampled={}
+        for key,(value,context) in metrics.items():
+            point=state.sampler.add(key,value,step or 0,timestamp,context.name)
+            if point is not None:
+                sampled[key]=(point[0],context)    #the step and timestamp of a logged point are the ones of this call
+        metrics=sampled
+        if not metrics:
+            return None
+    batched=state is not None and state.options.get('batch_metrics',False)
+    deferred={key:(value,context) for key,(value,context) in metrics.items() if batched or is_tensor(value)}
+    if deferred:
+        if state is not None:
+            for key,(value,context) in deferred.items():
+                state.buffer.add(key,value,step or 0,timestamp,context.name)
+            metrics={key:metric for key,metric in metrics.items() if key not in deferred}
+            if not metrics:
+                return None
         else:
-            artifact_paths.append(artifact)
-    return artifact_paths
+            values=materialize([value for value,_ in deferred.values()])
+            metrics={**metrics,**{key:(value,context) for (key,(_,context)),value in zip(deferred.items(),values)}}
 
+    #the contexts aren't logged as one tag per key: they are indexed, see _context_tags
+    metrics_arr=[Metric(key,value,timestamp,step or 0) for key,(value,context) in metrics.items()]
+    context_arr=[context.name for value,context in metrics.values()]
+    return mlflow.active_run().info.run_id,metrics_arr,context_arr
 
 def log_metrics(metrics:Dict[str,Tuple[float,Context]],step:Optional[int]=None,synchronous:bool=True) -> Optional[RunOperations]:
     """
     Logs the given metrics and their associated contexts to the active MLflow run.
 
+    Values can also be single-element tensors: in a run started with start_run they are kept on their device and
+    materialized together with the other buffered values when the buffer is flushed (see flush_metrics), instead of
+    forcing a device synchronization on every call.
+
     Parameters:
-        metrics (Dict[str, Tuple[float, Context]]): A dictionary containing the metrics and their associated contexts.
+        metrics (Dict[str, Tuple[float, Context]]): A dictionary containing the metrics and their associated contexts,
+            members of Context or contexts registered with register_context.
         step (Optional[int]): The step number for the metrics. Defaults to None.
         synchronous (bool): Whether to log the metrics synchronously or asynchronously. Defaults to True.
 
     Returns:
         Optional[RunOperations]: The run operations object if logging is successful, None otherwise.
     """
-    #create two separate lists, one for metrics and one for tags, and log them together using native log.batch
-    client= mlflow.MlflowClient()
+    import mlflow
 
-    timestamp=get_current_time_millis()
-    metrics_arr=[Metric(key,value,timestamp,step or 0) for key,(value,context) in metrics.items()]
-    tag_arr=[RunTag(f'metric.context.{key}',context.name) for key,(value,context) in metrics.items()]
-
-    return client.log_batch(mlflow.active_run().info.run_id,metrics=metrics_arr,tags=tag_arr,synchronous=synchronous)
+    batch = _metric_batch(metrics,step)
+    if batch is None:
+        return None
+    run_id,metrics_arr,context_arr = batch
+    client = mlflow.MlflowClient()
+    operations = client.log_batch(run_id,metrics=metrics_arr,tags=_context_tags(client,run_id,metrics_arr,context_arr),synchronous=synchronous)
+    _journal(run_id,metrics_arr,context_arr)
+    return operations
 
 def log_metric(key: str, value: float, context:Context, step: Optional[int] = None, synchronous: bool = True, timestamp: Optional[int] = None) -> Optional[RunOperations]:
     """
@@ -77,8 +323,8 @@ def log_metric(key: str, value: float, context:Context, step: Optional[int] = No
 
     Args:
         key (str): The key of the metric.
-        value (float): The value of the metric.
-        context (Context): The context of the metric.
+        value (float): The value of the metric, or a single-element tensor, buffered as in log_metrics.
+        context (Context): The context of the metric, a member of Context or a context registered with register_context.
         step (Optional[int], optional): The step of the metric. Defaults to None.
         synchronous (bool, optional): Whether to log the metric synchronously. Defaults to True.
         timestamp (Optional[int], optional): The timestamp of the metric. Defaults to None.
@@ -87,77 +333,323 @@ def log_metric(key: str, value: float, context:Context, step: Optional[int] = No
         Optional[RunOperations]: The run operations object.
 
     """
+    import mlflow
+
+    batch = _metric_batch({key:(value,context)},step,timestamp)
+    if batch is None:
+        return None
+    run_id,metrics_arr,context_arr = batch
     client = mlflow.MlflowClient()
-    client.set_tag(mlflow.active_run().info.run_id,f'metric.context.{key}',context.name)
-    return client.log_metric(mlflow.active_run().info.run_id,key,value,step=step or 0,synchronous=synchronous,timestamp=timestamp or get_current_time_millis())
+    operations = client.log_batch(run_id,metrics=metrics_arr,tags=_context_tags(client,run_id,metrics_arr,context_arr),synchronous=synchronous)
+    _journal(run_id,metrics_arr,context_arr)
+    return operations
+
+
+
+def flush_metrics(synchronous:bool=True) -> Optional[RunOperations]:
+    """
+    Materializes the tensor values buffered by log_metric and log_metrics and writes them to the active run.
+
+    The buffer is also flushed when it holds 1000 points and when the run started with start_run ends.
+
+    Args:
+        synchronous (bool): Whether to write synchronously. Defaults to True.
 
+    Returns:
+        Optional[RunOperations]: The run operations object, None if there was nothing to write or it was written synchronously.
+    """
+    state = _active_run_state()
+    if state is None:
+        return None
+    operations = state.buffer.flush(synchronous)
+    state.contexts_writer.flush()    #the contexts of the new keys, if they aren't written yet
+    return operations
+
+def metric_counts() -> Dict[str,Tuple[int,int]]:
+    """
+    Returns the number of points logged and actually written so far for each metric of the active run with a
+    sampling policy (see the metric_policies argument of start_run).
 
+    The final counts are also written as the metric.raw_count.{key} and metric.logged_count.{key} tags of the run
+    when it ends.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: The raw and logged point counts of each key.
+    """
+    state = _active_run_state()
+    return state.sampler.counts if state is not None and state.sampler is not None else {}
+
+#contexts of the runs not started with start_run, e.g. with mlflow.start_run, whose end prov4ml doesn't see
+_unmanaged_contexts: Dict[str,Tuple[ContextIndex,IndexWriter]] = {}
+
+def _context_tags(client:Any, run_id:str, metrics:List[Any], contexts:List[str]) -> List[Any]:
+    #the tags to write with a batch of metrics: none for the runs started with start_run, which write their context
+    #index themselves; for the others, whose end isn't seen, the whole index when a key or a context of a key is new,
+    #if it fits in a tag, and the steps logged since in the background, by its writer
+    if run_id in _run_states:
+        return []
+    from mlflow.entities import RunTag
+
+    if run_id not in _unmanaged_contexts:
+        index = ContextIndex()
+        _unmanaged_contexts[run_id] = index,IndexWriter(run_id,lambda: index,client=client)
+    index,writer = _unmanaged_contexts[run_id]
+    new = index.add_points(metrics,contexts)
+    writer.mark()
+    content = index.tag_content() if new else None
+    return [RunTag(CONTEXTS_TAG,content)] if content is not None else []    #too large for a tag, the writer uploads it
+
+def _journal(run_id:str, metrics:List[Any], contexts:List[str]) -> None:
+    #passes the metrics written to MLflow and their contexts to the state of their run, for its context index, its
+    #journal and its best points
+    state = _run_states.get(run_id)
+    if state is not None:
+        state.append_metrics(metrics,contexts)
+
+def _as_list(values:Any, dtype:str) -> List[Any]:
+    #tensors are copied to host once and numpy arrays converted in C, without a Python call per element
+    if hasattr(values,'detach'):
+        values = values.detach().cpu().numpy()
+    if hasattr(values,'astype') and hasattr(values,'tolist'):
+        return values.astype(dtype,copy=False).ravel().tolist()
+    return list(values)
+
+def log_metric_series(key:str, values:Any, steps:Optional[Any]=None, timestamps:Optional[Any]=None, context:Context=Context.TRAINING, synchronous:bool=True) -> Optional[RunOperations]:
+    """
+    Logs a whole series of values of a metric, e.g. per-sample losses or a precomputed curve, with as few requests as possible.
+
+    Args:
+        key (str): The key of the metric.
+        values (Any): The values, as a sequence, a NumPy array or a CPU tensor. Arrays and tensors are flattened.
+        steps (Optional[Any]): The step of each value, in the same forms. Defaults to None, the positions of the values.
+        timestamps (Optional[Any]): The timestamp of each value, in milliseconds. Defaults to None, the current time for all.
+        context (Context): The context of the metric. Defaults to Context.TRAINING.
+        synchronous (bool): Whether to log the series synchronously. Defaults to True.
+
+    Returns:
+        Optional[RunOperations]: The run operations object, None if the series was logged synchronously.
+    """
+    import mlflow
+    from mlflow.entities import Metric
+    from mlflow.utils.async_logging.run_operations import get_combined_run_operations
+    from mlflow.utils.time import get_current_time_millis
+
+    values = _as_list(values,'float64')
+    steps = _as_list(steps,'int64') if steps is not None else range(len(values))
+    timestamps = _as_list(timestamps,'int64') if timestamps is not None else [get_current_time_millis()]*len(values)
+    if not len(values) == len(steps) == len(timestamps):
+        raise ValueError(f'{key}: got {len(values)} values, {len(steps)} steps and {len(timestamps)} timestamps')
+
+    client = mlflow.MlflowClient()
+    run_id = mlflow.active_run().info.run_id
+    metrics = [Metric(key,value,timestamp,step) for value,timestamp,step in zip(values,timestamps,steps)]
+    operations = []
+    for batch_metrics,_ in iter_batches(metrics):
+        batch_contexts = [context.name]*len(batch_metrics)
+        operations.append(client.log_batch(run_id,metrics=batch_metrics,tags=_context_tags(client,run_id,batch_metrics,batch_contexts),
+                                           synchronous=synchronous))
+        _journal(run_id,batch_metrics,batch_contexts)
+    return get_combined_run_operations(operations)
+
+def log_checkpoint(local_path:str, step:int, artifact_path:str='checkpoints') -> str:
+    """
+    Logs a checkpoint file as an artifact of the active run, recording the step it was saved at.
+
+    The step is recorded as the checkpoint.{step} tag of the run, so that the checkpoint of the best step of a metric
+    with an objective (see the objectives of start_run) is linked to its BestEvaluation entity.
+
+    Args:
+        local_path (str): The path of the checkpoint file.
+        step (int): The step the checkpoint was saved at.
+        artifact_path (str): The artifact directory of the checkpoint. Defaults to checkpoints.
+
+    Returns:
+        str: The artifact path of the checkpoint, the identifier of its entity.
+    """
+    import mlflow
+
+    mlflow.log_artifact(local_path,artifact_path)
+    path = f'{artifact_path}/{os.path.basename(local_path)}'
+    mlflow.set_tag(f'checkpoint.{step}',path)
+    state = _active_run_state()
+    if state is not None and state.events is not None:
+        state.events.artifact(path,step)
+    return path
+
+def best_metrics() -> Dict[str,Tuple[float,int]]:
+    """
+    Returns the best value so far of each metric with an objective in the active run, and the step it was logged at.
+
+    Only the points written to MLflow are compared: buffered and sampled points count once they are written.
+
+    Returns:
+        Dict[str, Tuple[float, int]]: The best value and its step, by key.
+    """
+    state = _active_run_state()
+    if state is None or state.best is None:
+        return {}
+    return {key: (value,step) for key,(value,step,_) in state.best.best.items()}
 
-def first_level_prov(run:Run, doc: prov.ProvDocument) -> prov.ProvDocument:
+def metric_channel(multiprocessing_context:Optional[str]=None) -> MetricChannel:
+    """
+    Returns the channel through which other processes, such as DataLoader workers, log metrics into the active run.
+
+    The channel is opened on the first call and drained into MLflow by a thread of the calling process until the run
+    started with start_run ends. Its metrics are logged with the DATA_PREPARATION context.
+
+    Example:
+        channel = prov4ml.metric_channel()
+        dataset = MyDataset(..., channel=channel)   #in __getitem__: self.channel.log_metric('decode_time', t)
+        loader = DataLoader(dataset, num_workers=4)
+
+    Args:
+        multiprocessing_context (Optional[str]): The start method of the worker processes, as passed to the DataLoader
+            or multiprocessing.get_context. Only used when the channel is opened. Defaults to None, the default start method.
+
+    Returns:
+        MetricChannel: The channel of the active run.
+    """
+    state = _active_run_state()
+    if state is None:
+        raise RuntimeError('metric_channel needs an active run started with prov4ml.start_run')
+    if state.channel is None:
+        state.channel = MetricChannel(state.run_id, Context.DATA_PREPARATION.name, multiprocessing_context=multiprocessing_context)
+        state.channel.journal = state
+        state.channel.start()
+    return state.channel
+
+
+def _gather_snapshot(run:Run, state:Optional[ProvState]) -> RunSnapshot:
+    import mlflow
+
+    return RunSnapshot.gather(mlflow.MlflowClient(),run.info.run_id,run=run,metric_counts=state.metric_counts if state is not None else None)
+
+def metric_repetitions(history:List[Metric]) -> List[int]:
+    """
+    Returns the number of earlier points of a metric at the step of each of its points, 0 but for the repetitions of
+    a step logged more than once.
+
+    Args:
+        history (List[Metric]): The points of the metric.
+
+    Returns:
+        List[int]: The number of each point at its step.
+    """
+    numbering = MetricNumbering()
+    return [numbering.number(metric.key,metric.step) for metric in history]
+
+def metric_identifiers(history:List[Metric]) -> List[str]:
+    """
+    Returns the identifiers of the entities of the points of a metric: {key}_{step}, and {key}_{step}_{n} for the
+    n-th repetition of a step logged more than once, e.g. by log_metric calls without a step.
+
+    Args:
+        history (List[Metric]): The points of the metric.
+
+    Returns:
+        List[str]: The identifier of each point.
+    """
+    return [metric_identifier(metric.key,metric.step,n) for metric,n in zip(history,metric_repetitions(history))]
+
+def first_level_prov(run:Run, doc: prov.ProvDocument, state:Optional[ProvState]=None, snapshot:Optional[RunSnapshot]=None,
+                     step_ranges:Optional[Dict[Tuple[str,str],Dict[int,int]]]=None, contexts:Optional[ContextIndex]=None) -> prov.ProvDocument:
     """
     Generates the first level of provenance for a given run.
 
     Args:
         run (Run): The run object.
-        doc (prov.ProvDocument): The provenance document.
+        doc (prov.ProvDocument): The provenance document, or a RecordStore.
+        state (Optional[ProvState]): The state of the document, if it was previously generated for the same run and
+            is being extended. Only the records that are not already in the document are added. Defaults to None.
+        snapshot (Optional[RunSnapshot]): The MLflow data of the run, shared with second_level_prov. Defaults to None,
+            gathered by the function.
+        step_ranges (Optional[Dict[Tuple[str, str], Dict[int, int]]]): For the metrics logged with a Window policy, by
+            key and context name, the first step of the window aggregated by the point logged at each step, recorded
+            as the prov-ml:step_range attribute of its entity. Defaults to None.
+        contexts (Optional[ContextIndex]): The contexts of the metric keys, which tell apart the step ranges of a key
+            aggregated in several contexts. Defaults to None, read from the run if needed.
 
     Returns:
         prov.ProvDocument: The provenance document.
     """
-    client = mlflow.MlflowClient()
+    snapshot = snapshot or _gather_snapshot(run,state)
+    step_ranges = step_ranges or {}
 
-    #run entity and activity generation
-
-    run_entity = doc.entity(f'{run.info.run_name}',other_attributes={
-        "mlflow:run_id": str(lv_attr(LVL_1,str(run.info.run_id))),
-        "mlflow:artifact_uri":str(lv_attr(LVL_1,str(run.info.artifact_uri))),
-        "prov-ml:type":str(lv_attr(LVL_1,"LearningStage")),
-        "mlflow:user_id":str(lv_attr(LVL_1,str(run.info.user_id))),
-        "prov:level":LVL_1
-    })
+    resumed = state is not None
+    if resumed:
+        run_activity = doc.get_record(f'{run.info.run_name}_execution')[0]
+    else:
+        #run entity and activity generation
+
+        run_entity = doc.entity(f'{run.info.run_name}',other_attributes={
+            "mlflow:run_id": str(lv_attr(LVL_1,str(run.info.run_id))),
+            "mlflow:artifact_uri":str(lv_attr(LVL_1,str(run.info.artifact_uri))),
+            "prov-ml:type":str(lv_attr(LVL_1,"LearningStage")),
+            "mlflow:user_id":str(lv_attr(LVL_1,str(run.info.user_id))),
+            "prov:level":LVL_1
+        })
 
-    run_activity = doc.activity(f'{run.info.run_name}_execution',
-                                #datetime.fromtimestamp(run.info.start_time/1000),
-                                #datetime.fromtimestamp(run.info.end_time/1000),
-                                other_attributes={
-        'prov-ml:type':str(lv_attr(LVL_1,'LearningStageExecution')),
-        "prov:level":LVL_1
-    })
-    #experiment entity generation
-    experiment = doc.entity(f'{client.get_experiment(run.info.experiment_id).name}',other_attributes={
-        "prov-ml:type":str(lv_attr(LVL_1,"LearningExperiment")),
-        "mlflow:experiment_id": str(lv_attr(LVL_1,str(run.info.experiment_id))),
-        "prov:level":LVL_1
-    })
+        run_activity = doc.activity(f'{run.info.run_name}_execution',
+                                    #datetime.fromtimestamp(run.info.start_time/1000),
+                                    #datetime.fromtimestamp(run.info.end_time/1000),
+                                    other_attributes={
+            'prov-ml:type':str(lv_attr(LVL_1,'LearningStageExecution')),
+            "prov:level":LVL_1
+        })
+        #experiment entity generation
+        experiment = doc.entity(f'{snapshot.experiment.name}',other_attributes={
+            "prov-ml:type":str(lv_attr(LVL_1,"LearningExperiment")),
+            "mlflow:experiment_id": str(lv_attr(LVL_1,str(run.info.experiment_id))),
+            "prov:level":LVL_1
+        })
 
-    doc.hadMember(experiment,run_entity).add_attributes({
-        'prov:level':LVL_1
-    })
-    doc.wasGeneratedBy(run_entity,run_activity,other_attributes={
-        'prov:level':LVL_1
-    })
+        doc.hadMember(experiment,run_entity).add_attributes({
+            'prov:level':LVL_1
+        })
+        doc.wasGeneratedBy(run_entity,run_activity,other_attributes={
+            'prov:level':LVL_1
+        })
 
 
     #metrics and params generation
-    for name,_ in run.data.metrics.items():
-        #the Run object stores only the most recent metrics, to get all metrics lower level API is needed
-        for metric in client.get_metric_history(run.info.run_id,name):
-            i=0
-            ent=doc.entity(f'{name}_{metric.step or i}',{
+    #the Run object stores only the most recent metrics, the snapshot holds the histories; if resumed, the points
+    #already in the document are skipped, after numbering the repetitions of their steps
+    context_ranges: Dict[str,Dict[str,Dict[int,int]]] = {}
+    for (name,context),ranges in step_ranges.items():
+        context_ranges.setdefault(name,{})[context] = ranges
+    for name,history in snapshot.metric_histories.items():
+        key_ranges = context_ranges.get(name,{})
+        resolve = None
+        if len(key_ranges)>1:
+            #the same step can be aggregated in several contexts, each point takes the range of its own
+            if contexts is None:
+                import mlflow
+
+                contexts = ContextIndex.load(mlflow.MlflowClient(),run)
+            resolve = contexts.resolver(name)
+        for metric,n in islice(zip(history,metric_repetitions(history)),snapshot.metric_counts.get(name,0),None):
+            identifier = metric_identifier(name,metric.step,n)
+            ranges = key_ranges.get(resolve(metric.step,n),{}) if resolve is not None else next(iter(key_ranges.values()),{})
+            attributes={
                 'prov-ml:type':'ModelEvaluation',
+                'mlflow:key':str(lv_attr(LVL_1,name)),
                 'mlflow:value':str(lv_attr(LVL_1,metric.value)),
-                'mlflow:step':str(lv_attr(LVL_1,metric.step or i)),
+                'mlflow:step':str(lv_attr(LVL_1,metric.step)),
                 'prov:level':LVL_1,
-            })
+            }
+            if metric.step in ranges:
+                attributes['prov-ml:step_range']=str(lv_attr(LVL_1,[ranges[metric.step],metric.step]))
+            ent=doc.entity(identifier,attributes)
             doc.wasGeneratedBy(ent,run_activity,
                                #datetime.fromtimestamp(metric.timestamp/1000),
-                               identifier=f'{name}_{metric.step}_gen',
+                               identifier=f'{identifier}_gen',
                                other_attributes={
                                     'prov:level':LVL_1
                                })
-            i+=1
 
     for name,value in run.data.params.items():
+        if resumed and doc.get_record(f'{name}'):
+            continue
         ent = doc.entity(f'{name}',{
             'mlflow:value':str(lv_attr(LVL_1,value)),
             'prov-ml:type':str(lv_attr(LVL_1,'LearningHyperparameterValue')),
@@ -166,8 +658,10 @@ def first_level_prov(run:Run, doc: prov.ProvDocument) -> prov.ProvDocument:
         doc.used(run_activity,ent,other_attributes={'prov:level':LVL_1})
 
     #dataset entities generation
-    ent_ds = doc.entity(f'dataset',other_attributes={'prov:level':LVL_1})
+    ent_ds = doc.get_record('dataset')[0] if resumed else doc.entity(f'dataset',other_attributes={'prov:level':LVL_1})
     for dataset_input in run.inputs.dataset_inputs:
+        if resumed and doc.get_record(f'{dataset_input.dataset.name}-{dataset_input.dataset.digest}'):
+            continue
         attributes={
             'prov-ml:type':str(lv_attr(LVL_1,'FeatureSetData')),
             'mlflow:digest':str(lv_attr(LVL_1,str(dataset_input.dataset.digest))),
@@ -180,122 +674,279 @@ def first_level_prov(run:Run, doc: prov.ProvDocument) -> prov.ProvDocument:
     
 
     #model version entities generation
-    model_version = client.search_model_versions(f'run_id="{run.info.run_id}"')[0] #only one model version per run (in this case)
-
-    modv_ent=doc.entity(f'{model_version.name}_{model_version.version}',{
-        "prov-ml:type":str(lv_attr(LVL_1,"Model")),
-        'mlflow:version':str(lv_attr(LVL_1,model_version.version)),
-        'mlflow:artifact_uri':str(lv_attr(LVL_1,model_version.source)),
-        'mlflow:creation_timestamp':str(lv_attr(LVL_1,datetime.fromtimestamp(model_version.creation_timestamp/1000))),
-        'mlflow:last_updated_timestamp':str(lv_attr(LVL_1,datetime.fromtimestamp(model_version.last_updated_timestamp/1000))),
-        'prov:level':LVL_1
-    })
-    doc.wasGeneratedBy(modv_ent,run_activity,identifier=f'{model_version.name}_{model_version.version}_gen',other_attributes={'prov:level':LVL_1})
-    
-    
-    #get the model registered in the model registry of mlflow
-    model = client.get_registered_model(model_version.name)
-    mod_ent=doc.entity(f'{model.name}',{
-        "prov-ml:type":str(lv_attr(LVL_1,"Model")),
-        'mlflow:creation_timestamp':str(lv_attr(LVL_1,datetime.fromtimestamp(model.creation_timestamp/1000))),
-        'prov:level':LVL_1,
-    })
-    spec=doc.specializationOf(modv_ent,mod_ent)
-    spec.add_attributes({'prov:level':LVL_1})   #specilizationOf doesn't accept other_attributes, but its cast as record does
+    for model_version in snapshot.model_versions:
+        if resumed and doc.get_record(f'{model_version.name}_{model_version.version}'):
+            continue
+        modv_ent=doc.entity(f'{model_version.name}_{model_version.version}',{
+            "prov-ml:type":str(lv_attr(LVL_1,"Model")),
+            'mlflow:version':str(lv_attr(LVL_1,model_version.version)),
+            'mlflow:artifact_uri':str(lv_attr(LVL_1,model_version.source)),
+            'mlflow:creation_timestamp':str(lv_attr(LVL_1,datetime.fromtimestamp(model_version.creation_timestamp/1000))),
+            'mlflow:last_updated_timestamp':str(lv_attr(LVL_1,datetime.fromtimestamp(model_version.last_updated_timestamp/1000))),
+            'prov:level':LVL_1
+        })
+        doc.wasGeneratedBy(modv_ent,run_activity,identifier=f'{model_version.name}_{model_version.version}_gen',other_attributes={'prov:level':LVL_1})
+        
+        
+        #get the model registered in the model registry of mlflow
+        model = snapshot.registered_models[model_version.name]
+        if not doc.get_record(f'{model.name}'):
+            mod_ent=doc.entity(f'{model.name}',{
+                "prov-ml:type":str(lv_attr(LVL_1,"Model")),
+                'mlflow:creation_timestamp':str(lv_attr(LVL_1,datetime.fromtimestamp(model.creation_timestamp/1000))),
+                'prov:level':LVL_1,
+            })
+        else:
+            mod_ent=doc.get_record(f'{model.name}')[0]     #another version of the same model
+        spec=doc.specializationOf(modv_ent,mod_ent)
+        spec.add_attributes({'prov:level':LVL_1})   #specilizationOf doesn't accept other_attributes, but its cast as record does
 
 
     #artifact entities generation
-    artifacts=traverse_artifact_tree(client,run.info.run_id)
-    for artifact in artifacts:
+    for artifact in snapshot.artifacts:
+        if resumed and doc.get_record(f'{artifact.path}'):
+            continue
         ent=doc.entity(f'{artifact.path}',{
             'mlflow:artifact_path':str(lv_attr(LVL_1,artifact.path)),
             'prov:level':LVL_1,
-            #the FileInfo object stores only size and path of the artifact, specific connectors to the artifact store are needed to get other metadata
+            #the FileInfo object stores only size and path of the artifact, checksum_prov adds the checksums of local artifacts
         })
         doc.wasGeneratedBy(ent,run_activity,identifier=f'{artifact.path}_gen',other_attributes={'prov:level':LVL_1})
     
 
     return doc
 
+def best_prov(run:Run, doc:prov.ProvDocument, best:BestTracker, snapshot:RunSnapshot) -> prov.ProvDocument:
+    """
+    Adds a BestEvaluation entity for the best point of each metric with an objective.
+
+    The entity groups the metric entity of the best point, the checkpoint logged with log_checkpoint at its step, if
+    any, and, for each registered model, the first version created by the run after the best point was logged,
+    i.e. the one trained up to it. Everything comes from the run and the snapshot, no other query is made.
+    When a resumed run finds a new best point, the entity of the previous session's best point is replaced.
+
+    Args:
+        run (mlflow.entities.Run): The MLflow run.
+        doc (RecordStore): The provenance document, with the first level.
+        best (BestTracker): The best points of the run.
+        snapshot (RunSnapshot): The MLflow data of the run.
+
+    Returns:
+        prov.ProvDocument: The provenance document.
+    """
+    previous = {}    #the BestEvaluation entities of the sessions before a resume, by key
+    for ent in doc.records('entity'):
+        if ent.get_attribute('prov-ml:type') == {str(lv_attr(LVL_1,'BestEvaluation'))}:
+            for key in ent.get_attribute('mlflow:key'):
+                previous[key] = ent.identifier
+    for name,(value,step,timestamp) in best.best.items():
+        if doc.get_record(f'{name}_best_{step}'):
+            continue    #a resumed run whose best point didn't change
+        if str(lv_attr(LVL_1,name)) in previous:
+            doc.remove(previous[str(lv_attr(LVL_1,name))])    #superseded by a point of this session, with its members
+        history = snapshot.metric_histories.get(name,[])
+        point = next((identifier for metric,identifier in zip(history,metric_identifiers(history))
+                      if (metric.value,metric.step,metric.timestamp) == (value,step,timestamp)),None)
+        best_ent = doc.entity(f'{name}_best_{step}',{
+            'prov-ml:type':str(lv_attr(LVL_1,'BestEvaluation')),
+            'mlflow:key':str(lv_attr(LVL_1,name)),
+            'prov-ml:objective':str(lv_attr(LVL_1,best.objective(name))),
+            'mlflow:value':str(lv_attr(LVL_1,value)),
+            'mlflow:step':str(lv_attr(LVL_1,step)),
+            'prov:level':LVL_1,
+        })
+        members = [point,run.data.tags.get(f'checkpoint.{step}')]
+        versions = {}
+        for model_version in sorted(snapshot.model_versions,key=lambda model_version: model_version.creation_timestamp):
+            if model_version.creation_timestamp >= timestamp and model_version.name not in versions:
+                versions[model_version.name] = f'{model_version.name}_{model_version.version}'
+        for member in members+list(versions.values()):
+            if member is not None and doc.get_record(member):
+                doc.hadMember(best_ent,member).add_attributes({'prov:level':LVL_1})
+    return doc
+
+
+def checksum_prov(doc:prov.ProvDocument, checksums:Dict[str,ArtifactChecksum]) -> prov.ProvDocument:
+    """
+    Adds the size and the content checksum of the artifacts to their entities.
+
+    Args:
+        doc (prov.ProvDocument): The provenance document, with the first level.
+        checksums (Dict[str, Tuple[int, str]]): The size and checksum of each artifact path, see prov4ml.checksum.
+
+    Returns:
+        prov.ProvDocument: The provenance document.
+    """
+    for path,(size,checksum) in checksums.items():
+        for ent in doc.get_record(path):
+            ent.add_attributes({
+                'prov-ml:size':str(lv_attr(LVL_2,size)),
+                'prov-ml:checksum':str(lv_attr(LVL_2,checksum)),
+            })
+    return doc
+
+def _submit_checksums(run_state:_RunState, run:Run, artifacts:List[FileInfo]) -> Optional[Future]:
+    #hashes the local artifacts while the document is built, None if checksums are disabled or the artifacts are remote
+    checksums = run_state.options.get('checksums')
+    if not checksums:
+        return None
+    root = local_artifact_root(run.info.artifact_uri) if checksums is True else checksums.format(run_id=run.info.run_id,
+                                                                                                 run_name=run.info.run_name,
+                                                                                                 experiment_id=run.info.experiment_id)
+    if root is None or not artifacts:
+        return None
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(artifact_checksums,root,[artifact.path for artifact in artifacts],ChecksumCache(run_state.path(PROV_CHECKSUMS_PATH)))
+    executor.shutdown(wait=False)
+    return future
+
+
+def step_activity_levels(context:str, step:int, steps_per_epoch:Optional[int], step_bucket_size:Optional[int]) -> List[Tuple[str,Dict[str,Any]]]:
+    """
+    Returns the activities a metric of the given context and step is generated by, see second_level_prov.
+
+    Args:
+        context (str): The name of the Context of the metric.
+        step (int): The step of the metric.
+        steps_per_epoch (Optional[int]): The number of steps in each epoch, None for no epoch activities.
+        step_bucket_size (Optional[int]): The number of steps grouped in each step activity, None for no step activities.
 
+    Returns:
+        List[Tuple[str, Dict[str, Any]]]: The identifier and attributes of each activity, from the epoch to the
+            smallest level; empty for the contexts without step activities, or not registered.
+    """
+    definition = get_context(context) if context is not None else None
+    if definition is None or definition.prefix is None:
+        return []
+    prefix,prov_type = definition.prefix,definition.prov_type
+    levels = []
+    first,last = 0,None
+    if steps_per_epoch:
+        epoch = step//steps_per_epoch
+        first,last = epoch*steps_per_epoch,(epoch+1)*steps_per_epoch-1
+        levels.append((f'{prefix}_epoch_{epoch}',{'prov-ml:type':prov_type,'prov-ml:epoch':epoch,'prov-ml:first_step':first,'prov-ml:last_step':last}))
+    if step_bucket_size is None:
+        return levels
+    if step_bucket_size == 1:
+        levels.append((f'{prefix}_step_{step}',{'prov-ml:type':prov_type}))
+    else:
+        low = first+(step-first)//step_bucket_size*step_bucket_size
+        high = low+step_bucket_size-1 if last is None else min(low+step_bucket_size-1,last)
+        levels.append((f'{prefix}_steps_{low}_{high}',{'prov-ml:type':prov_type,'prov-ml:first_step':low,'prov-ml:last_step':high}))
+    return levels
+
+def _step_activity(doc:prov.ProvDocument, created:set, run_activity:Any, context:str, step:int, steps_per_epoch:Optional[int], step_bucket_size:Optional[int]) -> Optional[str]:
+    #returns the identifier of the smallest activity a metric of the given context and step is attached to, creating the missing levels
+    parent = run_activity
+    for identifier,attributes in step_activity_levels(context,step,steps_per_epoch,step_bucket_size):
+        if identifier not in created:
+            created.add(identifier)
+            if not doc.get_record(identifier):
+                doc.activity(identifier,other_attributes={
+                    **{key:str(lv_attr(LVL_2,value)) for key,value in attributes.items()},
+                    'prov:level':LVL_2,
+                })
+                doc.wasStartedBy(identifier,parent,other_attributes={'prov:level':LVL_2})
+        parent = identifier
+    return parent if parent is not run_activity else None
 
-def second_level_prov(run:Run, doc: prov.ProvDocument) -> prov.ProvDocument:
+def second_level_prov(run:Run, doc: prov.ProvDocument, state:Optional[ProvState]=None, steps_per_epoch:Optional[int]=None, step_bucket_size:Optional[int]=1, snapshot:Optional[RunSnapshot]=None, contexts:Optional[ContextIndex]=None) -> prov.ProvDocument:
     """
     Generates the second level of provenance for a given run.
+
+    Training and evaluation metrics are generated by a hierarchy of activities: the run, then one activity per epoch
+    (if steps_per_epoch is given), then one activity per range of step_bucket_size steps (if step_bucket_size is not None).
+    Each metric entity is attached to the smallest enabled level. The defaults give one activity per step and context,
+    e.g. train_step_3; for runs logging every iteration, epochs and larger buckets reduce the number of records.
+
     Args:
         run (Run): The run object.
-        doc (prov.ProvDocument): The provenance document.
+        doc (prov.ProvDocument): The provenance document, or a RecordStore.
+        state (Optional[ProvState]): The state of the document, if it was previously generated for the same run and
+            is being extended. Defaults to None.
+        steps_per_epoch (Optional[int]): The number of steps in each epoch. Defaults to None, no epoch activities.
+        step_bucket_size (Optional[int]): The number of steps grouped in each step activity. Defaults to 1. If None,
+            there are no step activities and metrics are attached to the epoch activities.
+        snapshot (Optional[RunSnapshot]): The MLflow data of the run, shared with first_level_prov. Defaults to None,
+            gathered by the function.
+        contexts (Optional[ContextIndex]): The contexts of the metric keys of the run. Defaults to None, read from
+            the run.
     Returns:
         prov.ProvDocument: The provenance document.
     """
-    client = mlflow.MlflowClient()
+    snapshot = snapshot or _gather_snapshot(run,state)
+    if contexts is None:
+        import mlflow
+
+        contexts = ContextIndex.load(mlflow.MlflowClient(),run)
+
+    resumed = state is not None
         
     run_activity= doc.get_record(f'{run.info.run_name}_execution')[0]
     run_activity.add_attributes({
         "mlflow:status":str(lv_attr(LVL_2,run.info.status)),
         "mlflow:lifecycle_stage":str(lv_attr(LVL_2,run.info.lifecycle_stage)),
     })
-    user_ag = doc.agent(f'{run.info.user_id}',other_attributes={
-        "prov:level":LVL_2,
-    })
-    doc.wasAssociatedWith(f'{run.info.run_name}_execution',user_ag,other_attributes={
-        "prov:level":LVL_2,
-    })
-
-    doc.entity('source_code',{
-        "mlflow:source_name":str(lv_attr(LVL_2,run.data.tags['mlflow.source.name'])),
-        "mlflow:source_type":str(lv_attr(LVL_2,run.data.tags['mlflow.source.type'])),  
-        'prov:level':LVL_2,   
-    })
+    if not resumed:
+        user_ag = doc.agent(f'{run.info.user_id}',other_attributes={
+            "prov:level":LVL_2,
+        })
+        doc.wasAssociatedWith(f'{run.info.run_name}_execution',user_ag,other_attributes={
+            "prov:level":LVL_2,
+        })
 
-    if 'mlflow.source.git.commit' in run.data.tags.keys():
-        doc.activity('commit',other_attributes={
-            "mlflow:source_git_commit":str(lv_attr(LVL_2,run.data.tags['mlflow.source.git.commit'])),
-            'prov:level':LVL_2,
+        doc.entity('source_code',{
+            "mlflow:source_name":str(lv_attr(LVL_2,run.data.tags['mlflow.source.name'])),
+            "mlflow:source_type":str(lv_attr(LVL_2,run.data.tags['mlflow.source.type'])),  
+            'prov:level':LVL_2,   
         })
-        doc.wasGeneratedBy('source_code','commit',other_attributes={'prov:level':LVL_2})
-        doc.wasInformedBy(run_activity,'commit',other_attributes={'prov:level':LVL_2})
-    else:
-        doc.used(run_activity,'source_code',other_attributes={'prov:level':LVL_2})
+
+        if 'mlflow.source.git.commit' in run.data.tags.keys():
+            doc.activity('commit',other_attributes={
+                "mlflow:source_git_commit":str(lv_attr(LVL_2,run.data.tags['mlflow.source.git.commit'])),
+                'prov:level':LVL_2,
+            })
+            doc.wasGeneratedBy('source_code','commit',other_attributes={'prov:level':LVL_2})
+            doc.wasInformedBy(run_activity,'commit',other_attributes={'prov:level':LVL_2})
+        else:
+            doc.used(run_activity,'source_code',other_attributes={'prov:level':LVL_2})
 
     #remove relations between metrics and run
 
 
     #create activities for training and evaluation and associate metrics
 
-    for name,_ in run.data.metrics.items():
-        for metric in client.get_metric_history(run.info.run_id,name):
-            if not doc.get_record(f'train_step_{metric.step}'):
-                train_activity=doc.activity(f'train_step_{metric.step}',other_attributes={
-                "prov-ml:type":str(lv_attr(LVL_2,"TrainingExecution")),
-                'prov:level':LVL_2,
-                })
-                test_activity=doc.activity(f'test_step_{metric.step}',other_attributes={
-                    "prov-ml:type":str(lv_attr(LVL_2,"EvaluationExecution")),
-                    'prov:level':LVL_2,
-                })
-                doc.wasStartedBy(train_activity,run_activity,other_attributes={'prov:level':LVL_2})
-                doc.wasStartedBy(test_activity,run_activity,other_attributes={'prov:level':LVL_2})
+    step_activities = set()
+    for name,history in snapshot.metric_histories.items():
+        resolve = contexts.resolver(name)    #constant unless the key is logged in several contexts
+        for metric,n in islice(zip(history,metric_repetitions(history)),snapshot.metric_counts.get(name,0),None):
+            identifier = metric_identifier(name,metric.step,n)
+            context = resolve(metric.step,n)
+            if context==Context.DATA_PREPARATION.name:
+                doc.wasGeneratedBy(identifier,'data_preparation',other_attributes={'prov:level':LVL_2})
+                continue
 
             # if doc.get_record(f'{name}_{metric.step}_gen')[0]:
             #     doc._records.remove(doc.get_record(f'{name}_{metric.step}_gen')[0]) #accessing private attribute, propriety doesn't allow to remove records, but we need to remove the lv1 generation
-            if run.data.tags[f'metric.context.{metric.key}']==Context.TRAINING.name:
-                doc.wasGeneratedBy(f'{metric.key}_{metric.step}',f'train_step_{metric.step}',other_attributes={'prov:level':LVL_2})    
-            elif run.data.tags[f'metric.context.{metric.key}']==Context.EVALUATION.name:
-                doc.wasGeneratedBy(f'{metric.key}_{metric.step}',f'test_step_{metric.step}',other_attributes={'prov:level':LVL_2})
+            step_activity = _step_activity(doc,step_activities,run_activity,context,metric.step,steps_per_epoch,step_bucket_size)
+            if step_activity is not None:
+                doc.wasGeneratedBy(identifier,step_activity,other_attributes={'prov:level':LVL_2})
     
     #data transformation activity
-    doc.activity("data_preparation",other_attributes={
-        "prov-ml:type":"FeatureExtractionExecution",
-        'prov:level':LVL_2,
-    })
+    if not resumed:
+        doc.activity("data_preparation",other_attributes={
+            "prov-ml:type":"FeatureExtractionExecution",
+            'prov:level':LVL_2,
+        })
     #add attributes to dataset entities
     for dataset_input in run.inputs.dataset_inputs:
+        ent= doc.get_record(f'{dataset_input.dataset.name}-{dataset_input.dataset.digest}')[0]
+        if ent.get_attribute('mlflow:profile'):
+            continue    #already added when the document was first generated
         attributes={
             'mlflow:profile':str(lv_attr(LVL_2,dataset_input.dataset.profile)),
             'mlflow:schema':str(lv_attr(LVL_2,dataset_input.dataset.schema)),   
         }
-        ent= doc.get_record(f'{dataset_input.dataset.name}-{dataset_input.dataset.digest}')[0]
         ent.add_attributes(attributes)
 
         #remove old generation relationship
@@ -303,31 +954,183 @@ def second_level_prov(run:Run, doc: prov.ProvDocument) -> prov.ProvDocument:
         #     doc._records.remove(doc.get_record(f'{dataset_input.dataset.name}-{dataset_input.dataset.digest}_der')[0])
         #doc.wasDerivedFrom(ent,'dataset','data_preparation',other_attributes={'prov:level':LVL_2})  #use new transform activity for derivation
         doc.wasGeneratedBy(ent,'data_preparation',other_attributes={'prov:level':LVL_2})        #use two binary relation for yProv
-    doc.used('data_preparation','dataset',other_attributes={'prov:level':LVL_2})
+    if not resumed:
+        doc.used('data_preparation','dataset',other_attributes={'prov:level':LVL_2})
     # doc.get_record('dataset')[0].add_attributes({
     #     'source_mirror':str(run.inputs.dataset_inputs[0].tags[1]),
     # })
 
 
 
-        
-    
-    model_version = client.search_model_versions(f'run_id="{run.info.run_id}"')[0]
-    # if doc.get_record(f'{model_version.name}_{model_version.version}_gen')[0]:
-    #     doc._records.remove(doc.get_record(f'{model_version.name}_{model_version.version}_gen')[0])
+    if not snapshot.model_versions or (resumed and doc.get_record('mlflow:ModelRegistration')):
+        return doc      #no model was registered, or it was registered before the run was resumed
 
     model_ser = doc.activity(f'mlflow:ModelRegistration',other_attributes={'prov:level':LVL_2})
     doc.wasInformedBy(model_ser,run_activity,other_attributes={'prov:level':LVL_2})
-    doc.wasGeneratedBy(f'{model_version.name}_{model_version.version}',model_ser,other_attributes={'prov:level':LVL_2})
-    
-    for artifact in traverse_artifact_tree(client,run.info.run_id,model_version.name): #get artifacts whose path starts with TinyVGG: these are model serialization and metadata files
-        # if doc.get_record(f'{artifact.path}_gen'):
-        #     doc._records.remove(doc.get_record(f'{artifact.path}_gen')[0])
-        memb=doc.hadMember(f'{model_version.name}_{model_version.version}',f"{artifact.path}")
-        memb.add_attributes({'prov:level':LVL_2})
+    for model_version in snapshot.model_versions:
+        # if doc.get_record(f'{model_version.name}_{model_version.version}_gen')[0]:
+        #     doc._records.remove(doc.get_record(f'{model_version.name}_{model_version.version}_gen')[0])
+        doc.wasGeneratedBy(f'{model_version.name}_{model_version.version}',model_ser,other_attributes={'prov:level':LVL_2})
+        
+        for artifact in snapshot.artifacts:
+            if not artifact.path.startswith(f'{model_version.name}/'):
+                continue    #artifacts whose path starts with the model name (e.g. TinyVGG) are model serialization and metadata files
+            # if doc.get_record(f'{artifact.path}_gen'):
+            #     doc._records.remove(doc.get_record(f'{artifact.path}_gen')[0])
+            memb=doc.hadMember(f'{model_version.name}_{model_version.version}',f"{artifact.path}")
+            memb.add_attributes({'prov:level':LVL_2})
     return doc
 
 
+def _begin_run(prov_user_namespace:str, run_id:Optional[str], experiment_id:Optional[str], run_name:Optional[str], nested:bool,
+               tags:Optional[Dict[str,Any]], description:Optional[str], log_system_metrics:Optional[bool], **options) -> ActiveRun:
+    import mlflow
+
+    #checked before the run starts: the step activities are only computed when the document is generated, after it ends
+    for option in ('steps_per_epoch','step_bucket_size'):
+        if options[option] is not None and options[option]<1:
+            raise ValueError(f'{option} must be at least 1 or None, got {options[option]}')
+    #by keyword, newer MLflow versions have more positional parameters
+    active_run= mlflow.start_run(run_id=run_id,experiment_id=experiment_id,run_name=run_name,nested=nested,tags=tags,
+                                 description=description,log_system_metrics=log_system_metrics) #start the run
+    print('started run', active_run.info.run_id)
+    metric_policies = options.pop('metric_policies',None)
+    events = options.pop('events',None)
+    options['output_dir'] = options['output_dir'].format(run_id=active_run.info.run_id,run_name=active_run.info.run_name,
+                                                         experiment_id=active_run.info.experiment_id)
+    os.makedirs(options['output_dir'],exist_ok=True)
+    run_state = _RunState(active_run.info.run_id,prov_user_namespace,run_id is not None,**options)
+    run_state.buffer.journal = run_state    #the points written by the buffer go to the journal and the best points
+    if metric_policies:
+        run_state.sampler = MetricSampler(metric_policies)
+    if run_state.best is not None and run_state.resumed:
+        run_state.best.restore(active_run.data.tags)
+    if run_state.resumed:
+        #kept apart from the index of this session, whose keys are the ones to fetch to extend the document
+        run_state.earlier_contexts = ContextIndex.load(mlflow.MlflowClient(),active_run)
+    if events is not None:
+        if isinstance(events,str):
+            events = events.format(run_id=active_run.info.run_id,run_name=active_run.info.run_name,experiment_id=active_run.info.experiment_id)
+        run_state.events = ProvEventStream(events,active_run.info.run_id,active_run.info.run_name,
+                                           partial(step_activity_levels,steps_per_epoch=options['steps_per_epoch'],step_bucket_size=options['step_bucket_size']))
+        run_state.events.run_started(active_run)
+    if options.get('journal'):
+        run_state.journal = Journal(run_state.run_id,{
+            'prov_user_namespace': prov_user_namespace,
+            'resumed': run_state.resumed,
+            'options': options,
+        })
+    _run_states[active_run.info.run_id] = run_state
+    return active_run
+
+def _end_run(status:str='FINISHED') -> None:
+    import mlflow
+
+    mlflow.end_run(status) #end the run, as per mlflow documentation
+    print('ended run')
+
+def _abort_run(active_run:ActiveRun) -> None:
+    #the body of the run raised: what was logged is written and the run ends as FAILED, without a document, so that
+    #the process can start other runs; a journal is kept, recover_run can still write the document from it
+    run_state = _run_states.pop(active_run.info.run_id)
+    run_state.close()
+    if run_state.journal is not None:
+        run_state.journal.close()
+    if run_state.events is not None:
+        run_state.events.run_ended('FAILED')
+        run_state.events.close()
+    _end_run('FAILED')
+
+def _load_prov_state(run_state:_RunState) -> Optional[ProvState]:
+    #the state of the document to extend, if the run was resumed and its document is found
+    if run_state.resumed and os.path.exists(run_state.path(PROV_GRAPH_PATH)):
+        return ProvState.load(run_state.path(PROV_STATE_PATH),run_state.run_id)
+    return None
+
+def _write_provenance(run_state:_RunState, snapshot:RunSnapshot, state:Optional[ProvState]) -> None:
+    print('doc generation')
+
+    run_id = run_state.run_id
+    active_run = snapshot.run
+    snapshot.artifacts = [artifact for artifact in snapshot.artifacts if not artifact.path.startswith(f'{PROV_ARTIFACT_PATH}/')]
+    #the document is built as compact records and serialized directly, prov.model objects are only created for the DOT export
+    if state is not None:
+        with open(run_state.path(PROV_GRAPH_PATH)) as prov_graph:
+            doc = RecordStore.deserialize(prov_graph,validation=run_state.options['validation'])
+    else:
+        doc = RecordStore(run_state.options['validation'])
+
+        #set namespaces
+        doc.set_default_namespace(run_state.prov_user_namespace)
+        doc.add_namespace('prov','http://www.w3.org/ns/prov#')
+        doc.add_namespace('xsd','http://www.w3.org/2000/10/XMLSchema#')
+        
+        doc.add_namespace('mlflow', 'mlflow') #TODO: find namespaces of mlflow and prov-ml ontologies
+        doc.add_namespace('prov-ml', 'prov-ml')
+
+
+
+    checksums = _submit_checksums(run_state,active_run,snapshot.artifacts)
+    step_ranges = run_state.sampler.step_ranges if run_state.sampler is not None else None
+    contexts = run_state.run_contexts()
+    doc = first_level_prov(active_run,doc,state,snapshot,step_ranges,contexts)
+    doc = second_level_prov(active_run,doc,state,run_state.options['steps_per_epoch'],run_state.options['step_bucket_size'],snapshot,contexts)
+    if run_state.best is not None:
+        doc = best_prov(active_run,doc,run_state.best,snapshot)
+    if checksums is not None:
+        doc = checksum_prov(doc,checksums.result())
+    for build in run_state.builders:
+        build(doc,active_run)
+    
+
+    #datasets are associated with two sets of tags: input tags, of the DatasetInput object, and the tags of the dataset itself
+    # for input_tag in dataset_input.tags:
+    #     attributes[f'mlflow:{input_tag.key.strip("mlflow.")}']=str(input_tag.value)
+    # for key,value in ds_tags['tags'].items():
+    #     attributes[f'mlflow:{str(key).strip("mlflow.")}']=str(value)
+        
+
+    #duplicate identifiers were checked as the records were added, the endpoints are checked once they are all added
+    issues = doc.validate()
+    if issues:
+        warnings.warn(f'{len(issues)} issues in the provenance document of run {run_id}: '+'; '.join(issues[:10])+(' ...' if len(issues)>10 else ''))
+    prov_json = doc.serialize()
+    with open(run_state.path(PROV_GRAPH_PATH),'w') as prov_graph:
+        prov_graph.write(prov_json)
+
+    #the outputs are uploaded by a background thread as soon as they are written, while the rest is generated
+    uploader = ThreadPoolExecutor(max_workers=1) if run_state.options['upload_artifacts'] else None
+    uploads = []
+    def upload(path:str) -> None:
+        if uploader is not None:
+            import mlflow
+            uploads.append(uploader.submit(mlflow.MlflowClient().log_artifact,run_id,path,PROV_ARTIFACT_PATH))
+
+    upload(run_state.path(PROV_GRAPH_PATH))
+    #the other formats are rendered from the JSON file by a thread, or worker processes for several formats, while
+    #this one updates the store and the state
+    exports = submit_exports(run_state.path(PROV_GRAPH_PATH),run_state.options['export_formats'])
+    if run_state.options['prov_store'] is not None:
+        from .store import ProvStore
+        with ProvStore(run_state.options['prov_store']) as store:
+            store.add_document(json.loads(prov_json),run_id)
+    ProvState(run_id,snapshot.recorded_metric_counts()).save(run_state.path(PROV_STATE_PATH))
+    for future in as_completed(exports.values()):
+        upload(future.result())
+    if uploader is not None:
+        uploader.shutdown()
+        for future in uploads:
+            future.result()
+    if run_state.journal is not None:
+        run_state.journal.remove()    #the document is written, nothing left to recover
+    if run_state.events is not None:
+        #the end of the run is published once its outputs are written
+        for artifact in snapshot.artifacts:
+            run_state.events.artifact(artifact.path)
+        run_state.events.run_ended(active_run.info.status)
+        run_state.events.close()
+
+
 @contextmanager
 def start_run(
     prov_user_namespace:str,
@@ -337,10 +1140,27 @@ def start_run(
     nested: bool = False,
     tags: Optional[Dict[str, Any]] = None,
     description: Optional[str] = None,
-    log_system_metrics: Optional[bool] = None,) -> ActiveRun: # type: ignore
+    log_system_metrics: Optional[bool] = None,
+    prov_store: Optional[str] = None,
+    steps_per_epoch: Optional[int] = None,
+    step_bucket_size: Optional[int] = 1,
+    journal: bool = False,
+    metric_policies: Optional[Dict[str, MetricPolicy]] = None,
+    objectives: Optional[Dict[str, str]] = None,
+    validation: Optional[str] = 'lenient',
+    export_formats: Tuple[str, ...] = ('dot',),
+    output_dir: str = '.',
+    upload_artifacts: bool = False,
+    batch_metrics: bool = False,
+    checksums: Union[bool,str] = False,
+    events: Optional[Union[str,Callable[[List[Dict[str,Any]]],None]]] = None,) -> ActiveRun: # type: ignore
     """
     Starts an MLflow run and generates provenance information.
 
+    When an existing run is resumed through run_id, and the document previously generated for it is found in
+    output_dir, the document is extended with the metrics and artifacts logged since then instead of being
+    regenerated from scratch; output_dir must then resolve to the same directory as when the run was started.
+
     Args:
         prov_user_namespace (str): The namespace of the user, this will be used as the default namespace.
         run_id (Optional[str]): The ID of the run to start. If not provided, a new run ID will be generated.
@@ -350,57 +1170,128 @@ def start_run(
         tags (Optional[Dict[str, Any]]): Additional tags to associate with the run. Defaults to None.
         description (Optional[str]): A description of the run. Defaults to None.
         log_system_metrics (Optional[bool]): Whether to log system metrics. Defaults to None.
+        prov_store (Optional[str]): The path of a SQLite provenance store (see prov4ml.store) the document is also added to. Defaults to None.
+        steps_per_epoch (Optional[int]): The number of steps in each epoch, to group step activities by epoch. Defaults to None.
+        step_bucket_size (Optional[int]): The number of steps grouped in each step activity, None to attach metrics
+            directly to the epochs. Defaults to 1. See second_level_prov.
+        journal (bool): Whether to append the logged metrics to a crash-safe journal in the prov_journal directory,
+            from which recover_run writes the document if the process is killed before the run ends. Defaults to False.
+        metric_policies (Optional[Dict[str, MetricPolicy]]): The sampling policy (EveryNth, Throttle or Window, see
+            prov4ml.sampling) of the metrics logged with log_metric and log_metrics, by key or fnmatch pattern, e.g.
+            {'loss': Window(100), 'grad_*': EveryNth(10)}. Defaults to None, every point is logged.
+        objectives (Optional[Dict[str, str]]): The objective, min or max, of metrics by key or fnmatch pattern, e.g.
+            {'MSE_eval': 'min'}. The best point of each is tracked as it is written and recorded as the metric.best.{key}
+            tag of the run and as a BestEvaluation entity (see best_prov). Defaults to None.
+        validation (Optional[str]): How the identifiers of the document are validated as it is built (see
+            prov4ml.records): strict raises a ValueError on a duplicate identifier or a dangling relation endpoint,
+            lenient reports them in a warning, None disables the checks. Defaults to lenient.
+        export_formats (Tuple[str, ...]): The formats the document is exported to besides PROV-JSON, rendered
+            concurrently by worker processes (see prov4ml.export.EXPORT_FORMATS). Defaults to ('dot',).
+        output_dir (str): The directory of the outputs (prov_graph.json, prov_state.json and the exports), created if
+            needed. It can be templated with {run_id}, {run_name} and {experiment_id}, e.g. 'prov/{run_id}', so that
+            concurrent runs don't overwrite each other. Defaults to the working directory.
+        upload_artifacts (bool): Whether to also upload the document and its exports as artifacts of the run, under
+            prov/, from a background thread. Defaults to False.
+        batch_metrics (bool): Whether to buffer every value logged with log_metric and log_metrics, not only the
+            tensors, and write them with one request per batch of up to 1000 points instead of one per call.
+            Defaults to False.
+        checksums (Union[bool, str]): Whether to add the size and the content checksum of the artifacts to their
+            entities (see prov4ml.checksum). True hashes them in a file: artifact store; with a remote store, a
+            string gives the local directory of a copy of the artifacts of the run, templated as output_dir. The
+            checksums are cached in prov_checksums.json, in the output directory. Defaults to False.
+        events (Optional[Union[str, Callable[[List[Dict[str, Any]]], None]]]): Where to publish the provenance
+            events of the run while it runs (see prov4ml.events): the path of a file they are appended to, one JSON
+            object per line, unix:{path} for a Unix socket, or a callable called with each batch of events. Paths can
+            be templated as output_dir. Defaults to None, no events.
 
     Returns:
         ActiveRun: The active run object.
 
     Raises:
-        None
+        ValueError: If steps_per_epoch or step_bucket_size is not None and less than 1, before the run is started.
+
+    If the body of the run raises, the buffered metrics are written, the run ends with the FAILED status and no
+    document is generated. The same happens, with a RuntimeError, if the metrics logged through metric_channel
+    can't all be written to MLflow when the run ends.
 
     """
     #wrapper for mlflow.start_run, with prov generation
-    
-    active_run= mlflow.start_run(run_id,experiment_id,run_name,nested,tags,description,log_system_metrics) #start the run
-    print('started run', active_run.info.run_id)
-    yield active_run #return the mlflow context manager, same one as mlflow.start_run()
+    active_run = _begin_run(prov_user_namespace,run_id,experiment_id,run_name,nested,tags,description,log_system_metrics,
+                            prov_store=prov_store,steps_per_epoch=steps_per_epoch,step_bucket_size=step_bucket_size,
+                            journal=journal,metric_policies=metric_policies,objectives=objectives,validation=validation,export_formats=export_formats,
+                            output_dir=output_dir,upload_artifacts=upload_artifacts,batch_metrics=batch_metrics,checksums=checksums,events=events)
+    try:
+        yield active_run #return the mlflow context manager, same one as mlflow.start_run()
+    except BaseException:
+        _abort_run(active_run)
+        raise
+
+    run_state = _run_states[active_run.info.run_id]
+    try:
+        run_state.close()    #write the buffered metrics and what the workers logged before the run ends
+    except BaseException:
+        _abort_run(active_run)    #metrics were lost: the run fails, without a document
+        raise
+    del _run_states[active_run.info.run_id]
+    _end_run()
+
+    import mlflow
+
+    prov_state = _load_prov_state(run_state)
+    snapshot = RunSnapshot.gather(mlflow.MlflowClient(),run_state.run_id,experiment_id=active_run.info.experiment_id,
+                                  metric_counts=prov_state.metric_counts if prov_state is not None else None,
+                                  logged_keys=run_state.contexts.keys)
+    _write_provenance(run_state,snapshot,prov_state)
+
+def recover_run(run_id:Optional[str]=None, journal_dir:str=JOURNAL_DIR) -> List[str]:
+    """
+    Writes the provenance document of runs started with journal=True whose process was killed before they ended.
 
+    The metric histories are read from the journal, i.e. its sealed segments and the lines appended after them, instead
+    of being read back from the tracking server; only the run, its model versions and its artifacts are fetched, and
+    for a resumed run, whose journal starts with the session, the histories of the keys logged before the resume.
+    Runs still marked as running are terminated with the KILLED status. Like start_run, the document is written
+    to the output directory of the run; a relative one is resolved against the working directory, which should be
+    the one the run was started from.
 
-    run_id=active_run.info.run_id
-    
-    mlflow.end_run() #end the run, as per mlflow documentation
-    print('ended run')
+    Args:
+        run_id (Optional[str]): The ID of the run to recover. Defaults to None, every run with a journal.
+        journal_dir (str): The directory of the journals. Defaults to prov_journal.
 
-    print('doc generation')
+    Returns:
+        List[str]: The IDs of the recovered runs.
+    """
+    import mlflow
+    from mlflow.entities import Metric,RunStatus
 
     client = mlflow.MlflowClient()
-    active_run=client.get_run(run_id)
-
-    doc = prov.ProvDocument()
-
-    #set namespaces
-    doc.set_default_namespace(prov_user_namespace)
-    doc.add_namespace('prov','http://www.w3.org/ns/prov#')
-    doc.add_namespace('xsd','http://www.w3.org/2000/10/XMLSchema#')
-    
-    doc.add_namespace('mlflow', 'mlflow') #TODO: find namespaces of mlflow and prov-ml ontologies
-    doc.add_namespace('prov-ml', 'prov-ml')
-
-
-
-    doc = first_level_prov(active_run,doc)
-    doc = second_level_prov(active_run,doc)
-    
-
-    #datasets are associated with two sets of tags: input tags, of the DatasetInput object, and the tags of the dataset itself
-    # for input_tag in dataset_input.tags:
-    #     attributes[f'mlflow:{input_tag.key.strip("mlflow.")}']=str(input_tag.value)
-    # for key,value in ds_tags['tags'].items():
-    #     attributes[f'mlflow:{str(key).strip("mlflow.")}']=str(value)
-        
-
-    with open('prov_graph.json','w') as prov_graph:
-        doc.serialize(prov_graph)
-    with open('prov_graph.dot', 'w') as prov_graph:
-        prov_graph.write(dot.prov_to_dot(doc).to_string())
-
-
+    recovered = []
+    for pending_id in ([run_id] if run_id is not None else pending_runs(journal_dir)):
+        header,contexts,points = Journal.read(pending_id,journal_dir)
+        run = client.get_run(pending_id)
+        if run.info.status == RunStatus.to_string(RunStatus.RUNNING):
+            client.set_terminated(pending_id,RunStatus.to_string(RunStatus.KILLED))
+
+        run_state = _RunState(pending_id,header['prov_user_namespace'],header['resumed'],**header['options'])
+        run_state.contexts = contexts
+        if run_state.resumed:
+            run_state.earlier_contexts = ContextIndex.load(client,run)
+        run_state.run_contexts().save(client,pending_id)
+        prov_state = _load_prov_state(run_state)
+        histories = {key: [Metric(key,value,timestamp,step) for value,step,timestamp in key_points] for key,key_points in points.items()}
+        known_histories = histories
+        if run_state.earlier_contexts is not None:
+            #the journal only holds the points of the last session: the keys logged before it are fetched whole
+            known_histories = {key: history for key,history in histories.items() if key not in run_state.earlier_contexts.keys}
+        if run_state.best is not None:
+            #the best points are those of the journal, or of the session before a resume
+            run_state.best.restore(run.data.tags)
+            run_state.best.append_metrics(metric for history in histories.values() for metric in history)
+            for _,batch_tags in iter_batches([],run_state.summary_tags()):
+                client.log_batch(pending_id,tags=batch_tags)
+        snapshot = RunSnapshot.gather(client,pending_id,metric_counts=prov_state.metric_counts if prov_state is not None else None,
+                                      logged_keys=contexts.keys,metric_histories=known_histories)
+        _write_provenance(run_state,snapshot,prov_state)
+        Journal.discard(pending_id,journal_dir)
+        recovered.append(pending_id)
+    return recovered
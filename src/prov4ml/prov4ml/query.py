@@ -0,0 +1,463 @@
+"""Indexed lineage queries over the PROV-JSON documents generated by prov4ml.
+
+The documents are read as plain JSON, without building ``prov.model`` objects, and indexed once:
+
+* records by identifier, O(1) lookup;
+* relations by type, by subject and by object, O(1) access to the relations of a record;
+* attribute values, built lazily the first time an attribute key is used in a filter, O(1) lookup afterwards.
+
+Building the index is O(R) in time and memory, where R is the number of records and relations.
+A lineage traversal is a breadth-first search visiting every reachable record and relation once,
+O(V + E) in the size of the lineage rather than of the whole document.
+
+Every relation is oriented from its subject (the first PROV argument, e.g. the entity of ``wasGeneratedBy``
+or the activity of ``used``) to its object, which is what the subject depends on. Upstream lineage follows
+relations from subject to object, downstream lineage from object to subject.
+"""
+import ast
+import json
+import re
+from collections import deque, namedtuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+RECORD_KINDS = ('entity', 'activity', 'agent')
+
+#PROV-JSON keys of the subject and object of each relation type
+RELATION_ENDPOINTS = {
+    'wasGeneratedBy': ('prov:entity', 'prov:activity'),
+    'used': ('prov:activity', 'prov:entity'),
+    'wasInformedBy': ('prov:informed', 'prov:informant'),
+    'wasStartedBy': ('prov:activity', 'prov:trigger'),
+    'wasEndedBy': ('prov:activity', 'prov:trigger'),
+    'wasInvalidatedBy': ('prov:entity', 'prov:activity'),
+    'wasDerivedFrom': ('prov:generatedEntity', 'prov:usedEntity'),
+    'wasAttributedTo': ('prov:entity', 'prov:agent'),
+    'wasAssociatedWith': ('prov:activity', 'prov:agent'),
+    'actedOnBehalfOf': ('prov:delegate', 'prov:responsible'),
+    'wasInfluencedBy': ('prov:influencee', 'prov:influencer'),
+    'specializationOf': ('prov:specificEntity', 'prov:generalEntity'),
+    'alternateOf': ('prov:alternate1', 'prov:alternate2'),
+    'hadMember': ('prov:collection', 'prov:entity'),
+}
+
+Relation = namedtuple('Relation', ['kind', 'identifier', 'subject', 'object', 'attributes'])
+
+_LV_ATTR = re.compile(r"^lv_attr\(level='(.*?)', value=(.*)\)$", re.DOTALL)
+_INTEGER = re.compile(r'-?(?:0|[1-9]\d*)$')
+_FLOAT = re.compile(r'-?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?$')
+_PLAIN_STRING = re.compile(r"'[^'\\]*'$")
+
+def _literal(text:str) -> Any:
+    #the numbers and plain strings that make up most values are parsed directly, literal_eval is slow
+    if _INTEGER.match(text):
+        return int(text)
+    if _FLOAT.match(text):
+        return float(text)
+    if _PLAIN_STRING.match(text):
+        return text[1:-1]
+    return ast.literal_eval(text)
+
+def attribute_value(value:Any) -> Any:
+    """
+    Returns the plain value of a PROV-JSON attribute.
+
+    Typed literals ({"$": ..., "type": ...}) are unwrapped, and so are the lv_attr strings written by prov4ml,
+    whose value is parsed back to a Python literal when possible.
+
+    Args:
+        value (Any): The attribute value, as found in the document.
+
+    Returns:
+        Any: The plain value.
+    """
+    if isinstance(value, dict):
+        value = value.get('$')
+    if isinstance(value, str) and value.startswith('lv_attr('):
+        match = _LV_ATTR.match(value)
+        if match:
+            try:
+                return _literal(match.group(2))
+            except (ValueError, SyntaxError):
+                return match.group(2)
+    return value
+
+def _index_keys(value:Any) -> List[Any]:
+    #attributes with several values (e.g. mlflow:status after a recovered run is resumed) are lists,
+    #each element is indexed on its own; unhashable elements are indexed by their repr
+    values = value if isinstance(value, list) else [value]
+    keys = []
+    for element in values:
+        element = attribute_value(element)
+        try:
+            hash(element)
+        except TypeError:
+            element = repr(element)
+        if element not in keys:
+            keys.append(element)
+    return keys
+
+def _has_value(value:Any, expected:Any) -> bool:
+    if isinstance(value, list):
+        return any(attribute_value(element) == expected for element in value)
+    return attribute_value(value) == expected
+
+def metric_identifier(key:str, step:int, n:int=0) -> str:
+    """
+    Returns the identifier of the entity of a metric point.
+
+    Args:
+        key (str): The metric key.
+        step (int): The step of the point.
+        n (int): The number of earlier points of the metric at the same step. Defaults to 0.
+
+    Returns:
+        str: {key}_{step}, or {key}_{step}_{n} for a repetition of the step.
+    """
+    return f'{key}_{step}' if n == 0 else f'{key}_{step}_{n}'
+
+class MetricNumbering:
+    """Names the entities of metric points as they are logged, with metric_identifier.
+
+    Every point of a key at a step already seen is a repetition of the step, whether or not it follows the previous
+    point, so the points of a run are named the same whether they are numbered all at once or one at a time.
+    """
+    def __init__(self):
+        self._counts: Dict[Tuple[str, int], int] = {}
+
+    def number(self, key:str, step:int) -> int:
+        """
+        Returns the number of the points of a key logged at a step before the next one.
+        """
+        n = self._counts.get((key, step), 0)
+        self._counts[(key, step)] = n + 1
+        return n
+
+    def identifier(self, key:str, step:int) -> str:
+        """
+        Returns the identifier of the next point of a key at a step.
+        """
+        return metric_identifier(key, step, self.number(key, step))
+
+def metric_key(identifier:str, attributes:Dict[str, Any]) -> Optional[str]:
+    """
+    Returns the metric key of a ModelEvaluation entity.
+
+    The key is the mlflow:key attribute. Documents written before the attribute was added are parsed as
+    metric_identifier names them, which is ambiguous only for repetitions of keys that end with _{step},
+    e.g. loss_3_3 at step 3, read as the first point of loss_3.
+
+    Args:
+        identifier (str): The identifier of the entity.
+        attributes (Dict[str, Any]): The plain attribute values of the entity.
+
+    Returns:
+        Optional[str]: The key, None if the identifier doesn't name a point of the entity's step.
+    """
+    if attributes.get('mlflow:key') is not None:
+        return str(attributes['mlflow:key'])
+    if attributes.get('mlflow:step') is None:
+        return None
+    suffix = f"_{attributes['mlflow:step']}"
+    if identifier.endswith(suffix):
+        return identifier[:-len(suffix)]
+    stem, _, n = identifier.rpartition('_')
+    if n.isdigit() and stem.endswith(suffix):
+        return stem[:-len(suffix)]
+    return None
+
+def load_document(path:str) -> Dict[str, Any]:
+    """
+    Loads a PROV-JSON document as a dictionary.
+
+    Args:
+        path (str): The path of the document.
+
+    Returns:
+        Dict[str, Any]: The document.
+    """
+    with open(path) as document:
+        return json.load(document)
+
+def _occurrences(value:Any) -> List[Dict[str, Any]]:
+    #records declared more than once are serialized as a list of attribute dictionaries
+    return value if isinstance(value, list) else [value]
+
+def iter_records(document:Dict[str, Any]) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """
+    Iterates over the entities, activities and agents of a PROV-JSON document.
+
+    Args:
+        document (Dict[str, Any]): The document.
+
+    Yields:
+        Tuple[str, str, Dict[str, Any]]: The kind, identifier and attributes of each record.
+    """
+    for kind in RECORD_KINDS:
+        for identifier, value in document.get(kind, {}).items():
+            for attributes in _occurrences(value):
+                yield kind, identifier, attributes
+
+def iter_relations(document:Dict[str, Any]) -> Iterator[Relation]:
+    """
+    Iterates over the relations of a PROV-JSON document.
+
+    Args:
+        document (Dict[str, Any]): The document.
+
+    Yields:
+        Relation: Each relation, with the endpoints removed from its attributes.
+    """
+    for kind, (subject_key, object_key) in RELATION_ENDPOINTS.items():
+        for identifier, value in document.get(kind, {}).items():
+            for attributes in _occurrences(value):
+                attributes = dict(attributes)
+                subject = attributes.pop(subject_key, None)
+                obj = attributes.pop(object_key, None)
+                yield Relation(kind, identifier, subject, obj, attributes)
+
+def document_run_id(document:Dict[str, Any]) -> Optional[str]:
+    """
+    Returns the ID of the run a document was generated for.
+
+    Args:
+        document (Dict[str, Any]): The document.
+
+    Returns:
+        Optional[str]: The value of mlflow:run_id of the LearningStage entity, None if there is no such entity.
+    """
+    for value in document.get('entity', {}).values():
+        for attributes in _occurrences(value):
+            if attribute_value(attributes.get('prov-ml:type')) == 'LearningStage':
+                return attribute_value(attributes.get('mlflow:run_id'))
+    return None
+
+
+class ProvIndex:
+    """Adjacency and attribute indexes over one or more PROV-JSON documents.
+
+    Documents added with a scope have all their identifiers prefixed with ``{scope}/``, so that records with the
+    same name in different runs (e.g. ``train_step_0``) stay distinct. Documents added without a scope share
+    their identifiers.
+
+    Args:
+        documents (Union[Dict[str, Any], Iterable[Dict[str, Any]], None]): The documents to index. If more than one
+            document is given, each one is scoped by its run ID. Defaults to None.
+    """
+    def __init__(self, documents:Union[Dict[str, Any], Iterable[Dict[str, Any]], None]=None):
+        self._kinds: Dict[str, str] = {}
+        self._attributes: Dict[str, Dict[str, Any]] = {}
+        self._relations: List[Relation] = []
+        self._by_kind: Dict[str, List[int]] = {}
+        self._by_subject: Dict[str, List[int]] = {}
+        self._by_object: Dict[str, List[int]] = {}
+        self._attribute_index: Dict[str, Dict[Any, List[str]]] = {}
+
+        if documents is None:
+            return
+        if isinstance(documents, dict):
+            self.add(documents)
+            return
+        documents = list(documents)
+        for i, document in enumerate(documents):
+            self.add(document, scope=(document_run_id(document) or str(i)) if len(documents) > 1 else None)
+
+    @classmethod
+    def from_files(cls, paths:Iterable[str]) -> 'ProvIndex':
+        """
+        Builds an index over the documents stored at the given paths, each one scoped by its run ID.
+
+        Args:
+            paths (Iterable[str]): The paths of the documents.
+
+        Returns:
+            ProvIndex: The index.
+        """
+        index = cls()
+        for i, path in enumerate(paths):
+            document = load_document(path)
+            index.add(document, scope=document_run_id(document) or str(i))
+        return index
+
+    def add(self, document:Dict[str, Any], scope:Optional[str]=None) -> None:
+        """
+        Adds the records and relations of a document to the index, in O(R).
+
+        Args:
+            document (Dict[str, Any]): The document.
+            scope (Optional[str]): The prefix of the identifiers of the document. Defaults to None.
+        """
+        qualify = (lambda identifier: identifier) if scope is None else (lambda identifier: f'{scope}/{identifier}')
+
+        for kind, identifier, attributes in iter_records(document):
+            identifier = qualify(identifier)
+            self._kinds[identifier] = kind
+            self._attributes.setdefault(identifier, {}).update(attributes)
+            for key, value in attributes.items():
+                if key in self._attribute_index:
+                    for index_key in _index_keys(value):
+                        self._attribute_index[key].setdefault(index_key, []).append(identifier)
+
+        for relation in iter_relations(document):
+            position = len(self._relations)
+            relation = relation._replace(
+                identifier=qualify(relation.identifier),
+                subject=qualify(relation.subject) if relation.subject is not None else None,
+                object=qualify(relation.object) if relation.object is not None else None,
+            )
+            self._relations.append(relation)
+            self._by_kind.setdefault(relation.kind, []).append(position)
+            if relation.subject is not None:
+                self._by_subject.setdefault(relation.subject, []).append(position)
+            if relation.object is not None:
+                self._by_object.setdefault(relation.object, []).append(position)
+
+    def __len__(self) -> int:
+        return len(self._kinds) + len(self._relations)
+
+    def __contains__(self, identifier:str) -> bool:
+        return identifier in self._kinds
+
+    def kind(self, identifier:str) -> Optional[str]:
+        """
+        Returns the kind (entity, activity or agent) of a record, None if the record is not in the index.
+        """
+        return self._kinds.get(identifier)
+
+    def attributes(self, identifier:str) -> Dict[str, Any]:
+        """
+        Returns the attributes of a record, with their plain values. Attributes with several values are lists.
+
+        Args:
+            identifier (str): The identifier of the record.
+
+        Returns:
+            Dict[str, Any]: The attributes, empty if the record is not in the index.
+        """
+        return {key: [attribute_value(element) for element in value] if isinstance(value, list) else attribute_value(value)
+                for key, value in self._attributes.get(identifier, {}).items()}
+
+    def relations(self, kind:Optional[str]=None, subject:Optional[str]=None, object:Optional[str]=None) -> List[Relation]:
+        """
+        Returns the relations matching all the given filters.
+
+        The candidates are taken from the smallest of the matching indexes, so the cost is proportional
+        to the number of relations of the given subject, object or type, not to the size of the document.
+
+        Args:
+            kind (Optional[str]): The relation type, e.g. wasGeneratedBy. Defaults to None.
+            subject (Optional[str]): The identifier of the subject. Defaults to None.
+            object (Optional[str]): The identifier of the object. Defaults to None.
+
+        Returns:
+            List[Relation]: The matching relations.
+        """
+        candidates = [positions for positions in (
+            self._by_kind.get(kind, []) if kind is not None else None,
+            self._by_subject.get(subject, []) if subject is not None else None,
+            self._by_object.get(object, []) if object is not None else None,
+        ) if positions is not None]
+        positions = min(candidates, key=len) if candidates else range(len(self._relations))
+        return [relation for relation in (self._relations[position] for position in positions)
+                if (kind is None or relation.kind == kind)
+                and (subject is None or relation.subject == subject)
+                and (object is None or relation.object == object)]
+
+    def _attribute_lookup(self, key:str) -> Dict[Any, List[str]]:
+        if key not in self._attribute_index:
+            lookup: Dict[Any, List[str]] = {}
+            for identifier, attributes in self._attributes.items():
+                if key in attributes:
+                    for index_key in _index_keys(attributes[key]):
+                        lookup.setdefault(index_key, []).append(identifier)
+            self._attribute_index[key] = lookup
+        return self._attribute_index[key]
+
+    def find(self, kind:Optional[str]=None, attributes:Optional[Dict[str, Any]]=None) -> List[str]:
+        """
+        Returns the records of the given kind whose attributes have the given plain values.
+        A record with several values for an attribute matches if any of them is the given value.
+
+        The first use of an attribute key builds its index in O(R), later lookups are O(1) plus the size of the result.
+
+        Args:
+            kind (Optional[str]): The record kind (entity, activity or agent). Defaults to None.
+            attributes (Optional[Dict[str, Any]]): The attribute values to match, e.g. {'prov-ml:type': 'Model'}. Defaults to None.
+
+        Returns:
+            List[str]: The identifiers of the matching records.
+        """
+        matches: Optional[List[str]] = None
+        for key, value in (attributes or {}).items():
+            found = self._attribute_lookup(key).get(value, [])
+            if matches is None:
+                matches = found
+            else:
+                found = set(found)
+                matches = [identifier for identifier in matches if identifier in found]
+        if matches is None:
+            matches = list(self._kinds)
+        return [identifier for identifier in matches if kind is None or self._kinds.get(identifier) == kind]
+
+    def _matches(self, identifier:str, attributes:Optional[Dict[str, Any]]) -> bool:
+        return all(_has_value(self._attributes.get(identifier, {}).get(key), value) for key, value in (attributes or {}).items())
+
+    def _traverse(self, start:str, forward:bool, relation_kinds:Optional[Iterable[str]], max_depth:Optional[int],
+                  attributes:Optional[Dict[str, Any]]) -> List[str]:
+        relation_kinds = set(relation_kinds) if relation_kinds is not None else None
+        adjacency = self._by_subject if forward else self._by_object
+        visited = {start}
+        lineage = []
+        queue = deque([(start, 0)])
+        while queue:
+            identifier, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for position in adjacency.get(identifier, []):
+                relation = self._relations[position]
+                if relation_kinds is not None and relation.kind not in relation_kinds:
+                    continue
+                neighbour = relation.object if forward else relation.subject
+                if neighbour is None or neighbour in visited:
+                    continue
+                visited.add(neighbour)
+                queue.append((neighbour, depth + 1))
+                if self._matches(neighbour, attributes):
+                    lineage.append(neighbour)
+        return lineage
+
+    def upstream(self, identifier:str, relation_kinds:Optional[Iterable[str]]=None, max_depth:Optional[int]=None,
+                 attributes:Optional[Dict[str, Any]]=None) -> List[str]:
+        """
+        Returns the records a record depends on, in breadth-first order.
+
+        For example, the hyperparameters and datasets that produced a model version are
+        ``upstream('mlp_1', attributes={'prov-ml:type': 'LearningHyperparameterValue'})`` and
+        ``upstream('mlp_1', attributes={'prov-ml:type': 'FeatureSetData'})``.
+
+        Args:
+            identifier (str): The identifier of the record to start from.
+            relation_kinds (Optional[Iterable[str]]): The relation types to follow. Defaults to None, all types.
+            max_depth (Optional[int]): The maximum number of relations to follow. Defaults to None, no limit.
+            attributes (Optional[Dict[str, Any]]): Plain attribute values the returned records must have,
+                the traversal itself is not restricted by them. Defaults to None.
+
+        Returns:
+            List[str]: The identifiers of the upstream records.
+        """
+        return self._traverse(identifier, True, relation_kinds, max_depth, attributes)
+
+    def downstream(self, identifier:str, relation_kinds:Optional[Iterable[str]]=None, max_depth:Optional[int]=None,
+                   attributes:Optional[Dict[str, Any]]=None) -> List[str]:
+        """
+        Returns the records that depend on a record, in breadth-first order.
+
+        Args:
+            identifier (str): The identifier of the record to start from.
+            relation_kinds (Optional[Iterable[str]]): The relation types to follow. Defaults to None, all types.
+            max_depth (Optional[int]): The maximum number of relations to follow. Defaults to None, no limit.
+            attributes (Optional[Dict[str, Any]]): Plain attribute values the returned records must have. Defaults to None.
+
+        Returns:
+            List[str]: The identifiers of the downstream records.
+        """
+        return self._traverse(identifier, False, relation_kinds, max_depth, attributes)
@@ -0,0 +1,433 @@
+"""Compact in-memory provenance document, serialized directly to PROV-JSON.
+
+A ``prov.model.ProvDocument`` allocates a record object, a dictionary of attribute sets and QualifiedName objects for
+every record, which dominates memory and build time for runs with many per-step metric entities. RecordStore exposes
+the part of the ProvDocument API used by first_level_prov and second_level_prov, but keeps each record as a slotted
+object holding its kind, its identifier and two tuples: the attribute keys, shared by all the records with the same
+keys, and the attribute values. Identifiers are interned, so relations share the strings of the records they link.
+
+serialize writes PROV-JSON with the same layout as the prov library (records grouped by kind in order of first
+appearance, anonymous relations numbered _:id1, _:id2, ... in creation order); to_document converts the store to a
+ProvDocument, only for consumers that need one, such as the DOT export.
+
+Identifiers are validated as records are added, with the index of identifiers the store keeps anyway: an identifier
+given to a second record is a duplicate, and an endpoint of a relation that isn't defined yet is remembered until
+a record defines it, so relations can still be added before their endpoints; the endpoints still undefined when
+validate is called are dangling. In strict mode an issue raises a ValueError, in lenient mode it is reported in issues.
+"""
+import bisect
+import datetime
+import json
+import sys
+from json.encoder import encode_basestring_ascii as _quote
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple, Union
+
+from .query import RELATION_ENDPOINTS
+
+#modes of the incremental validation of a RecordStore
+VALIDATION_MODES = ('strict', 'lenient')
+
+def _validation_mode(validation:Optional[str]) -> Optional[str]:
+    if validation is not None and validation not in VALIDATION_MODES:
+        raise ValueError(f'Unknown validation mode {validation!r}, the modes are {VALIDATION_MODES}')
+    return validation
+
+#namespaces predefined by the prov library, which are never written to the prefix section
+_BUILTIN_NAMESPACES = {
+    'prov': 'http://www.w3.org/ns/prov#',
+    'xsd': 'http://www.w3.org/2001/XMLSchema#',
+    'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+}
+
+def _literal(value:Any) -> str:
+    #PROV-JSON text of an attribute value, typed like prov.serializers.provjson.encode_json_representation
+    if isinstance(value, str):
+        return _quote(value)
+    if isinstance(value, list):
+        return '[' + ', '.join(_literal(item) for item in value) + ']'
+    if isinstance(value, bool) or value is None or isinstance(value, dict):
+        return json.dumps(value)
+    if isinstance(value, int):
+        return json.dumps({'$': str(value), 'type': 'xsd:int'})
+    if isinstance(value, float):
+        return json.dumps({'$': repr(value), 'type': 'xsd:double'})
+    if isinstance(value, datetime.datetime):
+        return json.dumps({'$': value.isoformat(), 'type': 'xsd:dateTime'})
+    return _quote(str(value))
+
+
+class Record:
+    """A record of a RecordStore: an element (entity, activity, agent) or a relation.
+
+    The endpoints of a relation are its first two attributes, e.g. prov:entity and prov:activity for wasGeneratedBy.
+
+    Attributes:
+        kind (str): The PROV-JSON kind of the record, e.g. entity or wasGeneratedBy.
+        identifier (Union[str, int]): The identifier, or the number of the anonymous relation.
+        keys (Tuple[str, ...]): The attribute keys.
+        values (Tuple[Any, ...]): The attribute values; a list holds the values of a multi-valued attribute.
+    """
+    __slots__ = ('kind', 'identifier', 'keys', 'values')
+
+    def __init__(self, kind:str, identifier:Union[str, int], keys:Tuple[str, ...], values:Tuple[Any, ...]):
+        self.kind = kind
+        self.identifier = identifier
+        self.keys = keys
+        self.values = values
+
+    def __repr__(self) -> str:
+        return f'Record({self.kind}, {self.identifier!r})'
+
+    @property
+    def attributes(self) -> Dict[str, Any]:
+        """
+        The attributes of the record, by key.
+        """
+        return dict(zip(self.keys, self.values))
+
+    def get_attribute(self, key:str) -> set:
+        """
+        Returns the set of values of an attribute, empty if the record doesn't have it, like ProvRecord.get_attribute.
+        """
+        for record_key, value in zip(self.keys, self.values):
+            if record_key == key:
+                return set(value) if isinstance(value, list) else {value}
+        return set()
+
+    def add_attributes(self, attributes:Dict[str, Any]) -> None:
+        """
+        Adds attributes to the record. A different value for an existing key is added to its values.
+
+        Args:
+            attributes (Dict[str, Any]): The attributes.
+        """
+        current = dict(zip(self.keys, self.values))
+        for key, value in attributes.items():
+            if key not in current:
+                current[key] = value
+            elif isinstance(current[key], list):
+                if value not in current[key]:
+                    current[key] = current[key] + [value]
+            elif current[key] != value:
+                current[key] = [current[key], value]
+        self.keys = tuple(current)
+        self.values = tuple(current.values())
+
+
+class RecordStore:
+    """Provenance document made of compact records, with the ProvDocument methods used by the provenance levels.
+
+    Records and relations can be given either Record objects or identifiers as endpoints. Identifiers with a prefix
+    (prefix:name) must use a registered namespace, as in prov.
+
+    Args:
+        validation (Optional[str]): strict, to raise a ValueError on a duplicate identifier or a dangling endpoint,
+            lenient, to record it in issues, or None, not to validate. Defaults to None.
+
+    Attributes:
+        issues (List[str]): The issues found in lenient mode.
+    """
+    def __init__(self, validation:Optional[str]=None):
+        self.validation = _validation_mode(validation)
+        self.issues: List[str] = []
+        self._unresolved: Dict[str, str] = {}    #endpoints not defined yet, with the kind of the first relation to them
+        self._default: Optional[str] = None
+        self._namespaces: Dict[str, str] = {}
+        self._by_kind: Dict[str, List[Record]] = {}
+        self._by_identifier: Dict[str, Union[Record, List[Record]]] = {}
+        self._shapes: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        self._anonymous = 0
+
+    def __len__(self) -> int:
+        return sum(len(records) for records in self._by_kind.values())
+
+    #namespaces
+
+    def set_default_namespace(self, uri:str) -> None:
+        self._default = uri
+
+    def add_namespace(self, prefix:str, uri:str) -> str:
+        """
+        Registers a namespace, renaming its prefix (prefix_1, prefix_2, ...) if it is taken by another URI, as prov does.
+
+        Returns:
+            str: The prefix the namespace was registered with.
+        """
+        if _BUILTIN_NAMESPACES.get(prefix) == uri or self._namespaces.get(prefix) == uri:
+            return prefix
+        if prefix in _BUILTIN_NAMESPACES or prefix in self._namespaces:
+            suffix = 1
+            while f'{prefix}_{suffix}' in _BUILTIN_NAMESPACES or f'{prefix}_{suffix}' in self._namespaces:
+                suffix += 1
+            prefix = f'{prefix}_{suffix}'
+        self._namespaces[prefix] = uri
+        return prefix
+
+    def _identifier(self, identifier:Union[str, Record]) -> str:
+        if isinstance(identifier, Record):
+            return identifier.identifier
+        if ':' in identifier:
+            prefix = identifier.split(':', 1)[0]
+            if prefix not in self._namespaces and prefix not in _BUILTIN_NAMESPACES:
+                raise ValueError(f'{identifier!r} is not a valid identifier: the prefix {prefix!r} is not a registered namespace')
+        return sys.intern(identifier)
+
+    #validation
+
+    def _issue(self, message:str) -> None:
+        if self.validation == 'strict':
+            raise ValueError(message)
+        self.issues.append(message)
+
+    def validate(self) -> List[str]:
+        """
+        Reports the relation endpoints that no record defines. Duplicates are reported as they are added.
+
+        Returns:
+            List[str]: The issues found so far, in lenient mode.
+
+        Raises:
+            ValueError: In strict mode, if an endpoint is dangling.
+        """
+        if self.validation is None:
+            return []
+        dangling = [f'dangling endpoint {identifier!r} of a {kind} relation' for identifier, kind in self._unresolved.items()]
+        self._unresolved.clear()
+        if dangling and self.validation == 'strict':
+            raise ValueError('; '.join(dangling))
+        self.issues.extend(dangling)
+        return list(self.issues)
+
+    #records
+
+    def _add(self, kind:str, identifier:Optional[str], attributes:Dict[str, Any]) -> Record:
+        if self.validation is not None and identifier is not None:
+            existing = self._by_identifier.get(identifier)
+            if existing is not None:
+                existing_kind = (existing[0] if isinstance(existing, list) else existing).kind
+                self._issue(f'duplicate identifier {identifier!r}: {kind} added after {existing_kind}')
+            self._unresolved.pop(identifier, None)
+        keys = tuple(attributes)
+        keys = self._shapes.setdefault(keys, keys)
+        if identifier is None:
+            self._anonymous += 1
+            record = Record(kind, self._anonymous, keys, tuple(attributes.values()))
+        else:
+            record = Record(kind, identifier, keys, tuple(attributes.values()))
+            existing = self._by_identifier.get(identifier)
+            if existing is None:
+                self._by_identifier[identifier] = record
+            elif isinstance(existing, list):
+                existing.append(record)
+            else:
+                self._by_identifier[identifier] = [existing, record]
+        self._by_kind.setdefault(kind, []).append(record)
+        return record
+
+    def get_record(self, identifier:str) -> List[Record]:
+        """
+        Returns the records with the given identifier, like ProvDocument.get_record.
+        """
+        records = self._by_identifier.get(identifier)
+        if records is None:
+            return []
+        return list(records) if isinstance(records, list) else [records]
+
+    def records(self, kind:str) -> List[Record]:
+        """
+        Returns the records of a kind, e.g. entity or hadMember, in the order they were added.
+        """
+        return list(self._by_kind.get(kind, ()))
+
+    def remove(self, identifier:str) -> int:
+        """
+        Removes the records with the given identifier and the relations it is an endpoint of, e.g. an entity replaced
+        when a resumed run extends its document. The anonymous relations left are renumbered in creation order.
+
+        Returns:
+            int: The number of records removed.
+        """
+        identifier = self._identifier(identifier)
+        removed: List[Record] = []
+        for kind in list(self._by_kind):
+            endpoints = RELATION_ENDPOINTS.get(kind, ())
+            kept = []
+            for record in self._by_kind[kind]:
+                if record.identifier == identifier or any(record.get_attribute(key) == {identifier} for key in endpoints):
+                    removed.append(record)
+                else:
+                    kept.append(record)
+            if kept:
+                self._by_kind[kind] = kept
+            else:
+                del self._by_kind[kind]
+        numbers = sorted(record.identifier for record in removed if isinstance(record.identifier, int))
+        for record in removed:
+            if isinstance(record.identifier, str):
+                instances = self._by_identifier.pop(record.identifier)
+                if isinstance(instances, list):
+                    instances = [instance for instance in instances if instance is not record]
+                    self._by_identifier[record.identifier] = instances if len(instances) > 1 else instances[0]
+        if numbers:
+            for records in self._by_kind.values():
+                for record in records:
+                    if isinstance(record.identifier, int):
+                        record.identifier -= bisect.bisect(numbers, record.identifier)
+            self._anonymous -= len(numbers)
+        self._unresolved.pop(identifier, None)
+        return len(removed)
+
+    def entity(self, identifier:str, other_attributes:Optional[Dict[str, Any]]=None) -> Record:
+        return self._add('entity', self._identifier(identifier), other_attributes or {})
+
+    def activity(self, identifier:str, other_attributes:Optional[Dict[str, Any]]=None) -> Record:
+        return self._add('activity', self._identifier(identifier), other_attributes or {})
+
+    def agent(self, identifier:str, other_attributes:Optional[Dict[str, Any]]=None) -> Record:
+        return self._add('agent', self._identifier(identifier), other_attributes or {})
+
+    def relation(self, kind:str, subject:Union[str, Record], object:Union[str, Record], identifier:Optional[str]=None,
+                 other_attributes:Optional[Dict[str, Any]]=None) -> Record:
+        """
+        Adds a relation of any kind of RELATION_ENDPOINTS.
+
+        Args:
+            kind (str): The kind of the relation, e.g. wasGeneratedBy.
+            subject (Union[str, Record]): The subject of the relation, e.g. the generated entity.
+            object (Union[str, Record]): The object of the relation, e.g. the generating activity.
+            identifier (Optional[str]): The identifier of the relation. Defaults to None, an anonymous relation.
+            other_attributes (Optional[Dict[str, Any]]): The attributes of the relation. Defaults to None.
+
+        Returns:
+            Record: The relation.
+        """
+        subject_key, object_key = RELATION_ENDPOINTS[kind]
+        attributes = {subject_key: self._identifier(subject), object_key: self._identifier(object), **(other_attributes or {})}
+        if self.validation is not None:
+            for endpoint in (attributes[subject_key], attributes[object_key]):
+                if endpoint not in self._by_identifier:
+                    self._unresolved.setdefault(endpoint, kind)
+        return self._add(kind, self._identifier(identifier) if identifier is not None else None, attributes)
+
+    def wasGeneratedBy(self, entity, activity, identifier=None, other_attributes=None) -> Record:
+        return self.relation('wasGeneratedBy', entity, activity, identifier, other_attributes)
+
+    def used(self, activity, entity, identifier=None, other_attributes=None) -> Record:
+        return self.relation('used', activity, entity, identifier, other_attributes)
+
+    def wasInformedBy(self, informed, informant, identifier=None, other_attributes=None) -> Record:
+        return self.relation('wasInformedBy', informed, informant, identifier, other_attributes)
+
+    def wasStartedBy(self, activity, trigger, identifier=None, other_attributes=None) -> Record:
+        return self.relation('wasStartedBy', activity, trigger, identifier, other_attributes)
+
+    def wasDerivedFrom(self, generated_entity, used_entity, identifier=None, other_attributes=None) -> Record:
+        return self.relation('wasDerivedFrom', generated_entity, used_entity, identifier, other_attributes)
+
+    def wasAssociatedWith(self, activity, agent, identifier=None, other_attributes=None) -> Record:
+        return self.relation('wasAssociatedWith', activity, agent, identifier, other_attributes)
+
+    def specializationOf(self, specific_entity, general_entity) -> Record:
+        return self.relation('specializationOf', specific_entity, general_entity)
+
+    def hadMember(self, collection, entity) -> Record:
+        return self.relation('hadMember', collection, entity)
+
+    #serialization
+
+    def _prefixes(self) -> Dict[str, str]:
+        prefixes = dict(self._namespaces)
+        if self._default:
+            prefixes['default'] = self._default
+        return prefixes
+
+    def _iter_json(self) -> Iterator[str]:
+        #same text as json.dump(ProvDocument) with the prov JSON encoder, produced record by record
+        yield '{'
+        separator = ''
+        prefixes = self._prefixes()
+        if prefixes:
+            yield '"prefix": ' + json.dumps(prefixes)
+            separator = ', '
+        for kind, records in self._by_kind.items():
+            yield separator + _quote(kind) + ': {'
+            separator = ', '
+            first = True
+            for record in records:
+                if isinstance(record.identifier, int):
+                    identifier = f'_:id{record.identifier}'
+                    instances = (record,)
+                else:
+                    identifier = record.identifier
+                    instances = self._by_identifier[identifier]
+                    if isinstance(instances, list):
+                        instances = [instance for instance in instances if instance.kind == kind]
+                        if instances[0] is not record:
+                            continue    #written as a list with the first record of the same kind and identifier
+                        if len(instances) == 1:
+                            instances = (record,)
+                    else:
+                        instances = (record,)
+                body = ', '.join(self._record_json(instance) for instance in instances)
+                yield ('' if first else ', ') + _quote(identifier) + ': ' + (body if len(instances) == 1 else f'[{body}]')
+                first = False
+            yield '}'
+        yield '}'
+
+    @staticmethod
+    def _record_json(record:Record) -> str:
+        return '{' + ', '.join(_quote(key) + ': ' + _literal(value) for key, value in zip(record.keys, record.values)) + '}'
+
+    def serialize(self, destination:Optional[IO[str]]=None) -> Optional[str]:
+        """
+        Serializes the store to PROV-JSON, like ProvDocument.serialize.
+
+        Args:
+            destination (Optional[IO[str]]): A text stream to write to. Defaults to None, the document is returned.
+
+        Returns:
+            Optional[str]: The document, if no destination was given.
+        """
+        if destination is not None:
+            for chunk in self._iter_json():
+                destination.write(chunk)
+            return None
+        return ''.join(self._iter_json())
+
+    @classmethod
+    def deserialize(cls, source:Optional[IO[str]]=None, content:Optional[str]=None, validation:Optional[str]=None) -> 'RecordStore':
+        """
+        Loads a PROV-JSON document, like ProvDocument.deserialize.
+
+        Args:
+            source (Optional[IO[str]]): A text stream to read from. Defaults to None.
+            content (Optional[str]): The document, if no source is given. Defaults to None.
+            validation (Optional[str]): The validation mode of the records added afterwards; the loaded records
+                aren't validated. Defaults to None.
+
+        Returns:
+            RecordStore: The store.
+        """
+        document = json.load(source) if source is not None else json.loads(content)
+        store = cls()
+        for prefix, uri in document.get('prefix', {}).items():
+            if prefix == 'default':
+                store.set_default_namespace(uri)
+            else:
+                store.add_namespace(prefix, uri)
+        for kind, section in document.items():
+            if kind in ('prefix', 'bundle'):
+                continue
+            for identifier, content in section.items():
+                for attributes in (content if isinstance(content, list) else [content]):
+                    store._add(kind, None if identifier.startswith('_:') else sys.intern(identifier), attributes)
+        store.validation = _validation_mode(validation)    #set once loaded, the document was validated when it was built
+        return store
+
+    def to_document(self) -> 'prov.model.ProvDocument':
+        """
+        Converts the store to a prov.model.ProvDocument.
+        """
+        import prov.model as prov
+
+        return prov.ProvDocument.deserialize(content=self.serialize())
@@ -0,0 +1,276 @@
+"""Sampling and windowed aggregation of high-frequency metrics.
+
+Policies are given per metric key (or fnmatch pattern) to start_run, and decide which of the points logged with
+log_metric and log_metrics are written to MLflow, and so become entities of the provenance document:
+
+* EveryNth(n) keeps one point out of n;
+* Throttle(seconds) keeps at most one point per interval;
+* Window(size, statistic) replaces each window of size points with their mean, min or max, computed in constant
+  memory; the resulting point is logged at the last step of the window and its entity records the step range.
+
+The last point of every key is always written when the run ends, so the final value of a metric is never dropped.
+"""
+import time
+from fnmatch import fnmatchcase
+from typing import Any, Dict, List, Optional, Tuple
+
+from .buffer import is_tensor
+
+#a point: value, step, timestamp
+Point = Tuple[Any, int, int]
+
+class MetricPolicy:
+    """Base class of the sampling policies."""
+    def sampler(self) -> '_Sampler':
+        raise NotImplementedError
+
+
+class EveryNth(MetricPolicy):
+    """Keeps the first point and then one point out of n.
+
+    Args:
+        n (int): The sampling period, in points.
+    """
+    def __init__(self, n:int):
+        if n < 1:
+            raise ValueError(f'n must be at least 1, not {n}')
+        self.n = n
+
+    def __repr__(self) -> str:
+        return f'EveryNth({self.n})'
+
+    def sampler(self) -> '_Sampler':
+        return _EveryNthSampler(self.n)
+
+
+class Throttle(MetricPolicy):
+    """Keeps the first point and then at most one point per interval.
+
+    Args:
+        seconds (float): The minimum time between two logged points.
+    """
+    def __init__(self, seconds:float):
+        self.seconds = seconds
+
+    def __repr__(self) -> str:
+        return f'Throttle({self.seconds})'
+
+    def sampler(self) -> '_Sampler':
+        return _ThrottleSampler(self.seconds)
+
+
+class Window(MetricPolicy):
+    """Logs one aggregate of each window of consecutive points.
+
+    Args:
+        size (int): The number of points in each window.
+        statistic (str): One of mean, min or max. Defaults to mean.
+    """
+    STATISTICS = ('mean', 'min', 'max')
+
+    def __init__(self, size:int, statistic:str='mean'):
+        if size < 1:
+            raise ValueError(f'size must be at least 1, not {size}')
+        if statistic not in self.STATISTICS:
+            raise ValueError(f'statistic must be one of {self.STATISTICS}, not {statistic!r}')
+        self.size = size
+        self.statistic = statistic
+
+    def __repr__(self) -> str:
+        return f'Window({self.size}, {self.statistic!r})'
+
+    def sampler(self) -> '_Sampler':
+        return _WindowSampler(self.size, self.statistic)
+
+
+class _Sampler:
+    #state of a policy for one key: add returns the point to log now, if any, and flush the point still pending
+    def __init__(self):
+        self._pending: Optional[Point] = None
+
+    def add(self, value:Any, step:int, timestamp:int) -> Optional[Point]:
+        if self._keep():
+            self._pending = None
+            return value, step, timestamp
+        self._pending = value, step, timestamp
+        return None
+
+    def flush(self) -> Optional[Point]:
+        pending, self._pending = self._pending, None
+        return pending
+
+    def _keep(self) -> bool:
+        raise NotImplementedError
+
+
+class _EveryNthSampler(_Sampler):
+    def __init__(self, n:int):
+        super().__init__()
+        self.n = n
+        self._seen = 0
+
+    def _keep(self) -> bool:
+        self._seen += 1
+        return (self._seen - 1) % self.n == 0
+
+
+class _ThrottleSampler(_Sampler):
+    def __init__(self, seconds:float):
+        super().__init__()
+        self.seconds = seconds
+        self._last: Optional[float] = None
+
+    def _keep(self) -> bool:
+        now = time.monotonic()
+        if self._last is None or now - self._last >= self.seconds:
+            self._last = now
+            return True
+        return False
+
+
+def _minimum(a:Any, b:Any) -> Any:
+    if is_tensor(a) or is_tensor(b):
+        import torch
+        return torch.minimum(torch.as_tensor(a), torch.as_tensor(b))    #stays on the device, no synchronization
+    return min(a, b)
+
+def _maximum(a:Any, b:Any) -> Any:
+    if is_tensor(a) or is_tensor(b):
+        import torch
+        return torch.maximum(torch.as_tensor(a), torch.as_tensor(b))
+    return max(a, b)
+
+
+class _WindowSampler:
+    #running count, aggregate and step range of the current window: constant memory, whatever the window size
+    def __init__(self, size:int, statistic:str):
+        self.size = size
+        self.statistic = statistic
+        self._reset()
+
+    def _reset(self) -> None:
+        self._count = 0
+        self._aggregate: Any = None
+        self.first_step: Optional[int] = None
+        self._last: Optional[Tuple[int, int]] = None
+
+    def add(self, value:Any, step:int, timestamp:int) -> Optional[Point]:
+        if is_tensor(value):
+            value = value.detach()
+        if self._count == 0:
+            #a copy: the caller may update the tensor in place before the window is flushed
+            self._aggregate = value.clone() if is_tensor(value) else value
+            self.first_step = step
+        elif self.statistic == 'mean':
+            self._aggregate = self._aggregate + value
+        elif self.statistic == 'min':
+            self._aggregate = _minimum(self._aggregate, value)
+        else:
+            self._aggregate = _maximum(self._aggregate, value)
+        self._count += 1
+        self._last = step, timestamp
+        return self.flush() if self._count == self.size else None
+
+    def flush(self) -> Optional[Point]:
+        if self._count == 0:
+            return None
+        value = self._aggregate / self._count if self.statistic == 'mean' else self._aggregate
+        step, timestamp = self._last
+        self._reset()
+        return value, step, timestamp
+
+
+class MetricSampler:
+    """Applies the policies of a run to the points of each metric key and context, counting the raw and logged points.
+
+    A key logged in several contexts, e.g. loss in TRAINING and VALIDATION, is sampled separately in each: a window
+    never aggregates the points of different contexts.
+
+    Args:
+        policies (Dict[str, MetricPolicy]): The policy of each key, or of the keys matching an fnmatch pattern.
+            Exact keys take precedence over patterns; keys matching no entry are logged as they are.
+
+    Attributes:
+        step_ranges (Dict[Tuple[str, str], Dict[int, int]]): For the keys with a Window policy, the first step of the
+            window aggregated by each logged point, by the step it was logged at, for each key and context name.
+    """
+    def __init__(self, policies:Dict[str, MetricPolicy]):
+        self.policies = policies
+        self.step_ranges: Dict[Tuple[str, str], Dict[int, int]] = {}
+        self._policies: Dict[str, Optional[MetricPolicy]] = {}
+        self._samplers: Dict[Tuple[str, str], Optional[Any]] = {}
+        self._counts: Dict[Tuple[str, str], List[int]] = {}
+
+    def _policy(self, key:str) -> Optional[MetricPolicy]:
+        if key not in self._policies:
+            policy = self.policies.get(key)
+            if policy is None:
+                policy = next((policy for pattern, policy in self.policies.items() if fnmatchcase(key, pattern)), None)
+            self._policies[key] = policy
+        return self._policies[key]
+
+    def _sampler(self, key:str, context:str) -> Optional[Any]:
+        if (key, context) not in self._samplers:
+            policy = self._policy(key)
+            self._samplers[(key, context)] = policy.sampler() if policy is not None else None
+            if policy is not None:
+                self._counts[(key, context)] = [0, 0]
+        return self._samplers[(key, context)]
+
+    def add(self, key:str, value:Any, step:int, timestamp:int, context:str) -> Optional[Point]:
+        """
+        Offers a point of a metric to the policy of its key, in its context.
+
+        Args:
+            key (str): The key of the metric.
+            value (Any): The value, a number or a single-element tensor.
+            step (int): The step of the point.
+            timestamp (int): The timestamp of the point, in milliseconds.
+            context (str): The name of the Context of the metric.
+
+        Returns:
+            Optional[Tuple[Any, int, int]]: The value, step and timestamp to log now, None if nothing is logged.
+        """
+        sampler = self._sampler(key, context)
+        if sampler is None:
+            return value, step, timestamp
+        self._counts[(key, context)][0] += 1
+        first_step = getattr(sampler, 'first_step', None)
+        point = sampler.add(value, step, timestamp)
+        if point is not None:
+            self._logged(key, context, point, first_step if first_step is not None else step)
+        return point
+
+    def flush(self) -> List[Tuple[str, Any, int, int, str]]:
+        """
+        Returns the points still pending, e.g. the last point of each key or its incomplete window, when the run ends.
+
+        Returns:
+            List[Tuple[str, Any, int, int, str]]: The key, value, step, timestamp and context name of each point.
+        """
+        points = []
+        for (key, context), sampler in self._samplers.items():
+            if sampler is None:
+                continue
+            first_step = getattr(sampler, 'first_step', None)
+            point = sampler.flush()
+            if point is not None:
+                self._logged(key, context, point, first_step)
+                points.append((key, *point, context))
+        return points
+
+    def _logged(self, key:str, context:str, point:Point, first_step:Optional[int]) -> None:
+        self._counts[(key, context)][1] += 1
+        if isinstance(self._samplers[(key, context)], _WindowSampler):
+            self.step_ranges.setdefault((key, context), {})[point[1]] = first_step
+
+    @property
+    def counts(self) -> Dict[str, Tuple[int, int]]:
+        """
+        The number of raw points and of logged points of each key with a policy, over all its contexts.
+        """
+        counts: Dict[str, Tuple[int, int]] = {}
+        for (key, _), (raw, logged) in self._counts.items():
+            total_raw, total_logged = counts.get(key, (0, 0))
+            counts[key] = (total_raw + raw, total_logged + logged)
+        return counts
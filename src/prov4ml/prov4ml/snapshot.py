@@ -0,0 +1,164 @@
+"""One-shot concurrent gathering of everything the provenance levels read from MLflow about a run."""
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import mlflow
+    from mlflow.entities import Experiment, Metric, Run
+    from mlflow.entities.file_info import FileInfo
+    from mlflow.entities.model_registry import ModelVersion, RegisteredModel
+
+#experiments and registered models don't change during a process, lookups are shared by all the runs it generates
+_experiments: Dict[Tuple[str, str], 'Experiment'] = {}
+_registered_models: Dict[Tuple[str, str], 'RegisteredModel'] = {}
+_cache_lock = threading.Lock()
+
+def traverse_artifact_tree(client:mlflow.MlflowClient,run_id:str,path=None) -> List[FileInfo]:
+    """
+    Recursively traverses the artifact tree of a given run in MLflow and returns a list of FileInfo objects.
+
+    Args:
+        client (mlflow.MlflowClient): The MLflow client object.
+        run_id (str): The ID of the run.
+        path (str, optional): The path to start the traversal from. Defaults to None.
+
+    Returns:
+        List[FileInfo]: A list of FileInfo objects representing the artifacts in the tree.
+    """
+    artifact_list=client.list_artifacts(run_id,path)
+    artifact_paths=[]
+    for artifact in artifact_list:
+        if artifact.is_dir:
+            artifact_paths.extend(traverse_artifact_tree(client,run_id,artifact.path))
+        else:
+            artifact_paths.append(artifact)
+    return artifact_paths
+
+def _memoized(cache:Dict, key:Tuple[str, str], fetch):
+    with _cache_lock:
+        if key in cache:
+            return cache[key]
+    value = fetch()
+    with _cache_lock:
+        cache[key] = value
+    return value
+
+def get_experiment(client:mlflow.MlflowClient, experiment_id:str) -> Experiment:
+    """
+    Returns an experiment, fetched once per tracking server and process.
+    """
+    return _memoized(_experiments, (client.tracking_uri, experiment_id), lambda: client.get_experiment(experiment_id))
+
+def get_registered_model(client:mlflow.MlflowClient, name:str) -> RegisteredModel:
+    """
+    Returns a registered model, fetched once per tracking server and process.
+    """
+    return _memoized(_registered_models, (client.tracking_uri, name), lambda: client.get_registered_model(name))
+
+def stale_metric_keys(run:Run, metric_counts:Optional[Dict[str,int]], logged_keys:Optional[Iterable[str]]=None) -> List[str]:
+    """
+    Returns the keys of the metrics of a run whose histories must be fetched: the ones without recorded points, and
+    the ones logged since the points were recorded.
+
+    Points are told apart by their number, not by their step: a resumed job can log steps that are already recorded,
+    e.g. when it restarts from an earlier checkpoint, or log every point at step 0. Since the run only exposes the
+    latest point of each metric, the keys logged since are given by the caller; the keys logged with MLflow directly
+    during a resumed session, outside prov4ml, are only fetched if they are new.
+
+    Args:
+        run (Run): The run object.
+        metric_counts (Optional[Dict[str, int]]): The number of recorded points of each metric, None if nothing was recorded.
+        logged_keys (Optional[Iterable[str]]): The keys logged since the points were recorded. Defaults to None,
+            unknown: every key is fetched.
+
+    Returns:
+        List[str]: The metric keys.
+    """
+    if metric_counts is None or logged_keys is None:
+        return list(run.data.metrics)
+    logged = set(logged_keys)
+    return [key for key in run.data.metrics if key not in metric_counts or key in logged]
+
+
+class RunSnapshot:
+    """Everything first_level_prov and second_level_prov read from MLflow about a run.
+
+    Attributes:
+        run (Run): The run.
+        experiment (Experiment): The experiment of the run.
+        model_versions (List[ModelVersion]): The model versions generated by the run, possibly none or several.
+        registered_models (Dict[str, RegisteredModel]): The registered model of each model version, by name.
+        metric_histories (Dict[str, List[Metric]]): The points of each metric, when the snapshot extends an existing
+            document only of the metrics logged since it was generated.
+        metric_counts (Dict[str, int]): The number of points of each metric already in the document: the points of
+            metric_histories past them are the new ones.
+        artifacts (List[FileInfo]): The artifacts of the run.
+    """
+    def __init__(self, run:Run, experiment:Experiment, model_versions:List[ModelVersion], registered_models:Dict[str, RegisteredModel],
+                 metric_histories:Dict[str, List[Metric]], artifacts:List[FileInfo], metric_counts:Optional[Dict[str, int]]=None):
+        self.run = run
+        self.experiment = experiment
+        self.model_versions = model_versions
+        self.registered_models = registered_models
+        self.metric_histories = metric_histories
+        self.metric_counts = metric_counts or {}
+        self.artifacts = artifacts
+
+    def recorded_metric_counts(self) -> Dict[str, int]:
+        """
+        Returns the number of points of each metric once the new points are added to the document.
+        """
+        return {**self.metric_counts, **{key: len(history) for key, history in self.metric_histories.items()}}
+
+    @classmethod
+    def gather(cls, client:mlflow.MlflowClient, run_id:str, experiment_id:Optional[str]=None, run:Optional[Run]=None,
+               metric_counts:Optional[Dict[str,int]]=None, logged_keys:Optional[Iterable[str]]=None,
+               metric_histories:Optional[Dict[str, List[Metric]]]=None, max_workers:int=8) -> 'RunSnapshot':
+        """
+        Issues all the lookups of a run concurrently.
+
+        The run, its model versions, its artifact tree and its experiment are fetched together; then the registered
+        models and the metric histories, which depend on them. Experiments and registered models are memoized
+        across the runs of the process.
+
+        Args:
+            client (mlflow.MlflowClient): The MLflow client object.
+            run_id (str): The ID of the run.
+            experiment_id (Optional[str]): The ID of the experiment of the run, if known, so that it is fetched
+                together with the run. Defaults to None.
+            run (Optional[Run]): The run, if already fetched. Defaults to None.
+            metric_counts (Optional[Dict[str, int]]): The number of points of each metric already in the document.
+                Defaults to None, no document.
+            logged_keys (Optional[Iterable[str]]): The keys logged since the document was generated, see
+                stale_metric_keys. Defaults to None, every key is fetched.
+            metric_histories (Optional[Dict[str, List[Metric]]]): The histories already known, e.g. read from a journal,
+                which are not fetched. Defaults to None.
+            max_workers (int): The maximum number of concurrent requests. Defaults to 8.
+
+        Returns:
+            RunSnapshot: The snapshot.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            run_future = pool.submit(client.get_run, run_id) if run is None else None
+            experiment_future = pool.submit(get_experiment, client, experiment_id) if experiment_id is not None else None
+            versions_future = pool.submit(client.search_model_versions, f'run_id="{run_id}"')
+            artifacts_future = pool.submit(traverse_artifact_tree, client, run_id)
+
+            run = run if run is not None else run_future.result()
+            if experiment_future is None or run.info.experiment_id != experiment_id:
+                experiment_future = pool.submit(get_experiment, client, run.info.experiment_id)
+
+            known_histories = metric_histories or {}
+            history_futures = {key: pool.submit(client.get_metric_history, run_id, key)
+                               for key in stale_metric_keys(run, metric_counts, logged_keys) if key not in known_histories}
+            model_versions = list(versions_future.result())
+            model_futures = {name: pool.submit(get_registered_model, client, name) for name in {version.name for version in model_versions}}
+
+            histories = {key: known_histories[key] if key in known_histories else history_futures[key].result()
+                         for key in run.data.metrics if key in known_histories or key in history_futures}
+
+            return cls(run, experiment_future.result(), model_versions, {name: future.result() for name, future in model_futures.items()},
+                       histories, artifacts_future.result(), metric_counts)
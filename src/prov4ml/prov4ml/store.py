@@ -0,0 +1,218 @@
+"""Local multi-run provenance store backed by an embedded SQLite database.
+
+Each document is stored as rows of four indexed tables, inserted in a single transaction:
+
+* records (entities, activities and agents) and relations, with their PROV-JSON attributes;
+* attributes, one row per record attribute with its plain value, indexed by key and value;
+* metrics, one row per ModelEvaluation entity, indexed by metric key.
+
+Cross-run questions are then answered with SQL instead of loading every document, and any single run
+can be exported back to PROV-JSON.
+"""
+import json
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from .query import RELATION_ENDPOINTS, attribute_value, document_run_id, iter_records, iter_relations, metric_key
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    prefix TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    run_id TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    attributes TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_identifier ON records (run_id, identifier);
+CREATE TABLE IF NOT EXISTS relations (
+    run_id TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    subject TEXT,
+    object TEXT,
+    attributes TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS relations_subject ON relations (run_id, subject);
+CREATE INDEX IF NOT EXISTS relations_object ON relations (run_id, object);
+CREATE INDEX IF NOT EXISTS relations_kind ON relations (kind, run_id);
+CREATE TABLE IF NOT EXISTS attributes (
+    run_id TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    number REAL
+);
+CREATE INDEX IF NOT EXISTS attributes_value ON attributes (key, value);
+CREATE INDEX IF NOT EXISTS attributes_record ON attributes (run_id, identifier);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    step INTEGER NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS metrics_key ON metrics (key, run_id);
+"""
+
+_TABLES = ('runs', 'records', 'relations', 'attributes', 'metrics')
+
+def _number(value:Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ProvStore:
+    """Provenance documents of many runs in one SQLite database.
+
+    Args:
+        path (str): The path of the database file, created if it does not exist. Defaults to prov_store.db.
+    """
+    def __init__(self, path:str='prov_store.db'):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute('PRAGMA journal_mode=WAL')    #lets concurrent runs on the same node read while one writes
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self) -> 'ProvStore':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the connection to the database.
+        """
+        self._connection.close()
+
+    def add_document(self, document:Dict[str, Any], run_id:Optional[str]=None) -> str:
+        """
+        Stores a PROV-JSON document in a single transaction, replacing any document previously stored for the same run.
+
+        Args:
+            document (Dict[str, Any]): The document.
+            run_id (Optional[str]): The ID of the run. Defaults to None, the ID found in the document.
+
+        Returns:
+            str: The ID of the run the document was stored for.
+        """
+        run_id = run_id or document_run_id(document)
+        if run_id is None:
+            raise ValueError('The document has no LearningStage entity, a run_id must be provided')
+
+        records, attributes, metrics = [], [], []
+        for kind, identifier, record_attributes in iter_records(document):
+            records.append((run_id, identifier, kind, json.dumps(record_attributes)))
+            plain = {key: attribute_value(value) for key, value in record_attributes.items()}
+            attributes.extend((run_id, identifier, key, str(value), _number(value)) for key, value in plain.items())
+            key = metric_key(identifier, plain) if plain.get('prov-ml:type') == 'ModelEvaluation' else None
+            if key is not None:
+                metrics.append((run_id, key, int(plain['mlflow:step']), _number(plain.get('mlflow:value'))))
+        relations = [(run_id, relation.identifier, relation.kind, relation.subject, relation.object, json.dumps(relation.attributes))
+                     for relation in iter_relations(document)]
+
+        with self._connection:
+            for table in _TABLES:
+                self._connection.execute(f'DELETE FROM {table} WHERE run_id = ?', (run_id,))
+            self._connection.execute('INSERT INTO runs VALUES (?, ?)', (run_id, json.dumps(document.get('prefix', {}))))
+            self._connection.executemany('INSERT INTO records VALUES (?, ?, ?, ?)', records)
+            self._connection.executemany('INSERT INTO relations VALUES (?, ?, ?, ?, ?, ?)', relations)
+            self._connection.executemany('INSERT INTO attributes VALUES (?, ?, ?, ?, ?)', attributes)
+            self._connection.executemany('INSERT INTO metrics VALUES (?, ?, ?, ?)', metrics)
+        return run_id
+
+    def query(self, sql:str, parameters:Tuple=()) -> List[Tuple]:
+        """
+        Runs an arbitrary SQL query against the store.
+
+        Args:
+            sql (str): The query.
+            parameters (Tuple): The query parameters. Defaults to ().
+
+        Returns:
+            List[Tuple]: The resulting rows.
+        """
+        return self._connection.execute(sql, parameters).fetchall()
+
+    def runs(self) -> List[str]:
+        """
+        Returns the IDs of the stored runs.
+        """
+        return [run_id for run_id, in self.query('SELECT run_id FROM runs ORDER BY run_id')]
+
+    def runs_using_dataset(self, digest:str) -> List[str]:
+        """
+        Returns the runs that used a dataset with the given digest.
+
+        Args:
+            digest (str): The MLflow digest of the dataset.
+
+        Returns:
+            List[str]: The IDs of the runs.
+        """
+        return [run_id for run_id, in self.query(
+            "SELECT DISTINCT run_id FROM attributes WHERE key = 'mlflow:digest' AND value = ? ORDER BY run_id", (digest,))]
+
+    def best_metric_per_model_version(self, key:str, objective:str='max') -> List[Tuple[str, str, int, float]]:
+        """
+        Returns the best value of a metric reached by each model version, over all the runs that generated it.
+
+        Args:
+            key (str): The metric key, e.g. test_acc.
+            objective (str): Either max or min. Defaults to max.
+
+        Returns:
+            List[Tuple[str, str, int, float]]: The model version entity, run ID, step and value of each best point.
+        """
+        if objective not in ('max', 'min'):
+            raise ValueError(f"objective must be 'max' or 'min', not {objective!r}")
+        #with a bare MAX/MIN aggregate SQLite returns the other columns from the row holding the extreme value
+        return self.query(f"""
+            SELECT version.identifier, metrics.run_id, metrics.step, {objective.upper()}(metrics.value)
+            FROM metrics JOIN attributes AS version
+                ON version.run_id = metrics.run_id AND version.key = 'mlflow:version'
+            WHERE metrics.key = ?
+            GROUP BY version.identifier
+            ORDER BY version.identifier""", (key,))
+
+    def export_document(self, run_id:str) -> Dict[str, Any]:
+        """
+        Exports the document of a run back to PROV-JSON.
+
+        Args:
+            run_id (str): The ID of the run.
+
+        Returns:
+            Dict[str, Any]: The document.
+        """
+        prefix = self.query('SELECT prefix FROM runs WHERE run_id = ?', (run_id,))
+        if not prefix:
+            raise KeyError(f'No document stored for run {run_id}')
+        document: Dict[str, Any] = {'prefix': json.loads(prefix[0][0])}
+
+        def add(kind:str, identifier:str, attributes:Dict[str, Any]) -> None:
+            section = document.setdefault(kind, {})
+            if identifier not in section:
+                section[identifier] = attributes
+            elif isinstance(section[identifier], list):
+                section[identifier].append(attributes)
+            else:
+                section[identifier] = [section[identifier], attributes]
+
+        for identifier, kind, attributes in self.query(
+                'SELECT identifier, kind, attributes FROM records WHERE run_id = ? ORDER BY rowid', (run_id,)):
+            add(kind, identifier, json.loads(attributes))
+        for identifier, kind, subject, obj, attributes in self.query(
+                'SELECT identifier, kind, subject, object, attributes FROM relations WHERE run_id = ? ORDER BY rowid', (run_id,)):
+            subject_key, object_key = RELATION_ENDPOINTS[kind]
+            endpoints = {key: value for key, value in ((subject_key, subject), (object_key, obj)) if value is not None}
+            add(kind, identifier, {**endpoints, **json.loads(attributes)})
+        return document
@@ -0,0 +1,131 @@
+"""Hyperparameter sweeps: trials run in parallel as nested child runs of a parent run.
+
+run_sweep starts the parent run with start_run, then runs each trial in a worker process of a pool, as a run
+started with start_run and nested under the parent, whose hyperparameters are logged as params. The trials of a
+worker share its resources:
+
+* the connection to the tracking server: MLflow keeps one HTTP session with a connection pool per process, so the
+  trials run by a worker reuse its connections instead of opening new ones;
+* a batched metric writer, created with the worker by the initializer of the pool, with its MLflow client: the
+  trials are started with batch_metrics and each one, in turn, writes its metrics through it, up to 1000 points per
+  request, instead of one request per log_metrics call. The writer is flushed when a trial ends, before the next.
+
+Each trial writes its own document, in ``{output_dir}/trials/{run_id}``. When all of them have ended, the document
+of the parent run is written with, for each trial, its LearningStageExecution, informed by the one of the parent,
+and the hyperparameter entities it used.
+"""
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .buffer import MetricBuffer
+from .prov4ml import LVL_1, LVL_2, _run_states, lv_attr, start_run
+from .records import RecordStore
+
+#the outcome of a trial: result is what the trial function returned, error the exception it raised, if any
+TrialResult = namedtuple('TrialResult', ['index', 'run_id', 'run_name', 'params', 'result', 'error'])
+
+#the batched metric writer of a worker process, shared by the trials it runs
+_writer: Optional[MetricBuffer] = None
+
+def _init_worker(tracking_uri:str) -> None:
+    global _writer
+    import mlflow
+
+    mlflow.set_tracking_uri(tracking_uri)    #with spawn, the worker doesn't inherit it
+    _writer = MetricBuffer(None)
+
+def _run_trial(trial_fn:Callable[[Dict[str, Any]], Any], index:int, params:Dict[str, Any], parent_run_id:str,
+               parent_run_name:str, experiment_id:str, prov_user_namespace:str, run_options:Dict[str, Any]) -> TrialResult:
+    import mlflow
+
+    run_name = f'{parent_run_name}_trial_{index}'
+    run_id = None
+    #nested under the parent run, which is active in forked workers; the tag also covers the spawned ones
+    try:
+        with start_run(prov_user_namespace, experiment_id=experiment_id, run_name=run_name, nested=True,
+                       tags={'mlflow.parentRunId': parent_run_id}, **run_options) as run:
+            run_id = run.info.run_id
+            if _writer is not None:
+                #flushed when the previous trial ended; the points it writes go to the state of this trial
+                state = _run_states[run_id]
+                _writer.run_id, _writer.journal = run_id, state
+                state.buffer = _writer
+            mlflow.log_params(params)
+            result = trial_fn(params)
+    except Exception as error:
+        return TrialResult(index, run_id, run_name, params, None, repr(error))
+    return TrialResult(index, run_id, run_name, params, result, None)
+
+def _link_trials(trials:List[TrialResult], doc:RecordStore, run:Any) -> None:
+    #the trials in the document of the parent run: their executions and the hyperparameters they used
+    parent_activity = doc.get_record(f'{run.info.run_name}_execution')[0]
+    for trial in trials:
+        if trial.run_id is None:
+            continue
+        execution = doc.activity(f'{trial.run_name}_execution', other_attributes={
+            'prov-ml:type': str(lv_attr(LVL_1, 'LearningStageExecution')),
+            'mlflow:run_id': str(lv_attr(LVL_1, trial.run_id)),
+            'mlflow:status': str(lv_attr(LVL_2, 'FAILED' if trial.error is not None else 'FINISHED')),
+            'prov:level': LVL_1,
+        })
+        doc.wasInformedBy(execution, parent_activity, other_attributes={'prov:level': LVL_1})
+        for name, value in trial.params.items():
+            #scoped by trial, the trials share the names of their hyperparameters
+            ent = doc.entity(f'{trial.run_name}/{name}', {
+                'mlflow:value': str(lv_attr(LVL_1, value)),
+                'prov-ml:type': str(lv_attr(LVL_1, 'LearningHyperparameterValue')),
+                'prov:level': LVL_1,
+            })
+            doc.used(execution, ent, other_attributes={'prov:level': LVL_1})
+
+def run_sweep(
+    prov_user_namespace:str,
+    trial_fn:Callable[[Dict[str, Any]], Any],
+    params:Sequence[Dict[str, Any]],
+    experiment_id:Optional[str]=None,
+    run_name:Optional[str]=None,
+    max_workers:Optional[int]=None,
+    multiprocessing_context:Optional[str]=None,
+    **run_options) -> List[TrialResult]:
+    """
+    Runs a hyperparameter sweep: each set of params is a trial, run as a nested child run in a process pool.
+
+    Inside a trial, the run of the trial is the active run: trial_fn logs its metrics with log_metric and
+    log_metrics as any training code started with start_run.
+
+    Args:
+        prov_user_namespace (str): The user namespace for provenance tracking.
+        trial_fn (Callable[[Dict[str, Any]], Any]): The trial, called with its params in a worker process. It must be
+            picklable, i.e. defined at the top level of a module, and so must its result.
+        params (Sequence[Dict[str, Any]]): The hyperparameters of each trial, logged as params of its run.
+        experiment_id (Optional[str]): The ID of the experiment of the runs. Defaults to None, the default experiment.
+        run_name (Optional[str]): The name of the parent run; trials are named {run_name}_trial_{index}. Defaults to
+            None, a generated name.
+        max_workers (Optional[int]): The maximum number of trials run at the same time. Defaults to None, the number of CPUs.
+        multiprocessing_context (Optional[str]): The start method of the workers. Defaults to None, the default start
+            method, which unlike spawn doesn't run the main module of the script again.
+        **run_options: The options of start_run given to the parent run and to the trials, e.g. export_formats or
+            metric_policies; trials are started with batch_metrics unless it is given. The outputs of each trial are
+            written in the trials/{run_id} subdirectory of output_dir.
+
+    Returns:
+        List[TrialResult]: The outcome of each trial, in the order of params.
+    """
+    import mlflow
+
+    with start_run(prov_user_namespace, experiment_id=experiment_id, run_name=run_name, **run_options) as parent:
+        parent_state = _run_states[parent.info.run_id]
+        trial_options = {'batch_metrics': True, **run_options,
+                         'output_dir': os.path.join(parent_state.options['output_dir'], 'trials', '{run_id}')}
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(multiprocessing_context),
+                                 initializer=_init_worker, initargs=(mlflow.get_tracking_uri(),)) as pool:
+            futures = [pool.submit(_run_trial, trial_fn, index, trial_params, parent.info.run_id, parent.info.run_name,
+                                   parent.info.experiment_id, prov_user_namespace, trial_options)
+                       for index, trial_params in enumerate(params)]
+            trials = [future.result() for future in futures]
+        parent_state.builders.append(partial(_link_trials, trials))
+    return trials
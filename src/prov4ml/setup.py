@@ -5,4 +5,5 @@ setup(
     version='1.0.0',
     packages=find_packages(),
     install_requires=[],  # List any dependencies your package requires
+    entry_points={'console_scripts': ['prov4ml=prov4ml.cli:main']},
 )
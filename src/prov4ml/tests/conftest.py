@@ -0,0 +1,15 @@
+"""Fixtures shared by the tests."""
+import pytest
+
+@pytest.fixture
+def tracking(tmp_path, monkeypatch):
+    """A local file store in a temporary directory, which is also the working directory of the test."""
+    import mlflow
+
+    monkeypatch.setenv('MLFLOW_ALLOW_FILE_STORE', 'true')
+    monkeypatch.chdir(tmp_path)
+    mlflow.set_tracking_uri(f'file://{tmp_path}/mlruns')
+    yield mlflow.MlflowClient()
+    while mlflow.active_run() is not None:
+        mlflow.end_run()
+    mlflow.set_tracking_uri(None)
@@ -0,0 +1,61 @@
+"""The awaitable API of prov4ml.aio must not block the event loop while the tracking server answers."""
+import asyncio
+import time
+
+import mlflow
+
+import prov4ml.prov4ml as prov4ml
+from prov4ml.aio import agather_snapshot, alog_metric, alog_metrics
+
+LATENCY = 0.2
+
+class SlowClient:
+    """A tracking client whose every call takes LATENCY seconds, then is answered by the local file store."""
+    def __init__(self, client):
+        self._client = client
+        self.tracking_uri = client.tracking_uri
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def call(*args, **kwargs):
+            time.sleep(LATENCY)
+            return method(*args, **kwargs)
+        return call
+
+async def _ticks_while(awaitable):
+    #the number of times a concurrent coroutine runs, every 10 ms, while the awaitable is awaited
+    ticks = 0
+    done = False
+
+    async def tick():
+        nonlocal ticks
+        while not done:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    result = await awaitable
+    done = True
+    await ticker
+    return ticks, result
+
+def test_logging_does_not_block_the_event_loop(tracking, monkeypatch):
+    client = SlowClient(tracking)
+    monkeypatch.setattr(mlflow, 'MlflowClient', lambda *args, **kwargs: client)
+    with mlflow.start_run() as run:
+        ticks, _ = asyncio.run(_ticks_while(alog_metric('loss', 0.5, prov4ml.Context.TRAINING, step=0)))
+        assert ticks >= LATENCY / 0.01 / 2
+        ticks, _ = asyncio.run(_ticks_while(alog_metrics({'acc': (0.9, prov4ml.Context.EVALUATION)}, step=0)))
+        assert ticks >= LATENCY / 0.01 / 2
+    assert [metric.value for metric in tracking.get_metric_history(run.info.run_id, 'loss')] == [0.5]
+    assert [metric.value for metric in tracking.get_metric_history(run.info.run_id, 'acc')] == [0.9]
+
+def test_snapshot_requests_do_not_block_the_event_loop(tracking):
+    with mlflow.start_run() as run:
+        mlflow.log_metric('loss', 0.5, step=0)
+        mlflow.log_metric('acc', 0.9, step=0)
+    ticks, snapshot = asyncio.run(_ticks_while(agather_snapshot(SlowClient(tracking), run.info.run_id)))
+    #get_run, then the experiment and the histories, at least three round trips
+    assert ticks >= 3 * LATENCY / 0.01 / 2
+    assert sorted(snapshot.metric_histories) == ['acc', 'loss']
@@ -0,0 +1,28 @@
+"""BestEvaluation entities of prov4ml.prov4ml.best_prov, in a run started with start_run and resumed."""
+import json
+
+import prov4ml.prov4ml as prov4ml
+
+def _best_entities():
+    with open('prov_graph.json') as graph:
+        document = json.load(graph)
+    best = [identifier for identifier, attributes in document['entity'].items()
+            if attributes.get('prov-ml:type') == "lv_attr(level='1', value='BestEvaluation')"]
+    members = {(relation['prov:collection'], relation['prov:entity']) for relation in document['hadMember'].values()
+               if relation['prov:collection'] in best}
+    return best, members
+
+def test_best_point_of_a_repeated_step(tracking):
+    with prov4ml.start_run(prov_user_namespace='www.example.org', run_name='run', objectives={'loss': 'min'}):
+        prov4ml.log_metric('loss', 2.0, prov4ml.Context.TRAINING, step=0)
+        prov4ml.log_metric('loss', 1.0, prov4ml.Context.TRAINING, step=0)
+        prov4ml.log_metric('loss', 3.0, prov4ml.Context.TRAINING, step=1)
+    assert _best_entities() == (['loss_best_0'], {('loss_best_0', 'loss_0_1')})
+
+def test_resumed_run_replaces_the_previous_best(tracking):
+    with prov4ml.start_run(prov_user_namespace='www.example.org', run_name='run', objectives={'loss': 'min'}) as run:
+        prov4ml.log_metric('loss', 2.0, prov4ml.Context.TRAINING, step=0)
+    assert _best_entities() == (['loss_best_0'], {('loss_best_0', 'loss_0')})
+    with prov4ml.start_run(prov_user_namespace='www.example.org', run_id=run.info.run_id, objectives={'loss': 'min'}):
+        prov4ml.log_metric('loss', 1.0, prov4ml.Context.TRAINING, step=1)
+    assert _best_entities() == (['loss_best_1'], {('loss_best_1', 'loss_1')})
@@ -0,0 +1,23 @@
+"""Tensor values buffered by prov4ml.buffer.MetricBuffer."""
+import pytest
+
+import prov4ml.prov4ml as prov4ml
+from prov4ml.buffer import MetricBuffer
+
+torch = pytest.importorskip('torch')
+
+def test_buffered_tensors_are_materialized_once(tracking):
+    with prov4ml.start_run(prov_user_namespace='www.example.org', run_name='run') as run:
+        for step in range(5):
+            loss = torch.tensor(1.0 / (step + 1))
+            prov4ml.log_metric('loss', loss, prov4ml.Context.TRAINING, step=step)
+            prov4ml.log_metrics({'acc': (torch.tensor(step / 10, dtype=torch.float64), prov4ml.Context.EVALUATION)}, step=step)
+            loss += 1    #updated in place after logging, the logged value must not change
+        before = MetricBuffer.materializations
+        prov4ml.flush_metrics()
+        assert MetricBuffer.materializations == before + 1    #one transfer for the ten values, all on the CPU
+
+        history = {key: [(metric.step, metric.value) for metric in tracking.get_metric_history(run.info.run_id, key)]
+                   for key in ('loss', 'acc')}
+    assert history['loss'] == [(step, pytest.approx(1.0 / (step + 1))) for step in range(5)]
+    assert history['acc'] == [(step, pytest.approx(step / 10)) for step in range(5)]
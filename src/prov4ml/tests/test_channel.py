@@ -0,0 +1,42 @@
+"""Failed writes of prov4ml.channel.MetricChannel."""
+import time
+
+import mlflow
+import pytest
+
+from prov4ml.channel import MetricChannel
+
+class FlakyClient:
+    """A tracking client whose first log_batch calls fail."""
+    def __init__(self, failures):
+        self.failures = failures
+        self.logged = []
+
+    def log_batch(self, run_id, metrics=(), params=(), tags=()):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('tracking server unavailable')
+        self.logged.extend((metric.key, metric.value, metric.step) for metric in metrics)
+
+def _channel(monkeypatch, client):
+    monkeypatch.setattr(mlflow, 'MlflowClient', lambda: client)
+    channel = MetricChannel('r0', 'DATA_PREPARATION', flush_interval=0.01)
+    channel.start()
+    return channel
+
+def test_failed_writes_are_retried(monkeypatch):
+    client = FlakyClient(failures=2)
+    channel = _channel(monkeypatch, client)
+    channel.log_metric('decode_time', 1.0, step=0)
+    channel.log_metric('decode_time', 2.0, step=1)
+    time.sleep(0.5)    #two failed flushes, then a successful one
+    channel.close()
+    assert client.logged == [('decode_time', 1.0, 0), ('decode_time', 2.0, 1)]
+
+def test_close_raises_if_metrics_were_not_written(monkeypatch):
+    client = FlakyClient(failures=10 ** 6)
+    channel = _channel(monkeypatch, client)
+    channel.log_metric('decode_time', 1.0, step=0)
+    with pytest.raises(RuntimeError, match='1 metrics') as raised:
+        channel.close()
+    assert isinstance(raised.value.__cause__, ConnectionError)
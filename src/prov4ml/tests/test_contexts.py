@@ -0,0 +1,89 @@
+"""Writing of the context index of prov4ml.contexts, which logging must never wait for."""
+import json
+import time
+from collections import namedtuple
+
+import mlflow
+
+import prov4ml.prov4ml as prov4ml
+from prov4ml.contexts import CONTEXTS_TAG, ContextIndex, IndexWriter
+
+Metric = namedtuple('Metric', ['key', 'value', 'timestamp', 'step'])
+
+class RecordingClient:
+    """A tracking client that records the tags and artifacts it is asked to write."""
+    def __init__(self):
+        self.calls = []
+
+    def set_tag(self, run_id, key, value):
+        self.calls.append(('set_tag', key, value))
+
+    def log_artifact(self, run_id, path, artifact_path):
+        self.calls.append(('log_artifact', artifact_path))
+
+def test_writer_writes_a_change_once_after_the_interval():
+    index = ContextIndex()
+    client = RecordingClient()
+    writer = IndexWriter('r0', lambda: index, interval=0.1, client=client)
+    index.add_points([Metric('loss', 1.0, 1000, 0)], ['TRAINING'])
+    writer.mark()
+    writer.mark()
+    assert client.calls == []
+    time.sleep(0.3)
+    assert [call[:2] for call in client.calls] == [('set_tag', CONTEXTS_TAG)]
+    writer.close()
+    assert len(client.calls) == 2    #closing writes the steps logged since in any case
+
+def test_unmanaged_runs_write_the_tag_only_for_new_keys(tracking):
+    client = RecordingClient()
+    with mlflow.start_run() as run:
+        tags = prov4ml._context_tags(client, run.info.run_id, [Metric('loss', 1.0, 1000, 0)], ['TRAINING'])
+        assert [tag.key for tag in tags] == [CONTEXTS_TAG]
+        assert prov4ml._context_tags(client, run.info.run_id, [Metric('loss', 1.0, 1001, 1)], ['TRAINING']) == []
+        #an index too large for a tag is uploaded by the writer, not by the call logging the metrics
+        metrics = [Metric(f'metric_with_a_long_name_{i}', 1.0, 1002, 2) for i in range(500)]
+        assert prov4ml._context_tags(client, run.info.run_id, metrics, ['TRAINING'] * len(metrics)) == []
+        assert client.calls == []
+        prov4ml._unmanaged_contexts.pop(run.info.run_id)[1].close()
+        assert [call[0] for call in client.calls] == ['log_artifact', 'set_tag']
+
+def test_managed_runs_write_the_index_when_flushed(tracking):
+    with prov4ml.start_run(prov_user_namespace='www.example.org', run_name='run') as run:
+        prov4ml.log_metric('loss', 1.0, prov4ml.Context.TRAINING, step=0)
+        assert CONTEXTS_TAG not in tracking.get_run(run.info.run_id).data.tags
+        prov4ml.flush_metrics()
+        assert CONTEXTS_TAG in tracking.get_run(run.info.run_id).data.tags
+        prov4ml.log_metric('loss', 1.0, prov4ml.Context.TRAINING, step=1)
+    index = json.loads(tracking.get_run(run.info.run_id).data.tags[CONTEXTS_TAG])
+    assert index['keys'] == {'loss': {'TRAINING': [[0, 1, 1]]}}
+
+def _index(points):
+    index = ContextIndex()
+    for step, context in points:
+        index.add('loss', context, step)
+    return index
+
+def test_the_order_of_shared_steps_takes_constant_space():
+    index = _index([(step, context) for step in range(1000) for context in ('TRAINING', 'VALIDATION')])
+    assert index.to_json()['shared'] == {'loss': [[0, 999, 1, [['TRAINING', 1], ['VALIDATION', 1]]]]}
+    resolve = ContextIndex.from_json(index.to_json()).resolver('loss')
+    assert [resolve(500, n) for n in range(2)] == ['TRAINING', 'VALIDATION']
+
+def test_repeated_identifiers_follow_the_order_of_their_step():
+    #step 0 is logged again in TRAINING after step 1; evaluation only every other step
+    index = _index([(0, 'TRAINING'), (0, 'VALIDATION'), (1, 'TRAINING'), (0, 'TRAINING'), (2, 'TRAINING'), (2, 'VALIDATION')])
+    for resolve in (index.resolver('loss'), ContextIndex.from_json(index.to_json()).resolver('loss')):
+        assert [resolve(0, n) for n in range(3)] == ['TRAINING', 'VALIDATION', 'TRAINING']
+        assert resolve(1, 0) == 'TRAINING'
+        assert [resolve(2, n) for n in range(2)] == ['TRAINING', 'VALIDATION']
+
+def test_points_of_shared_steps_are_generated_by_their_context(tracking):
+    with prov4ml.start_run(prov_user_namespace='www.example.org', run_name='run'):
+        for step in range(3):
+            prov4ml.log_metric('loss', 1.0, prov4ml.Context.TRAINING, step=step)
+            prov4ml.log_metric('loss', 2.0, prov4ml.Context.VALIDATION, step=step)
+    with open('prov_graph.json') as graph:
+        document = json.load(graph)
+    generated = {(relation['prov:entity'], relation['prov:activity']) for relation in document['wasGeneratedBy'].values()
+                 if relation['prov:activity'] != 'run_execution'}
+    assert {('loss_1', 'train_step_1'), ('loss_1_1', 'val_step_1'), ('loss_2_1', 'val_step_2')} <= generated
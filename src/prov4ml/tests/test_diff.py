@@ -0,0 +1,33 @@
+"""Metric series of prov4ml.diff.diff_documents."""
+from prov4ml.diff import diff_documents
+
+def _point(key, step, value):
+    return {
+        'prov-ml:type': 'ModelEvaluation',
+        'mlflow:key': f"lv_attr(level='1', value='{key}')",
+        'mlflow:value': f"lv_attr(level='1', value={value})",
+        'mlflow:step': f"lv_attr(level='1', value={step})",
+    }
+
+def _document(run_id, offset):
+    #layer logged twice at step 3, then layer_3 at step 3; top at steps 0 and 5, then top_5 at step 5
+    return {'entity': {
+        run_id: {'prov-ml:type': "lv_attr(level='1', value='LearningStage')", 'mlflow:run_id': f"lv_attr(level='1', value='{run_id}')"},
+        'layer_3': _point('layer', 3, 1.0),
+        'layer_3_1': _point('layer', 3, 2.0),
+        'layer_3_3': _point('layer_3', 3, 10.0 + offset),
+        'top_0': _point('top', 0, 0.1),
+        'top_5': _point('top', 5, 0.2),
+        'top_5_5': _point('top_5', 5, 0.5 + offset),
+    }}
+
+def test_metrics_are_keyed_by_their_attributes():
+    diff = diff_documents(_document('r0', 0.0), _document('r1', 1.0))
+    assert {key: (metric.points, metric.final_values) for key, metric in diff.metrics.items()} == {
+        'layer': ((1, 1), (1.0, 1.0)),
+        'layer_3': ((1, 1), (10.0, 11.0)),
+        'top': ((2, 2), (0.2, 0.2)),
+        'top_5': ((1, 1), (0.5, 1.5)),
+    }
+    assert diff.metrics['layer_3'].first_divergent_step == 3
+    assert diff.metrics['layer'].max_abs_difference == 0.0
@@ -0,0 +1,18 @@
+"""Metric events of prov4ml.events.ProvEventStream, in a run started with start_run."""
+import json
+
+import prov4ml.prov4ml as prov4ml
+
+def test_metric_events_are_named_as_in_the_document(tracking):
+    events = []
+    with prov4ml.start_run(prov_user_namespace='www.example.org', run_name='run', events=events.extend):
+        #step 0 is logged again after step 1, then once more right after itself
+        for step in (0, 1, 0, 0):
+            prov4ml.log_metric('loss', float(step), prov4ml.Context.TRAINING, step=step)
+    published = {event['id']: event['attributes']['mlflow:key'] for event in events
+                 if event['kind'] == 'entity' and event['attributes'].get('prov-ml:type') == 'ModelEvaluation'}
+    assert published == {'loss_0': 'loss', 'loss_1': 'loss', 'loss_0_1': 'loss', 'loss_0_2': 'loss'}
+
+    with open('prov_graph.json') as graph:
+        document = json.load(graph)
+    assert sorted(identifier for identifier in document['entity'] if identifier.startswith('loss_')) == sorted(published)
@@ -0,0 +1,32 @@
+"""Rendering of the exports by prov4ml.export.submit_exports."""
+import os
+
+from prov4ml import export
+from prov4ml.records import RecordStore
+
+def _document(tmp_path, name):
+    document = RecordStore()
+    document.set_default_namespace('www.example.org')
+    document.entity('dataset', {'prov:level': '1'})
+    document.activity('run_execution', {'prov:level': '1'})
+    document.used('run_execution', 'dataset')
+    path = str(tmp_path / f'{name}.json')
+    with open(path, 'w') as output:
+        document.serialize(output)
+    return path
+
+def test_single_format_is_rendered_in_process(tmp_path):
+    pools = dict(export._pools)
+    first = export.submit_exports(_document(tmp_path, 'first'), ['dot'])
+    second = export.submit_exports(_document(tmp_path, 'second'), ['dot'])
+    assert os.path.exists(first['dot'].result()) and os.path.exists(second['dot'].result())
+    assert export._renderer is not None and export._pools == pools
+
+def test_several_formats_reuse_the_pool(tmp_path):
+    first = export.submit_exports(_document(tmp_path, 'first'), ['dot', 'provn'])
+    pools = dict(export._pools)
+    second = export.submit_exports(_document(tmp_path, 'second'), ['dot', 'provn'])
+    assert export._pools == pools and len(pools) == 1
+    for futures in (first, second):
+        assert sorted(os.path.basename(future.result()) for future in futures.values())[0].endswith('.dot')
+    assert os.path.exists(tmp_path / 'second.provn')
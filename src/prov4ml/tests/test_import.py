@@ -0,0 +1,17 @@
+"""Guards the import time of prov4ml.prov4ml: the heavy dependencies must only be imported when they are used."""
+import os
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#mlflow, prov and pydot take over a second to import, prov4ml.prov4ml alone tens of milliseconds (benchmarks/bench_import.py)
+LAZY_MODULES = ('mlflow', 'prov', 'pydot')
+
+def test_import_is_lazy():
+    #a fresh interpreter, so that no other test has imported them already
+    loaded = subprocess.run(
+        [sys.executable, '-c', f'import sys, prov4ml.prov4ml; print(" ".join(m for m in {LAZY_MODULES!r} if m in sys.modules))'],
+        cwd=PACKAGE_DIR, capture_output=True, text=True, check=True,
+    ).stdout.split()
+    assert loaded == [], f'importing prov4ml.prov4ml imports {", ".join(loaded)}'
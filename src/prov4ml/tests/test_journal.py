@@ -0,0 +1,54 @@
+"""Segments and checkpoints of prov4ml.journal.Journal."""
+import os
+from collections import namedtuple
+
+from prov4ml.journal import Journal, pending_runs
+
+Metric = namedtuple('Metric', ['key', 'value', 'timestamp', 'step'])
+
+def _journal(tmp_path, points):
+    #points of loss in TRAINING and acc in EVALUATION, appended two by two, three per segment
+    journal = Journal('r0', {'resumed': False}, journal_dir=str(tmp_path), segment_size=3)
+    for step in range(points // 2):
+        journal.append_metrics([Metric('loss', 1.0 / (step + 1), 1000 + step, step), Metric('acc', step / 10, 1000 + step, step)],
+                               ['TRAINING', 'EVALUATION'])
+    journal.close()
+    return journal
+
+def _expected(points):
+    return {
+        'loss': [(1.0 / (step + 1), step, 1000 + step) for step in range(points // 2)],
+        'acc': [(step / 10, step, 1000 + step) for step in range(points // 2)],
+    }
+
+def test_read_returns_every_point(tmp_path):
+    _journal(tmp_path, 10)
+    header, contexts, histories = Journal.read('r0', str(tmp_path))
+    assert header == {'resumed': False}
+    assert histories == _expected(10)
+    assert contexts.resolver('loss')(4, 0) == 'TRAINING'
+    assert contexts.resolver('acc')(4, 0) == 'EVALUATION'
+
+def test_read_starts_from_the_checkpoints(tmp_path):
+    _journal(tmp_path, 10)
+    names = sorted(os.listdir(tmp_path))
+    assert 'r0.0.checkpoint.json' in names and 'r0.1.checkpoint.json' in names and 'r0.0.jsonl' in names
+    #the sealed segments are kept, but not replayed when a checkpoint covers them
+    for name in names:
+        if name.endswith('.jsonl') and name != 'r0.jsonl':
+            with open(tmp_path / name, 'w') as segment:
+                segment.write('{"metrics": [["loss", 99.0, 99, 99, "TRAINING"]]}\n')
+    assert Journal.read('r0', str(tmp_path))[2] == _expected(10)
+
+def test_segments_after_the_last_checkpoint_are_replayed(tmp_path):
+    _journal(tmp_path, 10)
+    os.remove(tmp_path / 'r0.1.checkpoint.json')    #the process died after sealing the segment
+    header, contexts, histories = Journal.read('r0', str(tmp_path))
+    assert histories == _expected(10)
+    assert contexts.resolver('acc')(2, 0) == 'EVALUATION'
+
+def test_discard_removes_every_file(tmp_path):
+    journal = _journal(tmp_path, 10)
+    assert pending_runs(str(tmp_path)) == ['r0']
+    journal.remove()
+    assert os.listdir(tmp_path) == []
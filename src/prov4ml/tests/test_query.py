@@ -0,0 +1,35 @@
+"""Attribute filters of prov4ml.query.ProvIndex."""
+from prov4ml.query import ProvIndex
+
+#a resumed run whose LearningStage entity was written again with another status
+DOCUMENT = {
+    'entity': {
+        'run': {
+            'prov-ml:type': "lv_attr(level='1', value='LearningStage')",
+            'mlflow:run_id': "lv_attr(level='1', value='r0')",
+            'mlflow:status': ["lv_attr(level='1', value='KILLED')", "lv_attr(level='1', value='FINISHED')"],
+        },
+        'loss_0': {
+            'prov-ml:type': 'ModelEvaluation',
+            'mlflow:status': {'$': 'FINISHED', 'type': 'xsd:string'},
+        },
+    },
+}
+
+def test_find_indexes_each_value_of_a_list_attribute():
+    index = ProvIndex(DOCUMENT)
+    assert index.find(attributes={'mlflow:status': 'KILLED'}) == ['run']
+    assert sorted(index.find(attributes={'mlflow:status': 'FINISHED'})) == ['loss_0', 'run']
+    assert index.attributes('run')['mlflow:status'] == ['KILLED', 'FINISHED']
+
+def test_traversal_filter_matches_any_value_of_a_list_attribute():
+    document = dict(DOCUMENT, wasGeneratedBy={'_:id1': {'prov:entity': 'loss_0', 'prov:activity': 'run'}})
+    index = ProvIndex(document)
+    assert index.upstream('loss_0', attributes={'mlflow:status': 'KILLED'}) == ['run']
+
+def test_attribute_index_is_updated_by_later_documents():
+    index = ProvIndex()
+    index.add({'entity': {'a': {'mlflow:status': 'FINISHED'}}})
+    assert index.find(attributes={'mlflow:status': 'FINISHED'}) == ['a']
+    index.add(DOCUMENT, scope='r0')
+    assert index.find(attributes={'mlflow:status': 'KILLED'}) == ['r0/run']
@@ -0,0 +1,33 @@
+"""Sampling policies of prov4ml.sampling.MetricSampler, in a run started with start_run."""
+import json
+
+import prov4ml.prov4ml as prov4ml
+from prov4ml.sampling import MetricSampler, Window
+
+def test_windows_do_not_mix_contexts(tracking):
+    with prov4ml.start_run(prov_user_namespace='www.example.org', run_name='run', metric_policies={'loss': prov4ml.Window(2)}) as run:
+        for step in range(2):
+            prov4ml.log_metric('loss', 1.0, prov4ml.Context.TRAINING, step=step)
+            prov4ml.log_metric('loss', 100.0, prov4ml.Context.VALIDATION, step=step)
+        assert prov4ml.metric_counts() == {'loss': (4, 2)}
+    history = tracking.get_metric_history(run.info.run_id, 'loss')
+    assert sorted((metric.step, metric.value) for metric in history) == [(1, 1.0), (1, 100.0)]
+
+    with open('prov_graph.json') as graph:
+        document = json.load(graph)
+    generated = {relation['prov:entity']: relation['prov:activity'] for relation in document['wasGeneratedBy'].values()
+                 if relation['prov:activity'] != 'run_execution'}
+    by_value = {attributes['mlflow:value']: identifier for identifier, attributes in document['entity'].items()
+                if identifier.startswith('loss_')}
+    assert generated[by_value["lv_attr(level='1', value=1.0)"]] == 'train_step_1'
+    assert generated[by_value["lv_attr(level='1', value=100.0)"]] == 'val_step_1'
+    assert all(document['entity'][identifier]['prov-ml:step_range'] == "lv_attr(level='1', value=[0, 1])" for identifier in by_value.values())
+
+def test_incomplete_windows_are_flushed_in_their_context():
+    sampler = MetricSampler({'loss': Window(3)})
+    assert sampler.add('loss', 1.0, 0, 1000, 'TRAINING') is None
+    assert sampler.add('loss', 100.0, 0, 1000, 'VALIDATION') is None
+    assert sampler.add('loss', 3.0, 1, 1001, 'TRAINING') is None
+    assert sorted(sampler.flush()) == [('loss', 2.0, 1, 1001, 'TRAINING'), ('loss', 100.0, 0, 1000, 'VALIDATION')]
+    assert sampler.step_ranges == {('loss', 'TRAINING'): {1: 0}, ('loss', 'VALIDATION'): {0: 0}}
+    assert sampler.counts == {'loss': (3, 2)}
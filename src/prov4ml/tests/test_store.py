@@ -0,0 +1,43 @@
+"""Metric rows of prov4ml.store.ProvStore."""
+from prov4ml.store import ProvStore
+
+def _point(key, step, value, with_key=True):
+    attributes = {
+        'prov-ml:type': 'ModelEvaluation',
+        'mlflow:value': f"lv_attr(level='1', value={value})",
+        'mlflow:step': f"lv_attr(level='1', value={step})",
+    }
+    if with_key:
+        attributes['mlflow:key'] = f"lv_attr(level='1', value='{key}')"
+    return attributes
+
+def _document(entities):
+    return {'entity': {
+        'run': {'prov-ml:type': "lv_attr(level='1', value='LearningStage')", 'mlflow:run_id': "lv_attr(level='1', value='r0')"},
+        **entities,
+    }}
+
+def _metrics(store):
+    return store.query('SELECT key, step, value FROM metrics ORDER BY key, step, value')
+
+def test_repeated_steps_are_stored(tmp_path):
+    #loss logged three times at step 0 (log_metric without a step), top_5 once at step 5
+    document = _document({
+        'loss_0': _point('loss', 0, 1.0),
+        'loss_0_1': _point('loss', 0, 2.0),
+        'loss_0_2': _point('loss', 0, 3.0),
+        'top_5_5': _point('top_5', 5, 0.5),
+    })
+    with ProvStore(str(tmp_path / 'store.db')) as store:
+        store.add_document(document)
+        assert _metrics(store) == [('loss', 0, 1.0), ('loss', 0, 2.0), ('loss', 0, 3.0), ('top_5', 5, 0.5)]
+
+def test_documents_without_the_key_attribute_are_parsed(tmp_path):
+    document = _document({
+        'loss_0': _point('loss', 0, 1.0, with_key=False),
+        'loss_0_1': _point('loss', 0, 2.0, with_key=False),
+        'top_5_5': _point('top_5', 5, 0.5, with_key=False),
+    })
+    with ProvStore(str(tmp_path / 'store.db')) as store:
+        store.add_document(document)
+        assert _metrics(store) == [('loss', 0, 1.0), ('loss', 0, 2.0), ('top_5', 5, 0.5)]
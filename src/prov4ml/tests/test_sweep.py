@@ -0,0 +1,20 @@
+"""Trials of prov4ml.sweep.run_sweep."""
+import os
+
+import prov4ml.prov4ml as prov4ml
+from prov4ml import sweep
+
+def trial(params):
+    for step in range(3):
+        prov4ml.log_metrics({'loss': (params['lr'] * step, prov4ml.Context.TRAINING)}, step=step)
+    buffer = prov4ml._active_run_state().buffer
+    return os.getpid(), id(buffer), buffer is sweep._writer
+
+def test_trials_of_a_worker_share_its_writer(tracking):
+    trials = prov4ml.run_sweep('www.example.org', trial, [{'lr': 0.1}, {'lr': 0.2}, {'lr': 0.3}], run_name='sweep',
+                               max_workers=1, multiprocessing_context='fork', export_formats=())
+    assert [trial.error for trial in trials] == [None, None, None]
+    assert len({trial.result for trial in trials}) == 1 and trials[0].result[2]
+    for index, trial_result in enumerate(trials):
+        history = tracking.get_metric_history(trial_result.run_id, 'loss')
+        assert [(metric.step, metric.value) for metric in history] == [(step, (index + 1) / 10 * step) for step in range(3)]